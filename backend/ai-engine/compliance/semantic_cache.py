@@ -0,0 +1,206 @@
+"""
+Semantic near-duplicate cache for compliance classification
+Live editing re-validates copy on every keystroke, and most edits are tiny
+(punctuation, casing, "today" -> "now"). Texts are embedded as hashed
+character n-gram vectors (no model call), and a cached classification is
+reused when its text is similar enough and the edit adds no content word
+the cached text lacks: n-gram similarity alone stays high for edits such
+as adding "clinically proven" or "not", which change the verdict. A sample
+of hits is re-run through the full model to measure how often the reused
+answer agrees.
+"""
+
+import os
+import random
+import re
+import threading
+import zlib
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "false").lower() in ("1", "true", "yes")
+# Cosine similarity (of the content words) above which a cached classification is reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.97))
+# Content words the edit may remove from the cached text (it may never add any)
+SEMANTIC_CACHE_MAX_DROPPED_WORDS = int(os.getenv("SEMANTIC_CACHE_MAX_DROPPED_WORDS", 0))
+# Entries kept (oldest evicted first); each holds a 4KB vector
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 5000))
+# Share of semantic hits re-classified by the full model to measure agreement
+SEMANTIC_CACHE_VERIFY_RATE = float(os.getenv("SEMANTIC_CACHE_VERIFY_RATE", 0.05))
+EMBEDDING_DIM = 1024
+NGRAM_SIZES = (3, 4, 5)
+
+_TOKEN = re.compile(r"[a-z0-9£$€%]+")
+
+# Words that can be added or removed without changing a claim. Negations
+# ("not", "no", "never", "without") are deliberately not in here.
+STOPWORDS = frozenset((
+    "a", "an", "the", "and", "or", "at", "in", "on", "of", "to", "for", "with", "from", "by",
+    "our", "your", "its", "this", "that", "these", "those", "is", "are", "it", "here", "just"
+))
+
+# Interchangeable words, mapped to one spelling before comparing
+SYNONYMS = {
+    "today": "now",
+    "buy": "shop",
+    "purchase": "shop",
+    "stores": "store"
+}
+
+
+def normalize_text(text):
+    """Lowercase words and numbers only, so punctuation/casing edits hit exactly"""
+    return " ".join(_TOKEN.findall(text.lower()))
+
+
+def content_words(normalized):
+    """Words that carry the claim, in order, with synonyms unified"""
+    return [SYNONYMS.get(word, word) for word in normalized.split() if word not in STOPWORDS]
+
+
+def embed(text, dim=EMBEDDING_DIM):
+    """
+    Signed feature-hashed character n-grams (plus whole words), L2-normalized
+
+    Args:
+        text: Normalized text
+        dim: Vector size
+
+    Returns:
+        float32 vector; texts sharing most n-grams have cosine close to 1
+    """
+    padded = f" {text} "
+    grams = [padded[i:i + n] for n in NGRAM_SIZES for i in range(len(padded) - n + 1)]
+    grams += text.split()
+
+    hashes = np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint32, count=len(grams))
+    signs = ((hashes >> 31) & 1).astype(np.float32) * 2 - 1
+    vector = np.bincount(hashes % dim, weights=signs, minlength=dim).astype(np.float32)
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Classifications keyed by text, with exact and nearest-neighbour lookup
+
+    The index is a fixed-size matrix of unit vectors filled as a ring, so a
+    lookup is one matrix-vector product over the cached entries.
+    """
+
+    def __init__(self, size=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 verify_rate=SEMANTIC_CACHE_VERIFY_RATE, max_dropped_words=SEMANTIC_CACHE_MAX_DROPPED_WORDS):
+        self.size = size
+        self.threshold = threshold
+        self.verify_rate = verify_rate
+        self.max_dropped_words = max_dropped_words
+        self._vectors = np.zeros((size, EMBEDDING_DIM), dtype=np.float32)
+        self._keys = [None] * size
+        self._words = [None] * size
+        self._texts = [None] * size
+        self._results = [None] * size
+        self._slots = {}  # normalized text -> slot
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.rejected_edits = 0
+        self.misses = 0
+        self.verified = 0
+        self.agreed = 0
+
+    def lookup(self, text):
+        """
+        Cached classification for text or a near-duplicate of it
+
+        Returns:
+            (result, match info) or (None, None) on a miss; match info has
+            "match" (exact or semantic), "similarity" and "cached_text"
+        """
+        normalized = normalize_text(text)
+        words = content_words(normalized)
+        vector = embed(" ".join(words))
+
+        with self._lock:
+            slot = self._slots.get(normalized)
+            if slot is not None:
+                self.exact_hits += 1
+                return self._results[slot], {"match": "exact", "similarity": 1.0,
+                                             "cached_text": self._texts[slot]}
+
+            if self._count:
+                similarities = self._vectors[:self._count] @ vector
+                slot = int(np.argmax(similarities))
+                similarity = float(similarities[slot])
+                if similarity >= self.threshold and not self._changes_claim(words, self._words[slot]):
+                    self.semantic_hits += 1
+                    return self._results[slot], {"match": "semantic", "similarity": round(similarity, 3),
+                                                 "cached_text": self._texts[slot]}
+                if similarity >= self.threshold:
+                    self.rejected_edits += 1
+
+            self.misses += 1
+            return None, None
+
+    def _changes_claim(self, words, cached_words):
+        """True if the edit adds a content word, or drops more than allowed"""
+        words, cached_words = set(words), set(cached_words)
+        return bool(words - cached_words) or len(cached_words - words) > self.max_dropped_words
+
+    def add(self, text, result):
+        normalized = normalize_text(text)
+        words = content_words(normalized)
+        vector = embed(" ".join(words))
+
+        with self._lock:
+            if normalized in self._slots:
+                self._results[self._slots[normalized]] = result
+                return
+
+            slot = self._next
+            if self._keys[slot] is not None:
+                del self._slots[self._keys[slot]]
+
+            self._vectors[slot] = vector
+            self._keys[slot] = normalized
+            self._words[slot] = words
+            self._texts[slot] = text
+            self._results[slot] = result
+            self._slots[normalized] = slot
+            self._next = (slot + 1) % self.size
+            self._count = min(self._count + 1, self.size)
+
+    def should_verify(self, match):
+        """Sample semantic hits for a full-model agreement check"""
+        return match["match"] == "semantic" and random.random() < self.verify_rate
+
+    def record_agreement(self, cached, fresh):
+        with self._lock:
+            self.verified += 1
+            if cached["label"] == fresh["label"]:
+                self.agreed += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "enabled": True,
+                "entries": self._count,
+                "capacity": self.size,
+                "threshold": self.threshold,
+                "lookups": lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                # Similar texts not reused because the edit added (or dropped) words
+                "rejected_edits": self.rejected_edits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                # Verified hits still ran the model
+                "model_calls_saved": hits - self.verified,
+                "verified": self.verified,
+                "agreement_rate": round(self.agreed / self.verified, 3) if self.verified else None
+            }
@@ -5,6 +5,8 @@ import logger from '../../utils/logger.js';
 import axios from 'axios';
 import FormData from 'form-data';
 
+const IMAGE_SERVICE_URL = process.env.IMAGE_SERVICE_URL || 'http://localhost:8000';
+
 /**
  * Generate a complete ad: Background + Layout + Copy
  */
@@ -35,42 +37,91 @@ export async function generateCompleteAd(req, res) {
     });
 
     const results = {
+      composite: null,
       background: null,
       layout: null,
       copy: null,
       processingSteps: []
     };
 
-    // Step 1: Generate Background
+    const backgroundPrompt = `${style || 'modern'} background for ${category || 'product'} advertisement, professional, high quality, suitable for retail`;
+
+    // Step 1: Compose the ad image (background removal, background, composite, encode)
+    // in a single image-service request instead of one hop per stage.
+    // results.composite is the finished ad with the product on it
     try {
-      logger.info('Step 1: Generating background');
-      const backgroundPrompt = `${style || 'modern'} background for ${category || 'product'} advertisement, professional, high quality, suitable for retail`;
-      
+      logger.info('Step 1: Composing ad image');
+
+      const productResponse = await axios.get(productImageUrl, {
+        responseType: 'arraybuffer',
+        timeout: 30000
+      });
+
       const formData = new FormData();
+      formData.append('file', Buffer.from(productResponse.data), 'product.png');
       formData.append('prompt', backgroundPrompt);
       formData.append('style', style || 'professional');
       formData.append('width', 1080);
       formData.append('height', 1080);
 
-      const bgResponse = await axios.post(
-        'http://localhost:8000/process/generate-background',
+      const composeResponse = await axios.post(
+        `${IMAGE_SERVICE_URL}/process/compose-ad`,
         formData,
         {
           headers: formData.getHeaders(),
-          timeout: 60000
+          timeout: 120000,
+          maxContentLength: Infinity,
+          maxBodyLength: Infinity
         }
       );
 
-      if (bgResponse.data.success) {
-        results.background = {
-          url: `http://localhost:8000${bgResponse.data.download_url}`,
-          metadata: bgResponse.data.metadata
+      if (composeResponse.data.success) {
+        results.composite = {
+          url: `${IMAGE_SERVICE_URL}${composeResponse.data.download_url}`,
+          metadata: composeResponse.data.metadata
         };
-        results.processingSteps.push({ step: 'background', success: true });
+        results.processingSteps.push({
+          step: 'composite',
+          success: true,
+          timingsMs: composeResponse.data.metadata.timings_ms
+        });
+      }
+    } catch (composeError) {
+      logger.warn('Ad composition failed', composeError);
+      results.processingSteps.push({ step: 'composite', success: false, error: composeError.message });
+    }
+
+    // Fallback: without a composite (e.g. the product image couldn't be
+    // downloaded) still return a background on its own
+    if (!results.composite) {
+      try {
+        logger.info('Step 1b: Generating background only');
+        const formData = new FormData();
+        formData.append('prompt', backgroundPrompt);
+        formData.append('style', style || 'professional');
+        formData.append('width', 1080);
+        formData.append('height', 1080);
+
+        const bgResponse = await axios.post(
+          `${IMAGE_SERVICE_URL}/process/generate-background`,
+          formData,
+          {
+            headers: formData.getHeaders(),
+            timeout: 60000
+          }
+        );
+
+        if (bgResponse.data.success) {
+          results.background = {
+            url: `${IMAGE_SERVICE_URL}${bgResponse.data.download_url}`,
+            metadata: bgResponse.data.metadata
+          };
+          results.processingSteps.push({ step: 'background', success: true });
+        }
+      } catch (bgError) {
+        logger.warn('Background generation failed', bgError);
+        results.processingSteps.push({ step: 'background', success: false, error: bgError.message });
       }
-    } catch (bgError) {
-      logger.warn('Background generation failed', bgError);
-      results.processingSteps.push({ step: 'background', success: false, error: bgError.message });
     }
 
     // Step 2: Generate Layout
@@ -177,7 +177,7 @@ export async function optimizeImage(req, res) {
 export async function generateBackground(req, res) {
   const startTime = Date.now();
   try {
-    const { prompt, style, width, height } = req.body;
+    const { prompt, style, width, height, engine, palette, seed, deterministic } = req.body;
     
     if (!prompt) {
       return res.status(400).json({ success: false, error: { message: 'Prompt is required' } });
@@ -192,6 +192,12 @@ export async function generateBackground(req, res) {
     formData.append('width', width || 1024);
     formData.append('height', height || 1024);
 
+    // Optional: local procedural engine, brand palette, reproducible output
+    if (engine) formData.append('engine', engine);
+    if (palette) formData.append('palette', Array.isArray(palette) ? palette.join(',') : palette);
+    if (seed !== undefined) formData.append('seed', seed);
+    if (deterministic) formData.append('deterministic', 'true');
+
     const response = await axios.post(
       `${IMAGE_SERVICE_URL}/process/generate-background`,
       formData,
@@ -0,0 +1,440 @@
+"""
+Image processing benchmark
+
+Generates synthetic packshots at several resolutions and formats (including
+alpha) and times every image_processing stage on them. Each stage/image
+case runs in a fresh subprocess so its peak RSS is its own.
+
+    python benchmark-image-processing.py --stub-model --output bench.json
+    python benchmark-image-processing.py --compare bench.json --output new.json
+    python benchmark-image-processing.py --backends pil,vips --stages optimize,renditions
+
+--stub-model swaps the U2-Net session for a cheap saliency mask so runs
+don't need the model download and measure everything around inference.
+The standard tier goes through rembg.remove on that mask, or through a
+plain cutout when rembg isn't installed.
+--backends runs the resize/encode stages once per imaging backend
+(IMAGING_BACKEND in the case's subprocess), for side-by-side time and RSS.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = ('decode', 'decode_draft', 'remove_background', 'extract_colors', 'optimize', 'renditions',
+          'save_background')
+# Stages that go through the pluggable imaging backend
+BACKEND_STAGES = ('extract_colors', 'optimize', 'renditions', 'save_background')
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', False),
+    'png': ('PNG', '.png', False),
+    'png-alpha': ('PNG', '.png', True),
+    'webp': ('WEBP', '.webp', False)
+}
+
+
+# -----------------------------------------------------------
+# SYNTHETIC IMAGES
+# -----------------------------------------------------------
+
+def synthetic_packshot(long_side, alpha=False, seed=0):
+    """Product-like shape with shading and texture on a studio backdrop"""
+    rng = np.random.default_rng(seed)
+    width, height = long_side, long_side * 3 // 4
+
+    # Soft backdrop gradient plus sensor-like noise, so encoders can't cheat
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    backdrop = 235 - 25 * y + rng.normal(0, 3, (height, width, 3)).astype(np.float32)
+    image = Image.fromarray(np.clip(backdrop, 0, 255).astype(np.uint8))
+
+    mask = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rounded_rectangle(
+        (width * 0.32, height * 0.18, width * 0.68, height * 0.88),
+        radius=long_side // 20, fill=255
+    )
+    draw.ellipse((width * 0.38, height * 0.08, width * 0.62, height * 0.3), fill=255)
+    mask = mask.filter(ImageFilter.GaussianBlur(max(1, long_side // 800)))
+
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    color = rng.integers(40, 200, size=3).astype(np.float32)
+    shading = 0.6 + 0.5 * np.sin(x * np.pi)
+    label = rng.normal(0, 18, (height, width, 3)).astype(np.float32)
+    product = Image.fromarray(np.clip(color * shading + label, 0, 255).astype(np.uint8))
+
+    image.paste(product, (0, 0), mask)
+    if alpha:
+        image.putalpha(mask)
+    return image
+
+
+def write_images(directory, sizes, formats):
+    images = []
+    for long_side in sizes:
+        for name in formats:
+            image_format, extension, alpha = FORMATS[name]
+            image = synthetic_packshot(long_side, alpha=alpha, seed=long_side)
+            path = os.path.join(directory, f"packshot_{long_side}_{name}{extension}")
+            options = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+            image.save(path, image_format, **options)
+            images.append({
+                "path": path,
+                "format": name,
+                "width": image.width,
+                "height": image.height,
+                "alpha": alpha,
+                "bytes": os.path.getsize(path)
+            })
+    return images
+
+
+# -----------------------------------------------------------
+# CHILD: RUN ONE CASE
+# -----------------------------------------------------------
+
+class StubSession:
+    """Stand-in for the rembg U2-Net session: 320px saliency mask, upsampled"""
+
+    def predict(self, image, *args, **kwargs):
+        small = np.asarray(image.convert('RGB').resize((320, 320), Image.Resampling.BILINEAR), dtype=np.float32)
+        border = np.concatenate([small[0], small[-1], small[:, 0], small[:, -1]]).mean(axis=0)
+        distance = np.sqrt(((small - border) ** 2).sum(axis=-1))
+        mask = np.clip((distance - 20) * 4, 0, 255).astype(np.uint8)
+        return [Image.fromarray(mask).resize(image.size, Image.Resampling.LANCZOS)]
+
+
+def stub_rembg():
+    """Stand-in rembg module: remove() is the stub session's mask applied as a naive cutout"""
+    def remove(image, session, **kwargs):
+        mask = session.predict(image)[0]
+        return Image.composite(image.convert('RGBA'), Image.new('RGBA', image.size, 0), mask)
+    module = types.ModuleType("rembg", "Benchmark stand-in for rembg")
+    module.remove = remove
+    return module
+
+
+def stage_runner(stage, variant, image_info, work_dir, stub_model):
+    """Build a zero-argument callable for one stage; returns output bytes or None"""
+    path = image_info["path"]
+    output = os.path.join(work_dir, f"out_{os.getpid()}")
+
+    if stage == 'decode':
+        def run():
+            with Image.open(path) as image:
+                image.load()
+        return run
+
+    if stage == 'decode_draft':
+        from image_processing.image_loading import load_thumbnail
+        return lambda: load_thumbnail(path, (300, 300)) and None
+
+    if stage == 'remove_background':
+        from image_processing import background_removal
+        if stub_model:
+            background_removal._session = StubSession()
+            if importlib.util.find_spec("rembg") is None:
+                # The standard tier imports rembg for remove()
+                sys.modules["rembg"] = stub_rembg()
+
+        def run():
+            result = background_removal.remove_background(path, output + '.png', variant)
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+            return os.path.getsize(output + '.png')
+        return run
+
+    if stage == 'extract_colors':
+        from image_processing.color_extraction import extract_colors
+
+        def run():
+            result = extract_colors(path, 5)
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+        return run
+
+    if stage == 'optimize':
+        from image_processing.optimization import optimize_image
+
+        def run():
+            result = optimize_image(path, output + '.jpg', 500, 'JPEG')
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+            return os.path.getsize(output + '.jpg')
+        return run
+
+    if stage == 'renditions':
+        from image_processing.imaging import get_backend
+        from image_processing.renditions import (
+            DEFAULT_RENDITIONS, build_renditions, parse_rendition_specs, required_source_size
+        )
+        specs = parse_rendition_specs(",".join(DEFAULT_RENDITIONS))
+
+        def run():
+            backend = get_backend()
+            image = backend.ingest(backend.load(path, required_source_size(specs)))
+            results = build_renditions(image, specs, 'JPEG', backend=backend)
+            if not all(r["success"] for r in results):
+                raise RuntimeError("rendition over budget")
+            return sum(len(r["data"]) for r in results)
+        return run
+
+    if stage == 'save_background':
+        from image_processing.background_generation import save_generated_background
+        with Image.open(path) as image:
+            source = image.convert('RGB')
+
+        def run():
+            save_generated_background(source, output + '.jpg', optimize=True, max_size_kb=500)
+            return os.path.getsize(output + '.jpg')
+        return run
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _proc_status_mb(field):
+    """VmRSS / VmHWM from /proc (Linux), in MB"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def reset_peak_rss():
+    """Start peak tracking from now; False where the kernel doesn't allow it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        return _proc_status_mb("VmHWM")
+    except (OSError, KeyError):
+        # ru_maxrss is KB on Linux, bytes on macOS, and survives exec on Linux
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def current_rss_mb():
+    try:
+        return _proc_status_mb("VmRSS")
+    except (OSError, KeyError):
+        return peak_rss_mb()
+
+
+def run_case(case):
+    """Time one stage on one image in this process"""
+    if case.get("backend"):
+        os.environ["IMAGING_BACKEND"] = case["backend"]
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    run = stage_runner(case["stage"], case["variant"], case["image"], case["work_dir"], case["stub_model"])
+    # Imports and setup are baseline; the peak covers only the stage itself
+    baseline = current_rss_mb()
+    peak_is_stage_only = reset_peak_rss()
+
+    timings = []
+    output_bytes = None
+    for i in range(case["warmup"] + case["repeats"]):
+        started = time.perf_counter()
+        output_bytes = run()
+        elapsed = (time.perf_counter() - started) * 1000
+        if i >= case["warmup"]:
+            timings.append(elapsed)
+
+    return {
+        "timings_ms": timings,
+        "output_bytes": output_bytes,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_is_stage_only": peak_is_stage_only
+    }
+
+
+# -----------------------------------------------------------
+# PARENT: ORCHESTRATE AND REPORT
+# -----------------------------------------------------------
+
+def spawn_case(case):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(case)],
+        capture_output=True, text=True
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        error = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+        return {"error": error}
+    return json.loads(lines[-1])
+
+
+def summarize(case, measured):
+    result = {
+        "stage": case["stage"],
+        "variant": case["variant"],
+        "backend": case.get("backend"),
+        "image": {k: v for k, v in case["image"].items() if k != "path"}
+    }
+    if "error" in measured:
+        return {**result, "error": measured["error"]}
+
+    timings = np.array(measured["timings_ms"])
+    return {
+        **result,
+        "repeats": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)), 2),
+        "p95_ms": round(float(np.percentile(timings, 95)), 2),
+        "mean_ms": round(float(timings.mean()), 2),
+        "min_ms": round(float(timings.min()), 2),
+        "peak_rss_mb": measured["peak_rss_mb"],
+        "peak_delta_mb": round(measured["peak_rss_mb"] - measured["baseline_rss_mb"], 1),
+        "baseline_rss_mb": measured["baseline_rss_mb"],
+        "output_bytes": measured["output_bytes"]
+    }
+
+
+def case_key(result):
+    image = result["image"]
+    return (result["stage"], result["variant"], result.get("backend"), image["format"], image["width"])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    previous = {case_key(r): r for r in (baseline or {}).get("results", [])}
+    print(f"\n{'stage':<31}{'image':<22}{'p50 ms':>10}{'p95 ms':>10}{'peak MB':>10}{'+MB':>8}{'out KB':>10}")
+    for r in results:
+        label = r["variant"] or r.get("backend")
+        stage = r["stage"] + (f" ({label})" if label else "")
+        image = f"{r['image']['width']}x{r['image']['height']} {r['image']['format']}"
+        if "error" in r:
+            print(f"{stage:<31}{image:<22}  ❌ {r['error']}")
+            continue
+
+        out_kb = f"{r['output_bytes'] / 1024:.0f}" if r["output_bytes"] else "-"
+        line = (f"{stage:<31}{image:<22}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+                f"{r['peak_rss_mb']:>10.0f}{r['peak_delta_mb']:>8.0f}{out_kb:>10}")
+        before = previous.get(case_key(r))
+        if before and "p50_ms" in before:
+            line += f"  {(r['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100:+.0f}% p50"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image_processing stages")
+    parser.add_argument("--sizes", default="1024,2048,4096", help="Long sides in pixels")
+    parser.add_argument("--formats", default="jpeg,png-alpha", help=f"Any of {','.join(FORMATS)}")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--tiers", default="fast,standard", help="remove_background quality tiers")
+    parser.add_argument("--backends", help=f"Imaging backends for {','.join(BACKEND_STAGES)} (e.g. pil,vips)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--stub-model", action="store_true", help="Use a cheap stand-in for U2-Net")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--compare", help="Previous results JSON to diff p50 against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_case(json.loads(args.child))))
+        return
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"Unknown stage: {stage}")
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    for name in formats:
+        if name not in FORMATS:
+            parser.error(f"Unknown format: {name}")
+    sizes = [int(s) for s in args.sizes.split(",")]
+    backends = [b.strip() for b in (args.backends or "").split(",") if b.strip()]
+    for name in backends:
+        if name not in ("pil", "vips"):
+            parser.error(f"Unknown backend: {name}")
+
+    print("=" * 60)
+    print("⏱️  Image processing benchmark")
+    print("=" * 60)
+    if args.stub_model and 'remove_background' in stages and importlib.util.find_spec("rembg") is None:
+        print("🧪 rembg not installed: the standard tier runs a plain cutout on the stub mask")
+
+    with tempfile.TemporaryDirectory(prefix="image-bench-") as work_dir:
+        print(f"🖼️  Generating {len(sizes) * len(formats)} synthetic images…")
+        images = write_images(work_dir, sizes, formats)
+
+        results = []
+        for stage in stages:
+            variants = [t.strip() for t in args.tiers.split(",")] if stage == 'remove_background' else [None]
+            stage_backends = (backends or [None]) if stage in BACKEND_STAGES else [None]
+            for variant in variants:
+                for backend, image in [(b, i) for b in stage_backends for i in images]:
+                    case = {
+                        "stage": stage,
+                        "variant": variant,
+                        "backend": backend,
+                        "image": image,
+                        "work_dir": work_dir,
+                        "stub_model": args.stub_model,
+                        "repeats": args.repeats,
+                        "warmup": args.warmup
+                    }
+                    label = variant or backend
+                    print(f"   {stage}{f' ({label})' if label else ''} on "
+                          f"{image['width']}x{image['height']} {image['format']}…")
+                    results.append(summarize(case, spawn_case(case)))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stub_model": args.stub_model,
+            "backends": backends or None,
+            "repeats": args.repeats
+        },
+        "results": results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
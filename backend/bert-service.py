@@ -3,9 +3,10 @@ FastAPI service for BERT-based text classification
 Runs on port 8001
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 import uvicorn
 import sys
 import os
@@ -14,6 +15,7 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'ai-engine/compliance'))
 
 from bert_classifier import ComplianceTextClassifier
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED
 
 app = FastAPI(title="BERT Compliance Service")
 
@@ -29,6 +31,10 @@ app.add_middleware(
 # Initialize classifier
 print("🔧 Loading BERT classifier...")
 classifier = ComplianceTextClassifier()
+# Opt-in (SEMANTIC_CACHE=true): reuse classifications of near-identical copy
+semantic_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
+if semantic_cache:
+    print(f"🧠 Semantic cache on (threshold {semantic_cache.threshold}, {semantic_cache.size} entries)")
 print("✅ BERT service ready")
 
 
@@ -43,6 +49,7 @@ class ClassifyResponse(BaseModel):
     confidence: float
     compliant: bool
     all_probabilities: dict
+    cache: Optional[dict] = None
 
 
 @app.get("/health")
@@ -50,26 +57,97 @@ async def health():
     return {"status": "healthy", "service": "BERT Compliance Classifier"}
 
 
+def verify_cached(text, cached):
+    """Full inference for a sampled cache hit, to measure agreement"""
+    fresh = classifier.classify_text(text)
+    semantic_cache.record_agreement(cached, fresh)
+    # Later edits of this text match the verified answer exactly
+    semantic_cache.add(text, fresh)
+
+
+def classify_cached(text, threshold, background_tasks):
+    """Classify through the semantic cache when it is enabled"""
+    if semantic_cache is None or not text or not text.strip():
+        return classifier.classify_text(text, threshold)
+
+    cached, match = semantic_cache.lookup(text)
+    if cached is None:
+        result = classifier.classify_text(text, threshold)
+        semantic_cache.add(text, result)
+        return {**result, "cache": {"match": None}}
+
+    return from_cache(text, cached, match, threshold, background_tasks)
+
+
+def from_cache(text, cached, match, threshold, background_tasks):
+    """Response for a cache hit, scheduling a sampled verification"""
+    if semantic_cache.should_verify(match):
+        background_tasks.add_task(verify_cached, text, cached)
+    # compliant depends on this request's threshold, not the cached one
+    return {
+        **cached,
+        "compliant": cached["label"] == "allowed" or cached["confidence"] < threshold,
+        "cache": match
+    }
+
+
+def classify_batch_cached(texts, threshold, background_tasks):
+    """Cache lookups for every text, then all the misses in one classify_batch call"""
+    results = [None] * len(texts)
+    misses = []
+    for index, text in enumerate(texts):
+        if not text or not text.strip():
+            misses.append(index)
+            continue
+        cached, match = semantic_cache.lookup(text)
+        if cached is None:
+            misses.append(index)
+        else:
+            results[index] = from_cache(text, cached, match, threshold, background_tasks)
+
+    if misses:
+        classified = classifier.classify_batch([texts[index] for index in misses], threshold)
+        for index, result in zip(misses, classified):
+            text = texts[index]
+            if text and text.strip():
+                semantic_cache.add(text, result)
+                result = {**result, "cache": {"match": None}}
+            results[index] = result
+
+    return results
+
+
 @app.post("/classify", response_model=ClassifyResponse)
-async def classify_text(request: ClassifyRequest):
+async def classify_text(request: ClassifyRequest, background_tasks: BackgroundTasks):
     """Classify text for compliance violations"""
     try:
-        result = classifier.classify_text(request.text, request.threshold)
+        result = classify_cached(request.text, request.threshold, background_tasks)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/classify-batch")
-async def classify_batch(texts: list[str], threshold: float = 0.7):
+async def classify_batch(texts: list[str], background_tasks: BackgroundTasks, threshold: float = 0.7):
     """Classify multiple texts"""
     try:
-        results = classifier.classify_batch(texts, threshold)
+        if semantic_cache is None:
+            results = classifier.classify_batch(texts, threshold)
+        else:
+            results = classify_batch_cached(texts, threshold, background_tasks)
         return {"results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Semantic cache hit rate and sampled agreement with full inference"""
+    if semantic_cache is None:
+        return {"enabled": False}
+    return semantic_cache.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "bert-service:app",
@@ -1,26 +1,130 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
 from dotenv import load_dotenv
 import os
+import sys
 from datetime import datetime
 import shutil
 import uuid
+from typing import List, Optional
 import time
+import asyncio
+import io
+import json
+import zipfile
+from PIL import Image
+
+# Load .env before importing modules that read their configuration at import time
+load_dotenv()
+_import_started = time.perf_counter()
 
 # Import our processing functions
 from image_processing.background_removal import (
-    remove_background, 
-    remove_background_fast
+    QUALITY_TIERS,
+    REMBG_BATCH_SIZE,
+    CUTOUT_PNG_COMPRESS_LEVEL,
+    remove_background,
+    cutout_image,
+    segment_batch,
+    cutout_with_mask
 )
+from PIL import ImageOps
 from image_processing.color_extraction import extract_colors
 from image_processing.optimization import optimize_image
+from image_processing.encoding import (
+    encode_to_target,
+    encode_cutout,
+    normalize_format,
+    CUTOUT_FORMATS,
+    FORMAT_EXTENSIONS,
+    FORMAT_MEDIA_TYPES
+)
+from image_processing.delivery import deliver, parse_delivery
+from image_processing.compliance_analysis import analyze_creative, MAX_ANALYSIS_CREATIVES
+from image_processing.compose import (
+    composite_product,
+    fit_background,
+    parse_background_color,
+    parse_placement,
+    solid_background
+)
+from image_processing.renditions import (
+    parse_rendition_specs,
+    build_renditions,
+    required_source_size,
+    DEFAULT_RENDITIONS
+)
+from image_processing.image_loading import load_image
+from image_processing.imaging import get_backend
+from image_processing.artifact_store import (
+    artifact_path,
+    ensure_store,
+    serve_artifact,
+    read_store_stats,
+    sweep_store
+)
+from image_processing.palette_index import PaletteIndex, DEFAULT_INDEX_PATH
 
 # Background generation imports
-from image_processing.background_generation import generate_background, save_generated_background
+from image_processing.background_generation import (
+    enhance_prompt,
+    generate_background_async,
+    generate_background_variations_stream,
+    encode_generated_background,
+    save_generated_background
+)
+from image_processing.stability_client import STABILITY_ENGINE
+from image_processing.procedural_background import (
+    PROCEDURAL_STYLES,
+    generate_procedural_background,
+    parse_palette
+)
+from image_processing.admission import (
+    MemoryBudget,
+    UploadLimitMiddleware,
+    MAX_UPLOAD_BYTES,
+    MAX_BATCH_UPLOAD_BYTES,
+    BYTES_PER_PIXEL,
+    probe_image,
+    downscale_on_ingest
+)
+from image_processing.job_queue import (
+    JobQueue,
+    JobWorkerPool,
+    JOB_INPUT_DIR,
+    PRIORITIES,
+    TERMINAL_STATUSES
+)
+from image_processing.instrumentation import (
+    StageTimingMiddleware,
+    mark_worker_dead,
+    metrics_payload,
+    record_span,
+    reset_multiprocess_metrics,
+    span,
+    stage_timings
+)
+from image_processing.background_cache import (
+    BackgroundCache,
+    SingleFlight,
+    cache_key,
+    copy_cached,
+    derive_seed
+)
+# rembg, scikit-learn and the Stability SDK load on first use (or at startup via PRELOAD)
+from image_processing.engines import (
+    FORK_SAFE_ENGINES,
+    PRELOAD,
+    import_timings,
+    pending_engines,
+    readiness,
+    warm_engines
+)
+from image_processing import prefork
 
-load_dotenv()
+import_timings["image_service"] = round((time.perf_counter() - _import_started) * 1000, 1)
 
 app = FastAPI(title="Retail Forge AI - Image Service")
 
@@ -31,29 +135,95 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Inline (binary) deliveries carry their metadata in a header
+    expose_headers=["X-Image-Metadata", "Server-Timing"],
+)
+
+# Upload limits are enforced while the body streams in, not after it is on disk
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    path_limits={
+        "/process/remove-background/batch": MAX_BATCH_UPLOAD_BYTES,
+        "/process/analyze-compliance": MAX_BATCH_UPLOAD_BYTES,
+        # Product plus an optional background upload
+        "/process/compose-ad": 2 * MAX_UPLOAD_BYTES
+    }
 )
 
-# Create temp directories
-os.makedirs("temp/uploads", exist_ok=True)
-os.makedirs("temp/processed", exist_ok=True)
+# Outermost, so stage spans and the Server-Timing header cover every request
+app.add_middleware(StageTimingMiddleware, router=app.router)
+
+# Decoded pixels held by in-flight requests, across all endpoints
+memory_budget = MemoryBudget()
+
+# Create temp directories (processed artifacts are sharded by name prefix)
+ensure_store()
+
+ARTIFACT_MAX_AGE_SECONDS = int(os.getenv("ARTIFACT_MAX_AGE_SECONDS", 3600))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_MB", 2048)) * 1024 * 1024
+JANITOR_INTERVAL_SECONDS = int(os.getenv("JANITOR_INTERVAL_SECONDS", 60))
+
+PALETTE_INDEX_PATH = os.getenv("PALETTE_INDEX_PATH", DEFAULT_INDEX_PATH)
+
+background_cache = BackgroundCache()
+generation_flights = SingleFlight()
+
+# Loaded on first search and reloaded when the indexing job rewrites the file
+palette_index = None
+palette_index_mtime = None
 
 
 @app.get("/health")
 async def health_check():
+    stats = read_store_stats()
     return {
         "status": "healthy",
         "service": "Image Processing Service (rembg)",
         "timestamp": datetime.utcnow().isoformat(),
         "endpoints": [
             "/process/remove-background",
+            "/process/remove-background/batch",
             "/process/extract-colors",
             "/process/optimize",
-            "/process/generate-background"
+            "/process/renditions",
+            "/process/generate-background",
+            "/process/generate-background/variations",
+            "/process/compose-ad",
+            "/jobs/remove-background",
+            "/jobs/generate-background",
+            "/jobs/{job_id}",
+            "/palette/search",
+            "/metrics",
+            "/ready"
         ],
+        "artifact_store": {
+            "files": stats["files"],
+            "bytes": stats["bytes"]
+        },
+        "admission": memory_budget.stats(),
+        "imaging_backend": get_backend().name,
+        # Set when running under the prefork server (IMAGE_SERVICE_WORKERS > 1)
+        "worker": prefork.current_worker(),
+        "workers": prefork.worker_status(),
         "note": "Using lightweight rembg instead of SAM"
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """503 until every engine named in PRELOAD has warmed; includes import/warmup timings"""
+    ready, details = readiness()
+    return JSONResponse(details, status_code=200 if ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape: request and per-stage latency histograms"""
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+
 # -----------------------------------------------------------
 # BACKGROUND REMOVAL (FIXED - NOW FAST!)
 # -----------------------------------------------------------
@@ -61,56 +231,104 @@ async def health_check():
 @app.post("/process/remove-background")
 async def remove_bg_endpoint(
     file: UploadFile = File(...),
-    method: str = "fast"  # "standard" or "fast"
+    method: str = "fast",  # "fast", "standard" or "high"
+    delivery: str = "url",  # "url", "binary", "multipart" or "s3"
+    persist: bool = False,
+    crop: bool = False,
+    padding: int = 0,
+    format: str = "PNG",  # "PNG" or "WEBP" (lossless)
+    compress_level: int = CUTOUT_PNG_COMPRESS_LEVEL
 ):
-    """Remove background from uploaded image using rembg."""
+    """
+    Remove background from uploaded image using rembg.
+    delivery: "url" stores the cutout and returns a download_url; "binary" and
+    "multipart" return it in the response and "s3" uploads it to the output
+    bucket, storing it locally only if persist is set
+    crop: trim to the subject plus padding px; metadata.offset places the
+    cutout in the original frame
+    """
     start_time = time.time()
+    input_path = None
 
     try:
+        try:
+            delivery = parse_delivery(delivery)
+            output_format = normalize_format(format)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        if output_format not in CUTOUT_FORMATS:
+            raise HTTPException(400, f"format must be one of {', '.join(CUTOUT_FORMATS)}")
+        if not 0 <= compress_level <= 9:
+            raise HTTPException(400, "compress_level must be between 0 and 9")
+        if padding < 0:
+            raise HTTPException(400, "padding must not be negative")
+        inline = delivery != "url"
+
         file_id = str(uuid.uuid4())
         input_ext = os.path.splitext(file.filename)[1] or ".jpg"
         input_path = f"temp/uploads/{file_id}{input_ext}"
-        output_path = f"temp/processed/{file_id}_nobg.png"
+        output_filename = f"{file_id}_nobg{FORMAT_EXTENSIONS[output_format]}"
+        output_path = artifact_path(output_filename)
 
         # Save uploaded file
-        with open(input_path, "wb") as buffer:
+        with span("spool"), open(input_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
         file_size = os.path.getsize(input_path)
         print(f"📥 Received file: {file.filename} ({file_size} bytes)")
 
         # Check file size (max 10MB)
-        if file_size > 10 * 1024 * 1024:
+        if file_size > MAX_UPLOAD_BYTES:
             os.remove(input_path)
             raise HTTPException(400, "File too large (max 10MB)")
 
         # Process with rembg (much faster than SAM!)
-        if method == "fast":
-            print("⚡ Using fast background removal...")
-            result = remove_background_fast(input_path, output_path)
-        else:
-            print("🎨 Using standard background removal...")
-            result = remove_background(input_path, output_path)
+        # Unknown methods (e.g. the legacy "sam") keep the standard tier
+        quality = method if method in QUALITY_TIERS else "standard"
+        async with memory_budget.admit(input_path, "remove-background"):
+            print(f"🎨 Using {quality} background removal...")
+            result = await asyncio.to_thread(
+                remove_background, input_path, None if inline else output_path, quality,
+                crop, padding, output_format, compress_level
+            )
 
         if not result["success"]:
             raise HTTPException(500, result["error"])
 
+        persisted = not inline or persist
+        if inline and persist:
+            with span("write"), open(output_path, "wb") as f:
+                f.write(result["data"])
+
         processing_time = time.time() - start_time
 
         print(f"✅ Completed in {processing_time:.2f} seconds")
 
-        return {
+        response = {
             "success": True,
             "file_id": file_id,
-            "output_filename": f"{file_id}_nobg.png",
-            "download_url": f"/process/download/{file_id}_nobg.png",
+            "output_filename": output_filename,
+            "download_url": f"/process/download/{output_filename}" if persisted else None,
             "metadata": {
                 "dimensions": result.get("dimensions"),
+                "original_dimensions": result.get("original_dimensions"),
+                "offset": result.get("offset"),
+                "format": result.get("format"),
+                "size_kb": result.get("size_kb"),
                 "method": result.get("method", "rembg"),
+                "quality": result.get("quality"),
+                "timings_ms": result.get("timings_ms"),
+                "stages_ms": stage_timings(),
                 "processing_time_seconds": round(processing_time, 2)
             }
         }
 
+        if not inline:
+            return response
+        return await deliver(delivery, response, [
+            (output_filename, FORMAT_MEDIA_TYPES[output_format], result["data"])
+        ])
+
     except HTTPException:
         raise
     except Exception as e:
@@ -118,30 +336,236 @@ async def remove_bg_endpoint(
         raise HTTPException(500, str(e))
     finally:
         # Clean up input file
-        if os.path.exists(input_path):
+        if input_path and os.path.exists(input_path):
             try:
                 os.remove(input_path)
             except:
                 pass
 
 
+# -----------------------------------------------------------
+# BATCH BACKGROUND REMOVAL (CATALOG ONBOARDING)
+# -----------------------------------------------------------
+
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", 500))
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _spool_upload(upload):
+    """Copy an upload to temp/uploads so it outlives the request body"""
+    path = f"temp/uploads/{uuid.uuid4()}{os.path.splitext(upload.filename or '')[1]}"
+    with span("spool"), open(path, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+    return path
+
+
+def _read_zip_member(zip_file, info):
+    """Decompress one archive member, at most MAX_UPLOAD_BYTES + 1 of it"""
+    # The declared size can lie, so the read is capped as well
+    if info.file_size > MAX_UPLOAD_BYTES:
+        raise ValueError("File too large (max 10MB)")
+    with zip_file.open(info) as member:
+        return member.read(MAX_UPLOAD_BYTES + 1)
+
+
+def _decode_batch_item(item):
+    """(filename, reader) -> (filename, RGB image or None, error)"""
+    filename, read = item
+    try:
+        data = read()
+        if len(data) > MAX_UPLOAD_BYTES:
+            return filename, None, "File too large (max 10MB)"
+        # Header check rejects decompression bombs before decoding
+        probe_image(io.BytesIO(data))
+        with span("decode"):
+            image = Image.open(io.BytesIO(data))
+            image = downscale_on_ingest(ImageOps.exif_transpose(image)).convert("RGB")
+        return filename, image, None
+    except HTTPException as e:
+        return filename, None, e.detail
+    except Exception as e:
+        return filename, None, str(e)
+
+
+def _finish_batch_item(index, filename, image, mask):
+    """Upsample the mask, cut out and persist one image of a batch"""
+    file_id = str(uuid.uuid4())
+    output_filename = f"{file_id}_nobg.png"
+    started = time.perf_counter()
+    with span("refine"):
+        output = cutout_with_mask(image, mask)
+    with span("encode"):
+        data = encode_cutout(output, "PNG", CUTOUT_PNG_COMPRESS_LEVEL)
+    with span("write"), open(artifact_path(output_filename), "wb") as f:
+        f.write(data)
+    return {
+        "index": index,
+        "filename": filename,
+        "success": True,
+        "file_id": file_id,
+        "output_filename": output_filename,
+        "download_url": f"/process/download/{output_filename}",
+        "metadata": {
+            "dimensions": {"width": image.width, "height": image.height},
+            "method": "rembg-batch",
+            "finish_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+    }
+
+
+@app.post("/process/remove-background/batch")
+async def remove_bg_batch_endpoint(
+    files: List[UploadFile] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    batch_size: int = Form(None)
+):
+    """
+    Remove backgrounds from many images (multipart files and/or a zip archive)
+    Images are segmented REMBG_BATCH_SIZE at a time in one ONNX run each and
+    results stream back as NDJSON lines as they complete, then a summary line
+    """
+    start_time = time.time()
+    batch_size = max(1, min(batch_size or REMBG_BATCH_SIZE, REMBG_BATCH_SIZE))
+    spooled = [_spool_upload(upload) for upload in files or []]
+    archive_path = _spool_upload(archive) if archive is not None else None
+
+    def cleanup():
+        for path in spooled + [archive_path]:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    items = [
+        (upload.filename, lambda path=path: _read_file(path))
+        for upload, path in zip(files or [], spooled)
+    ]
+    zip_file = None
+    try:
+        if archive_path:
+            zip_file = zipfile.ZipFile(archive_path)
+            for info in zip_file.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                if os.path.splitext(name)[1].lower() in BATCH_IMAGE_EXTENSIONS:
+                    items.append((name, lambda info=info: _read_zip_member(zip_file, info)))
+    except zipfile.BadZipFile:
+        cleanup()
+        raise HTTPException(400, "archive is not a valid zip file")
+
+    if not items:
+        cleanup()
+        raise HTTPException(400, "No images provided")
+    if len(items) > MAX_BATCH_IMAGES:
+        cleanup()
+        raise HTTPException(400, f"Too many images (max {MAX_BATCH_IMAGES})")
+
+    print(f"📦 Batch background removal: {len(items)} images, batch size {batch_size}")
+
+    def decode_chunk(chunk):
+        return [_decode_batch_item(item) for item in chunk]
+
+    async def stream():
+        completed = 0
+        failed = 0
+        chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+        try:
+            # Decode the next chunk while the current one is on the model;
+            # at most two chunks of decoded images are alive at once
+            pending = asyncio.create_task(asyncio.to_thread(decode_chunk, chunks[0]))
+            for chunk_number in range(len(chunks)):
+                decoded = await pending
+                if chunk_number + 1 < len(chunks):
+                    pending = asyncio.create_task(asyncio.to_thread(decode_chunk, chunks[chunk_number + 1]))
+
+                offset = chunk_number * batch_size
+                ready = []
+                for position, (filename, image, error) in enumerate(decoded):
+                    if error:
+                        failed += 1
+                        yield json.dumps({"index": offset + position, "filename": filename,
+                                          "success": False, "error": error}) + "\n"
+                    else:
+                        ready.append((offset + position, filename, image))
+                if not ready:
+                    continue
+
+                async def finish(index, filename, image, mask):
+                    try:
+                        return await asyncio.to_thread(_finish_batch_item, index, filename, image, mask)
+                    except Exception as e:
+                        return {"index": index, "filename": filename, "success": False, "error": str(e)}
+
+                # Decoded chunks are bounded by batch size; the budget covers the
+                # cutouts made from them (one chunk may take the whole budget)
+                chunk_bytes = sum(
+                    image.width * image.height * BYTES_PER_PIXEL["remove-background"]
+                    for _, _, image in ready
+                )
+                async with memory_budget.reserve(min(chunk_bytes, memory_budget.capacity), timeout=None):
+                    try:
+                        masks = await asyncio.to_thread(segment_batch, [image for _, _, image in ready])
+                    except Exception as e:
+                        print(f"❌ Batch inference failed: {e}")
+                        for index, filename, _ in ready:
+                            failed += 1
+                            yield json.dumps({"index": index, "filename": filename,
+                                              "success": False, "error": str(e)}) + "\n"
+                        continue
+
+                    tasks = [
+                        asyncio.create_task(finish(index, filename, image, mask))
+                        for (index, filename, image), mask in zip(ready, masks)
+                    ]
+                    del decoded, ready, masks
+                    for task in asyncio.as_completed(tasks):
+                        result = await task
+                        if result["success"]:
+                            completed += 1
+                        else:
+                            failed += 1
+                        yield json.dumps(result) + "\n"
+        finally:
+            if zip_file is not None:
+                zip_file.close()
+            cleanup()
+
+        elapsed = time.time() - start_time
+        print(f"✅ Batch completed: {completed} ok, {failed} failed in {elapsed:.2f} seconds")
+        yield json.dumps({
+            "done": True,
+            "completed": completed,
+            "failed": failed,
+            "batch_size": batch_size,
+            "stages_ms": stage_timings(),
+            "processing_time_seconds": round(elapsed, 2),
+            "images_per_second": round(completed / elapsed, 2) if elapsed else None
+        }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 # -----------------------------------------------------------
 # DOWNLOAD PROCESSED FILE
 # -----------------------------------------------------------
 
-@app.get("/process/download/{filename}")
-async def download_processed_file(filename: str):
-    file_path = f"temp/processed/{filename}"
+@app.api_route("/process/download/{filename}", methods=["GET", "HEAD"])
+async def download_processed_file(filename: str, request: Request):
+    """Serve an artifact with immutable caching, conditional GET and range support."""
+    try:
+        file_path = artifact_path(filename)
+    except ValueError:
+        raise HTTPException(404, "File not found")
 
-    if not os.path.exists(file_path):
+    if not os.path.isfile(file_path):
         raise HTTPException(404, "File not found")
 
-    return FileResponse(
-        file_path,
-        media_type="image/png",
-        filename=filename,
-        headers={"Cache-Control": "no-cache"}
-    )
+    return await serve_artifact(request, file_path, filename)
 
 
 # -----------------------------------------------------------
@@ -159,19 +583,21 @@ async def extract_colors_endpoint(
         input_ext = os.path.splitext(file.filename)[1] or ".jpg"
         input_path = f"temp/uploads/{file_id}{input_ext}"
 
-        with open(input_path, "wb") as buffer:
+        with span("spool"), open(input_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
         print(f"🎨 Extracting {count} colors from {file.filename}")
 
-        result = extract_colors(input_path, count)
-
-        os.remove(input_path)
+        try:
+            async with memory_budget.admit(input_path, "extract-colors"):
+                result = await asyncio.to_thread(extract_colors, input_path, count)
+        finally:
+            os.remove(input_path)
 
         if not result["success"]:
             raise HTTPException(500, result["error"])
 
-        return result
+        return {**result, "metadata": {"stages_ms": stage_timings()}}
 
     except HTTPException:
         raise
@@ -188,35 +614,62 @@ async def extract_colors_endpoint(
 async def optimize_endpoint(
     file: UploadFile = File(...),
     target_size_kb: int = 500,
-    format: str = "JPEG"
+    format: str = "JPEG",  # "JPEG", "PNG" or "WEBP"
+    delivery: str = "url",  # "url", "binary", "multipart" or "s3"
+    persist: bool = False
 ):
-    """Optimize image to target size."""
+    """Optimize image to target size (delivery/persist as for remove-background)."""
     try:
+        try:
+            output_format = normalize_format(format)
+            delivery = parse_delivery(delivery)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        inline = delivery != "url"
+
         file_id = str(uuid.uuid4())
         input_ext = os.path.splitext(file.filename)[1] or ".jpg"
         input_path = f"temp/uploads/{file_id}{input_ext}"
 
-        with open(input_path, "wb") as buffer:
+        with span("spool"), open(input_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        output_ext = ".jpg" if format.upper() == "JPEG" else ".png"
-        output_path = f"temp/processed/{file_id}_opt{output_ext}"
-
-        print(f"🗜️ Optimizing {file.filename} to {target_size_kb}KB")
+        output_ext = FORMAT_EXTENSIONS[output_format]
+        output_path = artifact_path(f"{file_id}_opt{output_ext}")
 
-        result = optimize_image(input_path, output_path, target_size_kb, format.upper())
+        print(f"🗜️ Optimizing {file.filename} to {target_size_kb}KB ({output_format})")
 
-        os.remove(input_path)
+        try:
+            async with memory_budget.admit(input_path, "optimize"):
+                result = await asyncio.to_thread(
+                    optimize_image, input_path, None if inline else output_path, target_size_kb, output_format
+                )
+        finally:
+            os.remove(input_path)
 
         if not result["success"]:
             raise HTTPException(500, result["error"])
 
-        return {
+        data = result.pop("data")
+        persisted = not inline or persist
+        if inline and persist:
+            with span("write"), open(output_path, "wb") as f:
+                f.write(data)
+
+        response = {
             **result,
+            "output_path": output_path if persisted else None,
             "file_id": file_id,
-            "download_url": f"/process/download/{file_id}_opt{output_ext}"
+            "download_url": f"/process/download/{file_id}_opt{output_ext}" if persisted else None,
+            "metadata": {"stages_ms": stage_timings()}
         }
 
+        if not inline:
+            return response
+        return await deliver(delivery, response, [
+            (f"{file_id}_opt{output_ext}", FORMAT_MEDIA_TYPES[output_format], data)
+        ])
+
     except HTTPException:
         raise
     except Exception as e:
@@ -224,6 +677,128 @@ async def optimize_endpoint(
         raise HTTPException(500, str(e))
 
 
+# -----------------------------------------------------------
+# MULTI-RENDITION OUTPUT
+# -----------------------------------------------------------
+
+@app.post("/process/renditions")
+async def renditions_endpoint(
+    file: UploadFile = File(...),
+    sizes: str = Form(",".join(DEFAULT_RENDITIONS)),
+    format: str = Form("JPEG"),
+    as_zip: bool = Form(False),
+    delivery: str = Form("url"),
+    persist: bool = Form(False)
+):
+    """
+    Build every retail media size from one upload and one decode
+    sizes: preset names (square, story, landscape, thumb_*) or WIDTHxHEIGHT[@KB]
+    delivery: "url" stores each rendition; "multipart" returns them in the
+    response (and "binary" a single rendition), stored only if persist is set
+    """
+    start_time = time.time()
+
+    try:
+        try:
+            specs = parse_rendition_specs(sizes)
+            output_format = normalize_format(format)
+            delivery = parse_delivery(delivery)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        if delivery == "binary" and len(specs) != 1:
+            raise HTTPException(400, "binary delivery returns one rendition; use multipart or s3")
+        inline = delivery != "url"
+
+        file_id = str(uuid.uuid4())
+        output_ext = FORMAT_EXTENSIONS[output_format]
+
+        print(f"🖼️ Building {len(specs)} renditions of {file.filename}")
+
+        async with memory_budget.admit(file.file, "renditions") as probe:
+            # PIL: single decode shared by every rendition, at the smallest
+            # JPEG scale that still covers the largest one. Streaming
+            # backends read the header here and shrink on load per rendition
+            backend = get_backend()
+            with span("decode"):
+                image = await asyncio.to_thread(backend.load, file.file, required_source_size(specs))
+            source_dimensions = {"width": probe["width"], "height": probe["height"]}
+            image = backend.ingest(image)
+
+            results = await asyncio.to_thread(build_renditions, image, specs, output_format, backend=backend)
+            del image
+
+        renditions = []
+        for result in results:
+            filename = f"{file_id}_{result['name']}{output_ext}"
+            rendition = {
+                "name": result["name"],
+                "width": result["width"],
+                "height": result["height"],
+                "budget_kb": result["budget_kb"],
+                "success": result["success"]
+            }
+
+            if result["success"]:
+                rendition.update({
+                    "filename": filename,
+                    "size_kb": result["size_kb"],
+                    "quality": result["quality"],
+                    "encode_attempts": result["encode_attempts"]
+                })
+            else:
+                rendition["error"] = result["error"]
+
+            renditions.append((rendition, result.get("data")))
+
+        processing_time = time.time() - start_time
+        print(f"✅ Renditions completed in {processing_time:.2f} seconds")
+
+        if as_zip:
+            buffer = io.BytesIO()
+            # Images are already compressed, so the archive only stores them
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+                for rendition, data in renditions:
+                    if data is not None:
+                        archive.writestr(rendition["filename"], data)
+
+            return Response(
+                content=buffer.getvalue(),
+                media_type="application/zip",
+                headers={"Content-Disposition": f'attachment; filename="{file_id}_renditions.zip"'}
+            )
+
+        for rendition, data in renditions:
+            if data is not None and (not inline or persist):
+                with span("write"), open(artifact_path(rendition["filename"]), "wb") as f:
+                    f.write(data)
+                rendition["download_url"] = f"/process/download/{rendition['filename']}"
+
+        response = {
+            "success": all(r["success"] for r, _ in renditions),
+            "file_id": file_id,
+            "renditions": [r for r, _ in renditions],
+            "metadata": {
+                "source_dimensions": source_dimensions,
+                "format": output_format,
+                "stages_ms": stage_timings(),
+                "processing_time_seconds": round(processing_time, 2)
+            }
+        }
+
+        if not inline:
+            return response
+        return await deliver(delivery, response, [
+            (rendition["filename"], FORMAT_MEDIA_TYPES[output_format], data)
+            for rendition, data in renditions if data is not None
+        ])
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in renditions_endpoint: {e}")
+        raise HTTPException(500, str(e))
+
+
 # -----------------------------------------------------------
 # BACKGROUND GENERATION
 # -----------------------------------------------------------
@@ -233,61 +808,185 @@ async def generate_background_endpoint(
     prompt: str = Form(...),
     style: str = Form("professional"),
     width: int = Form(1024),
-    height: int = Form(1024)
+    height: int = Form(1024),
+    deterministic: bool = Form(False),
+    seed: Optional[int] = Form(None),
+    engine: str = Form("sdxl"),
+    palette: Optional[str] = Form(None),
+    delivery: str = Form("url"),
+    persist: bool = Form(False)
 ):
     """
     Generate background using Stable Diffusion
     Styles: professional, modern, minimal, vibrant, abstract, gradient, textured
+    deterministic: fix the seed (derived from the request if not given) and
+    serve repeats of the same request from the background cache
+    engine: "sdxl", "procedural" (gradient/minimal/textured rendered locally)
+    or "auto" (procedural whenever the style allows it)
+    palette: comma-separated hex colors for the procedural engine
+    delivery/persist: as for remove-background
     """
     start_time = time.time()
 
     try:
+        try:
+            delivery = parse_delivery(delivery)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        inline = delivery != "url"
+        data = None
+
+        engine = engine.lower()
+        if engine not in ("sdxl", "procedural", "auto"):
+            raise HTTPException(400, f"Unknown engine: {engine}")
+        if engine == "procedural" and style not in PROCEDURAL_STYLES:
+            raise HTTPException(400, f"Procedural engine supports: {', '.join(PROCEDURAL_STYLES)}")
+        use_procedural = engine == "procedural" or (engine == "auto" and style in PROCEDURAL_STYLES)
+
         file_id = str(uuid.uuid4())
-        output_path = f"temp/processed/{file_id}_background.jpg"
+        output_path = artifact_path(f"{file_id}_background.jpg")
+        enhanced_prompt = enhance_prompt(prompt, style)
+        cache_status = None
 
         print("🎨 Generating background…")
         print(f"   Prompt: {prompt}")
         print(f"   Style:  {style}")
         print(f"   Size:   {width}x{height}")
+        print(f"   Engine: {'procedural' if use_procedural else 'sdxl'}")
 
-        result = generate_background(
-            prompt=prompt,
-            style=style,
-            width=width,
-            height=height
-        )
-
-        if not result["success"]:
-            raise HTTPException(500, result["error"])
+        if use_procedural:
+            # Milliseconds of local NumPy work, so it's never worth caching
+            if seed is None and deterministic:
+                seed = derive_seed(prompt, style, width, height)
 
-        save_generated_background(
-            image=result["image"],
-            output_path=output_path,
-            optimize=True,
-            max_size_kb=500
-        )
+            try:
+                palette_colors = parse_palette(palette)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+
+            with span("generate"):
+                result = await asyncio.to_thread(
+                    generate_procedural_background,
+                    style=style,
+                    width=width,
+                    height=height,
+                    palette=palette_colors,
+                    seed=seed,
+                    prompt=prompt
+                )
+
+            if not result["success"]:
+                raise HTTPException(500, result["error"])
+
+            seed = result["seed"]
+            enhanced_prompt = None
+            if inline:
+                data = await asyncio.to_thread(encode_generated_background, result["image"], 500)
+            else:
+                await asyncio.to_thread(
+                    save_generated_background,
+                    image=result["image"],
+                    output_path=output_path,
+                    optimize=True,
+                    max_size_kb=500
+                )
+        elif deterministic:
+            if seed is None:
+                seed = derive_seed(enhanced_prompt, style, width, height)
+            key = cache_key(enhanced_prompt, style, width, height, seed, STABILITY_ENGINE)
+
+            cached_path = background_cache.get(key)
+            cache_status = "hit"
+
+            if cached_path is None:
+                async def produce():
+                    result = await generate_background_async(prompt, style, width, height, seed)
+                    if not result["success"]:
+                        return result
+
+                    temp_path = background_cache.temp_path()
+                    await asyncio.to_thread(
+                        save_generated_background,
+                        image=result["image"],
+                        output_path=temp_path,
+                        optimize=True,
+                        max_size_kb=500
+                    )
+                    return {"success": True, "cache_path": background_cache.put_file(key, temp_path)}
+
+                # Identical concurrent requests wait on one upstream generation
+                result, shared = await generation_flights.do(key, produce)
+                if not result["success"]:
+                    raise HTTPException(500, result["error"])
+
+                cached_path = result["cache_path"]
+                cache_status = "shared" if shared else "miss"
+
+            if inline:
+                with span("read"):
+                    data = await asyncio.to_thread(_read_file, cached_path)
+            else:
+                await asyncio.to_thread(copy_cached, cached_path, output_path)
+            print(f"🗃️ Background cache {cache_status} (seed {seed})")
+        else:
+            # Runs on the shared Stability executor so concurrent requests overlap
+            result = await generate_background_async(
+                prompt=prompt,
+                style=style,
+                width=width,
+                height=height,
+                seed=seed
+            )
+
+            if not result["success"]:
+                raise HTTPException(500, result["error"])
+
+            seed = result.get("seed")
+            if inline:
+                data = await asyncio.to_thread(encode_generated_background, result["image"], 500)
+            else:
+                await asyncio.to_thread(
+                    save_generated_background,
+                    image=result["image"],
+                    output_path=output_path,
+                    optimize=True,
+                    max_size_kb=500
+                )
+
+        persisted = not inline or persist
+        if inline and persist:
+            with span("write"), open(output_path, "wb") as f:
+                f.write(data)
 
         processing_time = time.time() - start_time
-        file_size_kb = os.path.getsize(output_path) / 1024
+        file_size_kb = (len(data) if inline else os.path.getsize(output_path)) / 1024
 
         print(f"⏱️ Completed in {processing_time:.2f} seconds")
         print(f"📦 File size: {file_size_kb:.1f} KB")
 
-        return {
+        response = {
             "success": True,
             "file_id": file_id,
             "output_filename": f"{file_id}_background.jpg",
-            "download_url": f"/process/download/{file_id}_background.jpg",
+            "download_url": f"/process/download/{file_id}_background.jpg" if persisted else None,
             "metadata": {
                 "prompt": prompt,
-                "enhanced_prompt": result.get("enhanced_prompt"),
+                "enhanced_prompt": enhanced_prompt,
                 "style": style,
-                "dimensions": result.get("dimensions"),
+                "seed": seed,
+                "engine": "procedural" if use_procedural else "sdxl",
+                "cache": cache_status,
+                "dimensions": {"width": width, "height": height},
+                "stages_ms": stage_timings(),
                 "processing_time_seconds": round(processing_time, 2),
                 "file_size_kb": round(file_size_kb, 1)
             }
         }
 
+        if not inline:
+            return response
+        return await deliver(delivery, response, [(f"{file_id}_background.jpg", "image/jpeg", data)])
+
     except HTTPException:
         raise
     except Exception as e:
@@ -295,27 +994,669 @@ async def generate_background_endpoint(
         raise HTTPException(500, str(e))
 
 
+@app.post("/process/generate-background/variations")
+async def generate_background_variations_endpoint(
+    prompt: str = Form(...),
+    style: str = Form("professional"),
+    width: int = Form(1024),
+    height: int = Form(1024),
+    count: int = Form(3),
+    concurrency: int = Form(None)
+):
+    """
+    Generate up to 4 variations concurrently, streamed as NDJSON
+    One line per variation as soon as it is ready, then a summary line
+    """
+    # Checked before streaming: once the 200 is sent an error can only truncate the body
+    if count < 1:
+        raise HTTPException(400, "count must be at least 1")
+    if concurrency is not None and concurrency < 1:
+        raise HTTPException(400, "concurrency must be at least 1")
+
+    start_time = time.time()
+    print(f"🎨 Generating {count} background variations…")
+
+    async def stream():
+        completed = 0
+        failed = 0
+
+        async for index, result in generate_background_variations_stream(
+            prompt, style, count, width, height, concurrency
+        ):
+            if not result["success"]:
+                failed += 1
+                yield json.dumps({"index": index, "success": False, "error": result["error"]}) + "\n"
+                continue
+
+            file_id = str(uuid.uuid4())
+            filename = f"{file_id}_background.jpg"
+            try:
+                await asyncio.to_thread(
+                    save_generated_background,
+                    image=result["image"],
+                    output_path=artifact_path(filename),
+                    optimize=True,
+                    max_size_kb=500
+                )
+            except Exception as e:
+                # Report it on the variation's line and keep streaming the rest
+                failed += 1
+                yield json.dumps({"index": index, "success": False, "error": f"Failed to save: {e}"}) + "\n"
+                continue
+            completed += 1
+
+            yield json.dumps({
+                "index": index,
+                "success": True,
+                "file_id": file_id,
+                "output_filename": filename,
+                "download_url": f"/process/download/{filename}",
+                "metadata": {
+                    "prompt": result.get("prompt"),
+                    "enhanced_prompt": result.get("enhanced_prompt"),
+                    "style": style,
+                    "seed": result.get("seed"),
+                    "dimensions": result.get("dimensions"),
+                    "elapsed_seconds": round(time.time() - start_time, 2)
+                }
+            }) + "\n"
+
+        print(f"⏱️ Variations completed in {time.time() - start_time:.2f} seconds")
+        yield json.dumps({
+            "done": True,
+            "completed": completed,
+            "failed": failed,
+            "processing_time_seconds": round(time.time() - start_time, 2)
+        }) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# -----------------------------------------------------------
+# COMPOSE AD (ALL IMAGE STAGES IN ONE REQUEST)
+# -----------------------------------------------------------
+
+@app.post("/process/compose-ad")
+async def compose_ad_endpoint(
+    file: UploadFile = File(...),
+    background_file: Optional[UploadFile] = File(None),
+    prompt: str = Form("clean studio background"),
+    style: str = Form("professional"),
+    engine: str = Form("auto"),
+    palette: Optional[str] = Form(None),
+    background_color: Optional[str] = Form(None),
+    seed: Optional[int] = Form(None),
+    width: int = Form(1080),
+    height: int = Form(1080),
+    remove_background: bool = Form(True),
+    removal_quality: str = Form("standard"),
+    placement: str = Form("center"),
+    scale: float = Form(0.6),
+    shadow: bool = Form(True),
+    target_size_kb: int = Form(500),
+    format: str = Form("JPEG"),
+    delivery: str = Form("url"),
+    persist: bool = Form(False)
+):
+    """
+    Product image in, finished ad out: background removal, background
+    generation (or an uploaded/solid background), compositing and
+    target-size encoding all happen in memory in one request.
+    Background priority: background_file, then background_color, then generated
+    delivery/persist: as for remove-background
+    """
+    start_time = time.time()
+    timings = {}
+
+    def record(stage, started):
+        elapsed = time.perf_counter() - started
+        timings[stage] = round(elapsed * 1000, 1)
+        record_span(stage, elapsed)
+
+    try:
+        try:
+            output_format = normalize_format(format)
+            anchor = parse_placement(placement)
+            palette_colors = parse_palette(palette)
+            background_rgb = parse_background_color(background_color) if background_color else None
+            delivery = parse_delivery(delivery)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        inline = delivery != "url"
+
+        if not 0 < scale <= 1:
+            raise HTTPException(400, "scale must be between 0 and 1")
+        if engine not in ("sdxl", "procedural", "auto"):
+            raise HTTPException(400, f"Unknown engine: {engine}")
+        if removal_quality not in QUALITY_TIERS:
+            raise HTTPException(400, f"Unknown removal_quality: {removal_quality}")
+
+        print(f"🧩 Composing ad from {file.filename} ({width}x{height})")
+
+        # Background upload and output canvas are held alongside the product
+        extra_bytes = width * height * BYTES_PER_PIXEL["compose"]
+        if background_file is not None:
+            extra_bytes += (await asyncio.to_thread(probe_image, background_file.file))["pixels"] * 4
+
+        async with memory_budget.admit(file.file, "compose", extra_bytes=extra_bytes):
+            started = time.perf_counter()
+            product = Image.open(file.file)
+            product.load()
+            product = downscale_on_ingest(product)
+            background_upload = None
+            if background_file is not None:
+                background_upload = Image.open(background_file.file)
+                background_upload.load()
+            record("decode", started)
+
+            async def cutout():
+                started = time.perf_counter()
+                if remove_background:
+                    result, removal_timings = await asyncio.to_thread(cutout_image, product, removal_quality)
+                    timings.update({f"remove_background.{k}": v for k, v in removal_timings.items()})
+                else:
+                    result = product.convert("RGBA")
+                record("remove_background", started)
+                return result
+
+            async def backdrop():
+                started = time.perf_counter()
+                if background_upload is not None:
+                    image = await asyncio.to_thread(fit_background, background_upload, width, height)
+                    info = {"source": "upload"}
+                elif background_rgb:
+                    image = solid_background(background_rgb, width, height)
+                    info = {"source": "color", "color": background_color}
+                else:
+                    use_procedural = engine == "procedural" or (engine == "auto" and style in PROCEDURAL_STYLES)
+                    if use_procedural:
+                        result = await asyncio.to_thread(
+                            generate_procedural_background,
+                            style=style if style in PROCEDURAL_STYLES else "gradient",
+                            width=width,
+                            height=height,
+                            palette=palette_colors,
+                            seed=seed,
+                            prompt=prompt
+                        )
+                    else:
+                        result = await generate_background_async(prompt, style, width, height, seed)
+
+                    if not result["success"]:
+                        raise HTTPException(500, result["error"])
+
+                    image = await asyncio.to_thread(fit_background, result["image"], width, height)
+                    info = {
+                        "source": "generated",
+                        "engine": "procedural" if use_procedural else "sdxl",
+                        "style": style,
+                        "seed": result.get("seed")
+                    }
+                record("background", started)
+                return image, info
+
+            # Segmentation and background generation don't depend on each other
+            product_cutout, (background, background_info) = await asyncio.gather(cutout(), backdrop())
+
+            started = time.perf_counter()
+            composite, product_box = await asyncio.to_thread(
+                composite_product, background, product_cutout, anchor, scale, shadow
+            )
+            record("composite", started)
+
+            started = time.perf_counter()
+            encoded = await asyncio.to_thread(encode_to_target, composite, target_size_kb, output_format)
+            record("encode", started)
+
+            if not encoded["success"]:
+                raise HTTPException(500, encoded["error"])
+
+        file_id = str(uuid.uuid4())
+        filename = f"{file_id}_ad{FORMAT_EXTENSIONS[output_format]}"
+
+        persisted = not inline or persist
+        if persisted:
+            started = time.perf_counter()
+            with open(artifact_path(filename), "wb") as f:
+                f.write(encoded["data"])
+            record("write", started)
+
+        processing_time = time.time() - start_time
+        print(f"✅ Ad composed in {processing_time:.2f} seconds {timings}")
+
+        response = {
+            "success": True,
+            "file_id": file_id,
+            "output_filename": filename,
+            "download_url": f"/process/download/{filename}" if persisted else None,
+            "metadata": {
+                "dimensions": encoded["dimensions"],
+                "format": output_format,
+                "size_kb": encoded["size_kb"],
+                "quality": encoded["quality"],
+                "product_box": product_box,
+                "background": background_info,
+                "background_removed": remove_background,
+                "removal_quality": removal_quality if remove_background else None,
+                "timings_ms": timings,
+                "stages_ms": stage_timings(),
+                "processing_time_seconds": round(processing_time, 2)
+            }
+        }
+
+        if not inline:
+            return response
+        return await deliver(delivery, response, [
+            (filename, FORMAT_MEDIA_TYPES[output_format], encoded["data"])
+        ])
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in compose_ad_endpoint: {e}")
+        raise HTTPException(500, str(e))
+
+
+# -----------------------------------------------------------
+# COMPLIANCE ANALYSIS (PIXEL-LEVEL CHECKS FOR THE EDITOR)
+# -----------------------------------------------------------
+
+async def _analyze_upload(upload, creative):
+    """Decode one rendered creative and run the pixel checks on it"""
+    try:
+        async with memory_budget.admit(upload.file, "analyze-compliance") as probe:
+            with span("decode"):
+                image = await asyncio.to_thread(load_image, upload.file)
+            image = downscale_on_ingest(image)
+            result = await asyncio.to_thread(
+                analyze_creative, image, creative, (probe["width"], probe["height"])
+            )
+    except HTTPException as e:
+        result = {"success": False, "error": e.detail}
+    return {"filename": upload.filename, **result}
+
+
+@app.post("/process/analyze-compliance")
+async def analyze_compliance_endpoint(
+    files: List[UploadFile] = File(...),
+    creatives: Optional[str] = Form(None)
+):
+    """
+    WCAG contrast, safe-zone intrusion and packshot coverage of rendered creatives
+    files: one render per creative (keep transparency for the safe-zone and
+    coverage checks to see layers rather than the background)
+    creatives: JSON creativeData as the Node rules get it, a list in file
+    order or one object for every file; element boxes are in canvas px
+    """
+    start_time = time.time()
+
+    if len(files) > MAX_ANALYSIS_CREATIVES:
+        raise HTTPException(400, f"Too many creatives (max {MAX_ANALYSIS_CREATIVES})")
+    try:
+        specs = json.loads(creatives) if creatives else None
+    except json.JSONDecodeError as e:
+        raise HTTPException(400, f"creatives is not valid JSON: {e}")
+    if isinstance(specs, list):
+        if len(specs) != len(files):
+            raise HTTPException(400, f"creatives has {len(specs)} entries for {len(files)} files")
+    elif specs is None or isinstance(specs, dict):
+        specs = [specs] * len(files)
+    else:
+        raise HTTPException(400, "creatives must be an object or a list of objects")
+
+    results = await asyncio.gather(*(
+        _analyze_upload(upload, spec) for upload, spec in zip(files, specs)
+    ))
+
+    processing_time = time.time() - start_time
+    print(f"🔍 Analyzed {len(results)} creatives in {processing_time:.2f} seconds")
+
+    return {
+        "success": all(r["success"] for r in results),
+        "passed": all(r.get("passed", False) for r in results),
+        "creatives": results,
+        "metadata": {
+            "stages_ms": stage_timings(),
+            "processing_time_seconds": round(processing_time, 2)
+        }
+    }
+
+
 # -----------------------------------------------------------
-# CLEANUP OLD TEMP FILES
+# PALETTE SEARCH
 # -----------------------------------------------------------
 
+def get_palette_index():
+    global palette_index, palette_index_mtime
+
+    if not os.path.exists(PALETTE_INDEX_PATH):
+        raise HTTPException(503, "Palette index not built yet")
+
+    mtime = os.path.getmtime(PALETTE_INDEX_PATH)
+    if palette_index is None or mtime != palette_index_mtime:
+        print(f"🗂️  Loading palette index from {PALETTE_INDEX_PATH}")
+        palette_index = PaletteIndex.load(PALETTE_INDEX_PATH)
+        palette_index_mtime = mtime
+
+    return palette_index
+
+
+@app.post("/palette/search")
+async def palette_search_endpoint(
+    colors: str = Form(...),
+    top_k: int = Form(10)
+):
+    """
+    Find catalog products whose palette is close to a set of colors
+    colors: comma-separated hex values, e.g. "#00539f,#ee1c2e"
+    """
+    start_time = time.time()
+
+    try:
+        query = [c.strip() for c in colors.split(",") if c.strip()]
+        if not query:
+            raise HTTPException(400, "At least one color is required")
+        if not all(len(c.lstrip("#")) == 6 for c in query):
+            raise HTTPException(400, "Colors must be 6-digit hex values")
+
+        index = get_palette_index()
+        matches = index.search(query, top_k=max(1, min(top_k, 100)))
+
+        return {
+            "success": True,
+            "query": query,
+            "matches": matches,
+            "metadata": {
+                "indexed_products": len(index),
+                "processing_time_seconds": round(time.time() - start_time, 4)
+            }
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        print(f"❌ Error in palette_search_endpoint: {e}")
+        raise HTTPException(500, str(e))
+
+
+# -----------------------------------------------------------
+# JOB QUEUE (ASYNC MODE FOR LONG-RUNNING OPERATIONS)
+# -----------------------------------------------------------
+
+job_queue = JobQueue()
+os.makedirs(JOB_INPUT_DIR, exist_ok=True)
+
+
+def _discard(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def run_remove_background_job(params, report):
+    input_path = params["input_path"]
+    file_id = str(uuid.uuid4())
+    output_filename = f"{file_id}_nobg.png"
+
+    try:
+        # Workers wait for memory budget rather than failing the job
+        async with memory_budget.admit(input_path, "remove-background", timeout=None):
+            report(0.1, f"removing background ({params['quality']})")
+            result = await asyncio.to_thread(
+                remove_background, input_path, artifact_path(output_filename), params["quality"]
+            )
+    except asyncio.CancelledError:
+        # Input is kept so the requeued job can run after a restart
+        raise
+    except Exception:
+        _discard(input_path)
+        raise
+    _discard(input_path)
+
+    if not result["success"]:
+        raise RuntimeError(result["error"])
+
+    return {
+        "success": True,
+        "file_id": file_id,
+        "output_filename": output_filename,
+        "download_url": f"/process/download/{output_filename}",
+        "metadata": {
+            "dimensions": result.get("dimensions"),
+            "method": result.get("method"),
+            "quality": result.get("quality"),
+            "timings_ms": result.get("timings_ms")
+        }
+    }
+
+
+async def run_generate_background_job(params, report):
+    report(0.1, f"generating ({params.get('engine', 'sdxl')})")
+    # Same path as the synchronous endpoint, so jobs share its cache and dedupe
+    return await generate_background_endpoint(**params, delivery="url", persist=False)
+
+
+JOB_HANDLERS = {
+    "remove-background": run_remove_background_job,
+    "generate-background": run_generate_background_job
+}
+
+
+def _job_response(job):
+    """Public view of a job row"""
+    response = {
+        "job_id": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "progress": job["progress"],
+        "message": job["message"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events"
+    }
+    if job["status"] == "queued":
+        response["queue_position"] = job_queue.position(job["id"])
+    return response
+
+
+def _submit_job(job_type, params, priority):
+    if priority not in PRIORITIES:
+        raise HTTPException(400, f"Unknown priority: {priority} (use {', '.join(PRIORITIES)})")
+    job_id = job_queue.submit(job_type, params, priority)
+    app.state.job_workers.notify()
+    print(f"📝 Queued {job_type} job {job_id} ({priority})")
+    return _job_response(job_queue.get(job_id))
+
+
+@app.post("/jobs/remove-background", status_code=202)
+async def submit_remove_background_job(
+    file: UploadFile = File(...),
+    method: str = Form("fast"),
+    priority: str = Form("interactive")
+):
+    """Queue background removal; returns a job id immediately"""
+    quality = method if method in QUALITY_TIERS else "standard"
+    input_ext = os.path.splitext(file.filename or "")[1] or ".jpg"
+    input_path = os.path.join(JOB_INPUT_DIR, f"{uuid.uuid4()}{input_ext}")
+
+    with open(input_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+    if os.path.getsize(input_path) > MAX_UPLOAD_BYTES:
+        os.remove(input_path)
+        raise HTTPException(400, "File too large (max 10MB)")
+
+    try:
+        return _submit_job("remove-background", {"input_path": input_path, "quality": quality}, priority)
+    except HTTPException:
+        os.remove(input_path)
+        raise
+
+
+@app.post("/jobs/generate-background", status_code=202)
+async def submit_generate_background_job(
+    prompt: str = Form(...),
+    style: str = Form("professional"),
+    width: int = Form(1024),
+    height: int = Form(1024),
+    deterministic: bool = Form(False),
+    seed: Optional[int] = Form(None),
+    engine: str = Form("sdxl"),
+    palette: Optional[str] = Form(None),
+    priority: str = Form("interactive")
+):
+    """Queue background generation; takes the same fields as /process/generate-background"""
+    params = {
+        "prompt": prompt,
+        "style": style,
+        "width": width,
+        "height": height,
+        "deterministic": deterministic,
+        "seed": seed,
+        "engine": engine,
+        "palette": palette
+    }
+    return _submit_job("generate-background", params, priority)
+
+
+@app.get("/jobs/stats")
+async def job_queue_stats():
+    """Job counts by status and priority"""
+    return {
+        "jobs": await asyncio.to_thread(job_queue.stats),
+        "workers": app.state.job_workers.workers
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return _job_response(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-sent events for a job: one event whenever its status, progress
+    or message changes, ending with the terminal state
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+
+    async def stream():
+        last = None
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job is None:
+                break
+
+            state = (job["status"], job["progress"], job["message"])
+            if state != last:
+                last = state
+                yield f"event: {job['status']}\ndata: {json.dumps(_job_response(job))}\n\n"
+
+            if job["status"] in TERMINAL_STATUSES or await request.is_disconnected():
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+# -----------------------------------------------------------
+# STARTUP
+# -----------------------------------------------------------
+
+@app.on_event("startup")
+async def warm_preloaded_engines():
+    # Warms in the background so /health answers meanwhile; /ready waits for it.
+    # Engines not in PRELOAD (e.g. the Stability client pool) load on first use;
+    # under prefork only those the parent couldn't share are left to warm here
+    engines = pending_engines()
+    if engines:
+        print(f"🔥 Preloading engines: {', '.join(engines)}")
+        app.state.warmup = asyncio.create_task(asyncio.to_thread(warm_engines, engines))
+
+
+# -----------------------------------------------------------
+# TEMP FILE JANITOR
+# -----------------------------------------------------------
+
+async def run_janitor():
+    """Keep the artifact store within its age and size bounds for the life of the process"""
+    while True:
+        try:
+            result = await asyncio.to_thread(
+                sweep_store, ARTIFACT_MAX_AGE_SECONDS, ARTIFACT_MAX_BYTES
+            )
+            if result["expired"] or result["evicted"]:
+                print(f"🧹 Janitor: {result['expired']} expired, {result['evicted']} evicted, "
+                      f"{result['files']} files / {result['bytes'] / 1024 / 1024:.1f}MB left")
+
+            cache_evicted = await asyncio.to_thread(background_cache.prune)
+            if cache_evicted:
+                print(f"🧹 Janitor: {cache_evicted} cached backgrounds evicted")
+
+            jobs_purged = await asyncio.to_thread(job_queue.purge)
+            if jobs_purged:
+                print(f"🧹 Janitor: {jobs_purged} finished jobs purged")
+        except Exception as e:
+            print(f"❌ Janitor sweep failed: {e}")
+
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+
+
 @app.on_event("startup")
-async def cleanup_temp_files():
-    print("🧹 Cleaning up temp files…")
+async def start_janitor():
+    # Under prefork only worker 0 sweeps; the store and queues are shared
+    app.state.janitor = None
+    if prefork.current_worker() not in (None, 0):
+        return
+    print("🧹 Starting temp file janitor…")
+    app.state.janitor = asyncio.create_task(run_janitor())
+
 
-    for folder in ["temp/uploads", "temp/processed"]:
-        if os.path.exists(folder):
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
+@app.on_event("shutdown")
+async def stop_janitor():
+    if app.state.janitor is not None:
+        app.state.janitor.cancel()
 
-                if os.path.isfile(file_path):
-                    # Delete files older than 1 hour
-                    if time.time() - os.path.getmtime(file_path) > 3600:
-                        try:
-                            os.remove(file_path)
-                            print(f"   🗑️ Deleted: {filename}")
-                        except:
-                            pass
+
+@app.on_event("startup")
+async def start_job_workers():
+    app.state.job_workers = JobWorkerPool(job_queue, JOB_HANDLERS)
+    # A prefork parent requeues interrupted jobs once, before forking
+    app.state.job_workers.start(recover=prefork.current_worker() is None)
+    print(f"🛠️ Job workers started ({app.state.job_workers.workers})")
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Running jobs stay 'running' in the queue and are requeued on next start
+    await app.state.job_workers.stop()
+
+
+@app.get("/store/stats")
+async def artifact_store_stats():
+    """Artifact store size and file count as of the last janitor sweep"""
+    return {
+        **read_store_stats(),
+        "max_bytes": ARTIFACT_MAX_BYTES,
+        "max_age_seconds": ARTIFACT_MAX_AGE_SECONDS
+    }
 
 
 # -----------------------------------------------------------
@@ -324,6 +1665,8 @@ async def cleanup_temp_files():
 
 if __name__ == "__main__":
     port = int(os.getenv("IMAGE_SERVICE_PORT", 8000))
+    # python image-service.py --production (or IMAGE_SERVICE_ENV=production)
+    production = "--production" in sys.argv or os.getenv("IMAGE_SERVICE_ENV") == "production"
 
     print("=" * 60)
     print("🚀 Retail Forge AI - Image Processing Service")
@@ -331,13 +1674,49 @@ if __name__ == "__main__":
     print(f"📍 Port: {port}")
     print(f"📁 Temp folders: temp/uploads, temp/processed")
     print(f"🔗 Health: http://localhost:{port}/health")
+    print(f"🔗 Ready: http://localhost:{port}/ready")
+    print(f"🔥 Preload: {', '.join(PRELOAD) or 'none (engines load on first use)'}")
+    print(f"⏱️ Imports: {import_timings['image_service']:.0f}ms")
+    print(f"👷 Workers: {prefork.SERVER_WORKERS if production else 1}")
     print("⚡ Using lightweight rembg (no more SAM hangs!)")
     print("=" * 60)
 
-    uvicorn.run(
-        "image-service:app",
-        host="0.0.0.0",
-        port=port,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    if production and prefork.SERVER_WORKERS > 1:
+        # ONNX Runtime and OpenMP thread pools don't survive fork(), so each
+        # worker runs single-threaded inference and the workers use the cores.
+        # Must be set before the engines are imported (they load lazily)
+        if os.environ.get("OMP_NUM_THREADS", "1") != "1":
+            print(f"⚠️ Overriding OMP_NUM_THREADS={os.environ['OMP_NUM_THREADS']} with 1 for prefork workers")
+        os.environ["OMP_NUM_THREADS"] = "1"
+
+        # Loaded once here and shared copy-on-write by every worker
+        warm_engines([name for name in PRELOAD if name in FORK_SAFE_ENGINES])
+
+        requeued = job_queue.recover()
+        if requeued:
+            print(f"♻️ Requeued {requeued} interrupted jobs")
+        reset_multiprocess_metrics()
+
+        # MEMORY_BUDGET_MB is for the whole instance: the workers hold it in
+        # shared memory, so one request can still use all of it
+        memory_budget.shared = prefork.SharedMemoryLedger()
+
+        def worker_exited(pid):
+            requeued = job_queue.recover(worker=pid)
+            if requeued:
+                print(f"♻️ Requeued {requeued} jobs from worker pid {pid}")
+            mark_worker_dead(pid)
+
+        prefork.serve(app, port=port, on_worker_exit=worker_exited)
+    elif production:
+        # Serve the already-imported app: no reloader process and no second
+        # import of this module under the name "image-service"
+        uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    else:
+        uvicorn.run(
+            "image-service:app",
+            host="0.0.0.0",
+            port=port,
+            reload=True,
+            log_level="info"
+        )
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""
+Pixel-memory admission control
+Sniffs image dimensions from the header before anything is decoded,
+estimates the decoded working set of a request and holds it against a
+memory budget (per process, or shared by the prefork workers), so concurrent large uploads queue (or get
+rejected) instead of exhausting RAM
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from PIL import Image
+
+from image_processing.image_loading import load_image
+from image_processing.instrumentation import record_span
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_FILE_SIZE_MB", 10)) * 1024 * 1024
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_MB", 1024)) * 1024 * 1024
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_MB", 2048)) * 1024 * 1024
+# How long a request may wait for budget before it is turned away with a 503
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_TIMEOUT_SECONDS", 30))
+# How often a waiting request rechecks a budget shared with other processes,
+# whose releases can't wake it
+SHARED_BUDGET_POLL_SECONDS = 0.05
+# Images above this are downscaled as they are ingested (0 disables)
+INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", 0))
+# Hard ceiling; anything larger is rejected from its header alone
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 100_000_000))
+
+# PIL warns above this and raises above twice this
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Approximate peak bytes per source pixel while a stage works on an image:
+# decoded RGB plus the stage's own copies, masks and float planes
+BYTES_PER_PIXEL = {
+    'remove-background': 24,
+    'compose': 24,
+    'optimize': 10,
+    'renditions': 10,
+    'extract-colors': 8,
+    # RGBA decode and its array copy (8), uint8 distance and bool mask
+    # planes (~4), and float32 compositing of text regions, which can
+    # cover the whole render (~20)
+    'analyze-compliance': 32
+}
+DEFAULT_BYTES_PER_PIXEL = 12
+
+
+class AdmissionError(HTTPException):
+    """Request can't be admitted; answered with its status code as-is"""
+
+    def __init__(self, message, status_code=503, retry_after=None):
+        headers = {"Retry-After": str(retry_after)} if retry_after else None
+        super().__init__(status_code, message, headers=headers)
+
+
+def probe_image(source):
+    """
+    Read an image's dimensions from its header without decoding pixels
+
+    Args:
+        source: Path or seekable file object (rewound afterwards)
+
+    Returns:
+        dict with width, height, pixels and format
+    """
+    position = source.tell() if hasattr(source, "tell") else None
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            image_format = image.format
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise AdmissionError(f"Image exceeds {MAX_IMAGE_PIXELS} pixels", status_code=413)
+    except Exception:
+        raise AdmissionError("Unreadable or unsupported image file", status_code=400)
+    finally:
+        if position is not None:
+            source.seek(position)
+
+    if width * height > MAX_IMAGE_PIXELS:
+        raise AdmissionError(f"Image exceeds {MAX_IMAGE_PIXELS} pixels", status_code=413)
+
+    return {"width": width, "height": height, "pixels": width * height, "format": image_format}
+
+
+def ingest_scale(probe, max_pixels=INGEST_MAX_PIXELS):
+    """Linear scale (<= 1) that brings an image under the ingest ceiling"""
+    if not max_pixels or probe["pixels"] <= max_pixels:
+        return 1.0
+    return (max_pixels / probe["pixels"]) ** 0.5
+
+
+def estimate_bytes(probe, stage):
+    """Estimated peak memory for running a stage on a probed image"""
+    scale = ingest_scale(probe)
+    working = probe["pixels"] * scale * scale * BYTES_PER_PIXEL.get(stage, DEFAULT_BYTES_PER_PIXEL)
+    # Downscaling on ingest still decodes the full image once
+    decode = probe["pixels"] * 4 if scale < 1 else 0
+    return int(max(working, decode))
+
+
+def _ingest_size(width, height, max_pixels=INGEST_MAX_PIXELS):
+    scale = ingest_scale({"pixels": width * height}, max_pixels)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def downscale_on_ingest(image):
+    """Downscale a decoded image that is over the ingest ceiling"""
+    size = _ingest_size(image.width, image.height)
+    if size == image.size:
+        return image
+    print(f"📉 Downscaling on ingest: {image.width}x{image.height} -> {size[0]}x{size[1]}")
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def downscale_file_on_ingest(path, probe):
+    """Rewrite an uploaded file in place if it is over the ingest ceiling"""
+    if ingest_scale(probe) >= 1:
+        return probe
+
+    with Image.open(path) as source:
+        image_format = source.format
+        exif = source.info.get("exif")
+        # JPEGs skip most of the full-size decode
+        image = load_image(source, min_size=_ingest_size(probe["width"], probe["height"]))
+        image = downscale_on_ingest(image)
+
+    options = {"quality": 95} if image_format in ("JPEG", "WEBP") else {}
+    if exif:
+        options["exif"] = exif
+    image.save(path, image_format, **options)
+    return {**probe, "width": image.width, "height": image.height, "pixels": image.width * image.height}
+
+
+class MemoryBudget:
+    """
+    Pool of bytes that admitted requests hold while they run
+
+    Process-wide by default. With a shared ledger (try_reserve(nbytes,
+    capacity) / release(nbytes) / in_use(), e.g. prefork's
+    SharedMemoryLedger) the capacity is held across every process using it.
+    """
+
+    def __init__(self, capacity=MEMORY_BUDGET_BYTES, shared=None):
+        self.capacity = capacity
+        self.shared = shared
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._condition = None
+
+    def _claim(self, nbytes):
+        if self.shared is not None:
+            return self.shared.try_reserve(nbytes, self.capacity)
+        return self.in_use + nbytes <= self.capacity
+
+    @asynccontextmanager
+    async def reserve(self, nbytes, timeout=ADMISSION_TIMEOUT_SECONDS):
+        """
+        Hold nbytes of the budget for the duration of the block
+
+        Waits up to timeout seconds (None waits indefinitely) for room, then
+        raises AdmissionError; requests larger than the whole budget are
+        rejected immediately
+        """
+        if nbytes > self.capacity:
+            self.rejected += 1
+            raise AdmissionError(
+                f"Image needs ~{nbytes // 2 ** 20}MB to process; the limit is "
+                f"{self.capacity // 2 ** 20}MB",
+                status_code=413
+            )
+
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            self.waiting += 1
+            started = time.perf_counter()
+            deadline = None if timeout is None else started + timeout
+            try:
+                while not self._claim(nbytes):
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        self.rejected += 1
+                        raise AdmissionError("Server busy processing other images, retry shortly",
+                                             retry_after=max(1, round(timeout or 1)))
+                    if self.shared is not None:
+                        remaining = min(remaining or SHARED_BUDGET_POLL_SECONDS, SHARED_BUDGET_POLL_SECONDS)
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+                # Time queued behind other requests' pixels
+                record_span("admission_wait", time.perf_counter() - started)
+            self.in_use += nbytes
+            self.admitted += 1
+
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= nbytes
+                if self.shared is not None:
+                    self.shared.release(nbytes)
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, source, stage, timeout=ADMISSION_TIMEOUT_SECONDS, extra_bytes=0):
+        """
+        Probe an upload and hold its estimated memory while the block runs
+
+        Uploaded files (paths) over the ingest ceiling are downscaled in place
+        once admitted. Yields the probe dict.
+        """
+        probe = await asyncio.to_thread(probe_image, source)
+        async with self.reserve(estimate_bytes(probe, stage) + extra_bytes, timeout):
+            if isinstance(source, str):
+                probe = await asyncio.to_thread(downscale_file_on_ingest, source, probe)
+            yield probe
+
+    def stats(self):
+        stats = {
+            "capacity_bytes": self.capacity,
+            "in_use_bytes": self.in_use,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+        if self.shared is not None:
+            # in_use_bytes is this process's share
+            stats["instance_in_use_bytes"] = self.shared.in_use()
+        return stats
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware enforcing a request body limit while the body streams in
+
+    Rejects up front on Content-Length, otherwise counts bytes as they are
+    received and aborts the upload once the limit is crossed, answering 413
+    instead of whatever the app would have sent.
+
+    Args:
+        max_bytes: Default limit
+        path_limits: {path prefix: limit} overrides, e.g. for batch uploads
+    """
+
+    # Allowance for multipart boundaries and small form fields
+    OVERHEAD_BYTES = 64 * 1024
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, path_limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    def limit_for(self, path):
+        for prefix, limit in self.path_limits.items():
+            if path.startswith(prefix):
+                return limit
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        limit = self.limit_for(scope["path"]) + self.OVERHEAD_BYTES
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded:
+                # The app turned the aborted read into its own error; replace it
+                if message["type"] == "http.response.start" and not started:
+                    started = True
+                    await self._reject(send, limit)
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+            if not started:
+                await self._reject(send, limit)
+
+    async def _reject(self, send, limit):
+        body = json.dumps({
+            "detail": f"Upload too large (max {(limit - self.OVERHEAD_BYTES) // 2 ** 20}MB)"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
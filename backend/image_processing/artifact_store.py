@@ -0,0 +1,353 @@
+"""
+Artifact store for processed outputs
+Artifacts are uuid-named and never rewritten, so they are served with
+content-hash ETags, long-lived immutable caching and HTTP range support.
+Files are sharded into subdirectories by name prefix and a janitor keeps
+the store within an age and total-size bound
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+import anyio
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+PROCESSED_DIR = "temp/processed"
+UPLOADS_DIR = "temp/uploads"
+# Last sweep's stats, shared with every server worker (only one sweeps)
+STATS_PATH = "temp/store_stats.json"
+
+# Two hex characters of the uuid prefix -> 256 shard directories
+SHARD_PREFIX_LENGTH = 2
+
+MEDIA_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.zip': 'application/zip'
+}
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Content hashes keyed by file identity, so each artifact is hashed once
+_ETAG_CACHE_SIZE = 4096
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+
+# Store size as of the last janitor sweep
+store_stats = {
+    "files": 0,
+    "bytes": 0,
+    "expired_deleted": 0,
+    "evicted_deleted": 0,
+    "last_sweep_at": None,
+    "last_sweep_seconds": None
+}
+
+
+def ensure_store():
+    """Create the upload directory and every shard directory up front"""
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    for i in range(16 ** SHARD_PREFIX_LENGTH):
+        os.makedirs(os.path.join(PROCESSED_DIR, f"{i:0{SHARD_PREFIX_LENGTH}x}"), exist_ok=True)
+
+
+def artifact_path(filename):
+    """Resolve an artifact filename to its sharded path, rejecting anything path-like"""
+    if not filename or filename != os.path.basename(filename) or filename.startswith("."):
+        raise ValueError(f"Invalid artifact name: {filename}")
+
+    shard = filename[:SHARD_PREFIX_LENGTH].lower()
+    if len(shard) < SHARD_PREFIX_LENGTH or any(c not in "0123456789abcdef" for c in shard):
+        raise ValueError(f"Invalid artifact name: {filename}")
+
+    return os.path.join(PROCESSED_DIR, shard, filename)
+
+
+def touch_artifact(path, stat_result):
+    """Record an access for LRU eviction without changing mtime (and so the ETag)"""
+    try:
+        os.utime(path, ns=(time.time_ns(), stat_result.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def _scan_files(folder):
+    """Yield (path, stat) for files in a folder and its shard subdirectories"""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                try:
+                    yield entry.path, entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+
+
+def _delete(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def sweep_store(max_age_seconds=3600, max_bytes=2 * 1024 ** 3, low_watermark=0.9):
+    """
+    One janitor pass over the artifact store
+
+    Deletes uploads and artifacts older than max_age_seconds, then evicts the
+    least recently accessed artifacts until the store is back under
+    low_watermark * max_bytes
+
+    Returns:
+        dict with the store's file count, size and what was deleted
+    """
+    start_time = time.time()
+    expired = 0
+
+    if os.path.exists(UPLOADS_DIR):
+        for path, stat_result in _scan_files(UPLOADS_DIR):
+            if start_time - stat_result.st_mtime > max_age_seconds and _delete(path):
+                expired += 1
+
+    live = []
+    if os.path.exists(PROCESSED_DIR):
+        for path, stat_result in _scan_files(PROCESSED_DIR):
+            if start_time - stat_result.st_mtime > max_age_seconds:
+                if _delete(path):
+                    expired += 1
+            else:
+                live.append((stat_result.st_atime, stat_result.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in live)
+    evicted = 0
+
+    if total_bytes > max_bytes:
+        # Least recently accessed first
+        live.sort()
+        target = max_bytes * low_watermark
+        for _, size, path in live:
+            if total_bytes <= target:
+                break
+            if _delete(path):
+                total_bytes -= size
+                evicted += 1
+
+    # Totals carry over from the previous sweeping process
+    previous = read_store_stats()
+    store_stats.update({
+        "files": len(live) - evicted,
+        "bytes": total_bytes,
+        "expired_deleted": previous["expired_deleted"] + expired,
+        "evicted_deleted": previous["evicted_deleted"] + evicted,
+        "last_sweep_at": start_time,
+        "last_sweep_seconds": round(time.time() - start_time, 3)
+    })
+    _write_stats()
+
+    return {
+        "files": len(live) - evicted,
+        "bytes": total_bytes,
+        "expired": expired,
+        "evicted": evicted
+    }
+
+
+def _write_stats():
+    temp_path = f"{STATS_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(store_stats, f)
+    os.replace(temp_path, STATS_PATH)
+
+
+def read_store_stats():
+    """Stats of the last sweep by any worker (this process's if none was written)"""
+    try:
+        with open(STATS_PATH) as f:
+            return {**store_stats, **json.load(f)}
+    except (OSError, ValueError):
+        return dict(store_stats)
+
+
+def media_type_for(filename):
+    return MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+
+def compute_etag(path, stat_result):
+    """Strong ETag from the artifact's content hash"""
+    key = (path, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+    with _etag_lock:
+        if key in _etag_cache:
+            _etag_cache.move_to_end(key)
+            return _etag_cache[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()[:32]}"'
+
+    with _etag_lock:
+        _etag_cache[key] = etag
+        while len(_etag_cache) > _ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+
+    return etag
+
+
+def etag_matches(header, etag):
+    """Weak comparison, as required for If-None-Match"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range "bytes=" header into (start, end) inclusive
+
+    Returns None when the header should be ignored (malformed or multi-range),
+    raises ValueError when the range is unsatisfiable
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+
+    return start, min(end, size - 1)
+
+
+class ArtifactFileResponse(Response):
+    """
+    Streams all or part of a file. Uses the ASGI zero-copy send extension
+    (sendfile) when the server offers it, chunked reads otherwise
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, status_code=200, headers=None, media_type=None,
+                 offset=0, count=0, send_body=True):
+        self.path = path
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.offset,
+                    "count": self.count
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0
+                })
+
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+
+async def serve_artifact(request, path, filename):
+    """Build the response for an artifact GET/HEAD, honouring conditional and range headers"""
+    stat_result = os.stat(path)
+    etag = await run_in_threadpool(compute_etag, path, stat_result)
+    touch_artifact(path, stat_result)
+    size = stat_result.st_size
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes"
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    media_type = media_type_for(filename)
+    send_body = request.method != "HEAD"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+        if byte_range:
+            start, end = byte_range
+            count = end - start + 1
+            return ArtifactFileResponse(
+                path,
+                status_code=206,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(count)
+                },
+                media_type=media_type,
+                offset=start,
+                count=count,
+                send_body=send_body
+            )
+
+    return ArtifactFileResponse(
+        path,
+        headers={**headers, "Content-Length": str(size)},
+        media_type=media_type,
+        count=size,
+        send_body=send_body
+    )
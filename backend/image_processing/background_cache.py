@@ -0,0 +1,136 @@
+"""
+Deterministic generated-background cache
+Stores optimized JPEGs keyed on everything that determines the SDXL output
+(enhanced prompt, style, size, seed, engine) and collapses concurrent
+identical requests into a single upstream generation
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+BACKGROUND_CACHE_DIR = os.getenv("BACKGROUND_CACHE_DIR", "cache/backgrounds")
+BACKGROUND_CACHE_MAX_BYTES = int(os.getenv("BACKGROUND_CACHE_MAX_MB", 1024)) * 1024 * 1024
+
+
+def derive_seed(enhanced_prompt, style, width, height):
+    """Stable seed for a request that asks for determinism without giving one"""
+    digest = hashlib.sha256(f"{enhanced_prompt}|{style}|{width}x{height}".encode()).digest()
+    return int.from_bytes(digest[:4], "big")
+
+
+def cache_key(enhanced_prompt, style, width, height, seed, engine):
+    raw = f"{engine}|{enhanced_prompt}|{style}|{width}x{height}|{seed}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class BackgroundCache:
+    """On-disk JPEG cache, sharded by key prefix, pruned least-recently-used first"""
+
+    def __init__(self, directory=BACKGROUND_CACHE_DIR, max_bytes=BACKGROUND_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.jpg")
+
+    def get(self, key):
+        """Path of a cached background, or None"""
+        path = self.path_for(key)
+        try:
+            # Access time drives LRU pruning
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, key, source_path):
+        """Atomically move a finished file into the cache"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        return path
+
+    def temp_path(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f".{uuid.uuid4()}.tmp")
+
+    def prune(self):
+        """Evict least recently used entries until the cache fits max_bytes"""
+        if not os.path.exists(self.directory):
+            return 0
+
+        entries = []
+        for folder, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith("."):
+                    # Entry still being written
+                    continue
+                path = os.path.join(folder, filename)
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat_result.st_atime, stat_result.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+                evicted += 1
+            except OSError:
+                pass
+
+        return evicted
+
+
+def copy_cached(source_path, destination_path):
+    """
+    Expose a cached file as an artifact
+    A copy rather than a hard link: a shared inode would share its mtime, so
+    each new artifact would extend the expiry of earlier ones, and the
+    janitor would count the same bytes once per name
+    """
+    shutil.copyfile(source_path, destination_path)
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight execution"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        """
+        Run fn() once per key at a time
+
+        Returns:
+            (result, shared) where shared is True for callers that joined
+            an execution started by another request
+        """
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key]), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a leader-only failure isn't logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
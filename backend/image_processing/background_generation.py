@@ -1,97 +1,117 @@
 import os
 import io
 import base64
+import asyncio
 from PIL import Image
-import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
-from stability_sdk import client
+from image_processing.encoding import encode_to_target, encode_image
+from image_processing.engines import load_module
+from image_processing.imaging import get_backend
+from image_processing.instrumentation import span
+from image_processing.stability_client import (
+    get_stability_client,
+    call_with_retries,
+    run_in_stability_executor,
+    submit_to_stability_executor
+)
 
-def generate_background(prompt, style="professional", width=1024, height=1024):
+# Style-specific prompt enhancements
+STYLE_PROMPTS = {
+    'professional': 'clean, corporate, professional lighting, high quality, commercial photography',
+    'modern': 'contemporary, sleek, minimalist, modern design, clean composition',
+    'minimal': 'minimalist, simple, clean background, subtle, elegant, negative space',
+    'vibrant': 'vibrant colors, energetic, bold, colorful, dynamic, eye-catching',
+    'abstract': 'abstract art, creative, artistic, unique patterns, modern art',
+    'gradient': 'smooth gradient, color blend, soft transitions, elegant',
+    'textured': 'subtle texture, depth, professional finish, high resolution'
+}
+
+def enhance_prompt(prompt, style="professional"):
+    """Enhance a prompt with its style description"""
+    enhanced_prompt = f"{prompt}, {STYLE_PROMPTS.get(style, STYLE_PROMPTS['professional'])}"
+    enhanced_prompt += ", 4k, ultra detailed, professional quality, suitable for advertising"
+    return enhanced_prompt
+
+def _request_image(enhanced_prompt, width, height, seed):
+    """One Generate call on a pooled client, consumed to the first image artifact"""
+    stability_api = get_stability_client()
+    generation = load_module("stability_sdk.interfaces.gooseai.generation.generation_pb2")
+    
+    # Note: The Stability Python SDK handles prompts differently than raw API
+    # We pass the prompt list where weighted prompts can be used.
+    answers = stability_api.generate(
+        prompt=[enhanced_prompt], # Currently SDK doesn't support negative prompt easily in this method call without helpers, but putting it in prompt often works or relying on strict style prompts.
+        # For this version, we rely on the style prompts being generic.
+        seed=seed,
+        steps=30,
+        cfg_scale=7.0,
+        width=width,
+        height=height,
+        samples=1,
+        sampler=generation.SAMPLER_K_DPMPP_2M
+    )
+    
+    for resp in answers:
+        for artifact in resp.artifacts:
+            if artifact.finish_reason == generation.FILTER:
+                return None, True
+            if artifact.type == generation.ARTIFACT_IMAGE:
+                return artifact, False
+    
+    return None, False
+
+def generate_background(prompt, style="professional", width=1024, height=1024, seed=None):
     """
     Generate background using Stable Diffusion XL
     """
     try:
-        api_key = os.getenv('STABILITY_API_KEY')
-        if not api_key:
-            raise ValueError("STABILITY_API_KEY not found in environment")
-        
         print(f"🎨 Generating background with prompt: {prompt}")
         print(f"   Style: {style}, Size: {width}x{height}")
         
-        # Initialize Stability AI client
-        stability_api = client.StabilityInference(
-            key=api_key,
-            verbose=True,
-            engine="stable-diffusion-xl-1024-v1-0"
-        )
-        
         # COPYRIGHT SAFETY: Add negative prompts
         # This instructs the model NOT to include these elements
         negative_prompt = "text, watermark, copyright, signature, logo, trademark, disney, marvel, dc comics, famous characters, distorted, blurry, low quality, nsfw, brands, faces"
 
-        # Style-specific prompt enhancements
-        style_prompts = {
-            'professional': 'clean, corporate, professional lighting, high quality, commercial photography',
-            'modern': 'contemporary, sleek, minimalist, modern design, clean composition',
-            'minimal': 'minimalist, simple, clean background, subtle, elegant, negative space',
-            'vibrant': 'vibrant colors, energetic, bold, colorful, dynamic, eye-catching',
-            'abstract': 'abstract art, creative, artistic, unique patterns, modern art',
-            'gradient': 'smooth gradient, color blend, soft transitions, elegant',
-            'textured': 'subtle texture, depth, professional finish, high resolution'
-        }
-        
         # Enhance prompt with style
-        enhanced_prompt = f"{prompt}, {style_prompts.get(style, style_prompts['professional'])}"
-        enhanced_prompt += ", 4k, ultra detailed, professional quality, suitable for advertising"
+        enhanced_prompt = enhance_prompt(prompt, style)
         
         print(f"   Enhanced prompt: {enhanced_prompt[:100]}...")
         
-        # Generate image
-        # Note: The Stability Python SDK handles prompts differently than raw API
-        # We pass the prompt list where weighted prompts can be used.
-        answers = stability_api.generate(
-            prompt=[enhanced_prompt], # Currently SDK doesn't support negative prompt easily in this method call without helpers, but putting it in prompt often works or relying on strict style prompts.
-            # For this version, we rely on the style prompts being generic.
-            seed=None,
-            steps=30,
-            cfg_scale=7.0,
-            width=width,
-            height=height,
-            samples=1,
-            sampler=generation.SAMPLER_K_DPMPP_2M
-        )
+        # Generate image on the shared client; transient gRPC errors are retried
+        with span("generate"):
+            artifact, filtered = call_with_retries(
+                lambda: _request_image(enhanced_prompt, width, height, seed)
+            )
+        
+        if filtered:
+            print("⚠️ Safety filter triggered, trying again with safer prompt")
+            return {
+                "success": False,
+                "error": "Content filtered by safety system. Try a different description."
+            }
+        
+        if artifact is None:
+            return {
+                "success": False,
+                "error": "No image generated"
+            }
         
-        # Extract image from response
-        for resp in answers:
-            for artifact in resp.artifacts:
-                if artifact.finish_reason == generation.FILTER:
-                    print("⚠️ Safety filter triggered, trying again with safer prompt")
-                    return {
-                        "success": False,
-                        "error": "Content filtered by safety system. Try a different description."
-                    }
-                
-                if artifact.type == generation.ARTIFACT_IMAGE:
-                    img = Image.open(io.BytesIO(artifact.binary))
-                    
-                    if img.mode == 'RGBA':
-                        background = Image.new('RGB', img.size, (255, 255, 255))
-                        background.paste(img, mask=img.split()[3])
-                        img = background
-                    
-                    print(f"✅ Background generated successfully!")
-                    
-                    return {
-                        "success": True,
-                        "image": img,
-                        "prompt": prompt,
-                        "enhanced_prompt": enhanced_prompt,
-                        "style": style,
-                        "dimensions": {"width": width, "height": height}
-                    }
+        img = Image.open(io.BytesIO(artifact.binary))
+        
+        if img.mode == 'RGBA':
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        
+        print(f"✅ Background generated successfully!")
         
         return {
-            "success": False,
-            "error": "No image generated"
+            "success": True,
+            "image": img,
+            "prompt": prompt,
+            "enhanced_prompt": enhanced_prompt,
+            "style": style,
+            "seed": artifact.seed,
+            "dimensions": {"width": width, "height": height}
         }
         
     except Exception as e:
@@ -101,14 +121,25 @@ def generate_background(prompt, style="professional", width=1024, height=1024):
             "error": str(e)
         }
 
+async def generate_background_async(prompt, style="professional", width=1024, height=1024, seed=None):
+    """generate_background on the bounded Stability executor, without blocking the event loop"""
+    return await run_in_stability_executor(
+        generate_background, prompt, style=style, width=width, height=height, seed=seed
+    )
+
+# Prompt suffixes that make each variation distinct
+VARIATION_MODS = ["", ", alternate composition", ", different lighting", ", unique perspective"]
+
+VARIATION_CONCURRENCY = int(os.getenv("VARIATION_CONCURRENCY", 4))
+
 def generate_background_variations(base_prompt, style="professional", count=3):
-    """Generate multiple background variations"""
-    variations = []
-    variation_mods = ["", ", alternate composition", ", different lighting", ", unique perspective"]
+    """Generate multiple background variations concurrently"""
+    prompts = [base_prompt + mod for mod in VARIATION_MODS[:min(count, len(VARIATION_MODS))]]
+    futures = [submit_to_stability_executor(generate_background, p, style) for p in prompts]
     
-    for i in range(min(count, 4)):
-        modified_prompt = base_prompt + variation_mods[i]
-        result = generate_background(modified_prompt, style)
+    variations = []
+    for i, future in enumerate(futures):
+        result = future.result()
         if result["success"]:
             variations.append(result)
         else:
@@ -116,6 +147,43 @@ def generate_background_variations(base_prompt, style="professional", count=3):
     
     return variations
 
+async def generate_background_variations_stream(base_prompt, style="professional", count=3,
+                                                width=1024, height=1024, concurrency=None):
+    """
+    Fan variations out concurrently and yield (index, result) as each finishes,
+    so the first option is available without waiting for the slowest
+    """
+    semaphore = asyncio.Semaphore(concurrency or VARIATION_CONCURRENCY)
+    prompts = [base_prompt + mod for mod in VARIATION_MODS[:min(count, len(VARIATION_MODS))]]
+    
+    async def run(index, prompt):
+        async with semaphore:
+            return index, await generate_background_async(prompt, style, width, height)
+    
+    tasks = [asyncio.create_task(run(i, p)) for i, p in enumerate(prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away: don't keep queued variations waiting on the executor
+        for task in tasks:
+            task.cancel()
+
+def encode_generated_background(image, max_size_kb=500):
+    """Encode a generated background as JPEG under max_size_kb, in memory"""
+    backend = get_backend()
+    with span("encode"):
+        result = encode_to_target(backend.from_pil(image), max_size_kb, 'JPEG', min_quality=60,
+                                  min_scale=1.0, backend=backend)
+
+    if result["success"]:
+        print(f"💾 Encoded optimized background: {result['size_kb']:.1f}KB "
+              f"(quality: {result['quality']}, attempts: {result['encode_attempts']})")
+        return result["data"]
+
+    print(f"⚠️ Encoded at minimum quality (60)")
+    return encode_image(image, 'JPEG', quality=60)
+
 def save_generated_background(image, output_path, optimize=True, max_size_kb=500):
     """Save generated background with optimization"""
     try:
@@ -123,23 +191,12 @@ def save_generated_background(image, output_path, optimize=True, max_size_kb=500
             image.save(output_path, 'PNG', quality=95)
             return
         
-        quality = 95
-        while quality > 60:
-            buffer = io.BytesIO()
-            image.save(buffer, 'JPEG', quality=quality, optimize=True)
-            size_kb = buffer.tell() / 1024
-            
-            if size_kb <= max_size_kb:
-                with open(output_path, 'wb') as f:
-                    f.write(buffer.getvalue())
-                print(f"💾 Saved optimized background: {size_kb:.1f}KB (quality: {quality})")
-                return
-            
-            quality -= 5
+        # Quality search happens in memory; only the final encode is written
+        data = encode_generated_background(image, max_size_kb)
         
-        image.save(output_path, 'JPEG', quality=60, optimize=True)
-        print(f"⚠️ Saved at minimum quality (60)")
+        with span("write"), open(output_path, 'wb') as f:
+            f.write(data)
         
     except Exception as e:
         print(f"❌ Failed to save background: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -3,58 +3,364 @@ Lightweight Background Removal using rembg
 Much faster and less resource-intensive than SAM
 """
 
-from rembg import remove
-from PIL import Image
-import io
+from PIL import Image, ImageOps
+import numpy as np
 import os
 import sys
+import threading
+import time
 
-def remove_background(input_path, output_path):
+from image_processing.encoding import alpha_bbox, encode_cutout, normalize_format
+from image_processing.engines import load_module
+from image_processing.instrumentation import record_span, span
+
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+
+# Quality tiers for background removal:
+#   fast     - segment a downscaled copy, guided-filter upsample of the mask
+#   standard - rembg's own full-resolution cutout
+#   high     - full-resolution mask, guided-filter matting in the edge band
+QUALITY_TIERS = ("fast", "standard", "high")
+REMBG_FAST_MAX_SIDE = int(os.getenv("REMBG_FAST_MAX_SIDE", 1024))
+# Resolution the high tier solves its matting coefficients at
+REMBG_REFINE_MAX_SIDE = int(os.getenv("REMBG_REFINE_MAX_SIDE", 2048))
+# Images per ONNX run in batch mode; bounds memory for large uploads
+REMBG_BATCH_SIZE = int(os.getenv("REMBG_BATCH_SIZE", 8))
+
+# Cutout encoding: zlib level for PNG (1 fastest - 9 smallest) and WebP
+# lossless effort (0 fastest - 6 smallest)
+CUTOUT_PNG_COMPRESS_LEVEL = int(os.getenv("CUTOUT_PNG_COMPRESS_LEVEL", 6))
+CUTOUT_WEBP_METHOD = int(os.getenv("CUTOUT_WEBP_METHOD", 1))
+# Alpha at or below this counts as background when auto-cropping
+AUTOCROP_ALPHA_THRESHOLD = int(os.getenv("AUTOCROP_ALPHA_THRESHOLD", 0))
+
+# Models sharing U2-Net's preprocessing, which segment_batch reproduces
+# (see rembg.sessions.u2net); others fall back to one predict() per image
+BATCHABLE_MODELS = ("u2net", "u2netp", "u2net_human_seg", "silueta")
+U2NET_NORMALIZATION = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))
+
+# rembg builds a new ONNX session on every remove() call unless given one
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Shared rembg session, created on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            print(f"📦 Loading rembg model: {REMBG_MODEL}")
+            # rembg pulls in onnxruntime, so it is only imported once needed
+            rembg = load_module("rembg")
+            with span("model_load"):
+                _session = rembg.new_session(REMBG_MODEL)
+    return _session
+
+def warm_up():
+    """Load the session and run one inference so the first request doesn't pay for it"""
+    get_session().predict(Image.new('RGB', U2NET_NORMALIZATION[2]))
+
+def _downscale(image, max_side, resample=Image.Resampling.BILINEAR):
+    """Copy of image with its longest side at most max_side"""
+    scale = max_side / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap does most of the shrink with a cheap integer box reduce
+    return image.resize(size, resample, reducing_gap=2.0)
+
+def _box_mean(values, radius):
+    """Mean over a (2r+1)^2 window via an integral image, edges clamped"""
+    k = 2 * radius + 1
+    padded = np.pad(values.astype(np.float64), ((radius + 1, radius), (radius + 1, radius)), mode='edge')
+    integral = padded.cumsum(0).cumsum(1)
+    window = integral[k:, k:] - integral[:-k, k:] - integral[k:, :-k] + integral[:-k, :-k]
+    return (window / (k * k)).astype(np.float32)
+
+def _sample_bilinear(plane, ys, xs, size):
+    """Bilinearly sample a low-res plane at full-resolution pixel coordinates"""
+    height, width = plane.shape
+    fy = np.clip((ys + 0.5) * (height / size[1]) - 0.5, 0, height - 1)
+    fx = np.clip((xs + 0.5) * (width / size[0]) - 0.5, 0, width - 1)
+    y0, x0 = fy.astype(np.intp), fx.astype(np.intp)
+    y1, x1 = np.minimum(y0 + 1, height - 1), np.minimum(x0 + 1, width - 1)
+    wy, wx = (fy - y0).astype(np.float32), (fx - x0).astype(np.float32)
+    top = plane[y0, x0] * (1 - wx) + plane[y0, x1] * wx
+    bottom = plane[y1, x0] * (1 - wx) + plane[y1, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+def guided_upsample(mask, guide, radius=None, eps=1e-3, guide_small=None):
+    """
+    Fast guided filter: fit a local linear model alpha = a * I + b between
+    the mask and the image luminance at mask resolution, then apply the
+    upsampled coefficients to the full-resolution luminance so the edge
+    follows the real object boundary instead of a blurry interpolation
+
+    Args:
+        mask: L mask, any resolution at or below the guide
+        guide: Full-resolution image the mask belongs to
+        radius: Window radius at mask resolution
+        eps: Regularization; larger values smooth more
+        guide_small: The guide already downscaled to the mask size, if at hand
+
+    Returns:
+        Full-resolution alpha as a uint8 array
+    """
+    guide_full = guide.convert('L')
+    if guide_small is not None:
+        guide_small = guide_small.convert('L')
+    elif guide_full.size != mask.size:
+        guide_small = guide_full.resize(mask.size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    else:
+        guide_small = guide_full
+    if radius is None:
+        radius = max(2, round(min(mask.size) / 128))
+
+    I = np.asarray(guide_small, dtype=np.float32) / 255
+    p = np.asarray(mask, dtype=np.float32) / 255
+
+    mean_I = _box_mean(I, radius)
+    mean_p = _box_mean(p, radius)
+    cov_Ip = _box_mean(I * p, radius) - mean_I * mean_p
+    var_I = _box_mean(I * I, radius) - mean_I * mean_I
+
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+    mean_a = _box_mean(a, radius)
+    mean_b = _box_mean(b, radius)
+
+    alpha_small = np.clip(mean_a * I + mean_b, 0, 1)
+    alpha_small = (alpha_small * 255 + 0.5).astype(np.uint8)
+    if guide_full.size == mask.size:
+        return alpha_small
+
+    # Where a ~ 0 the model is flat (alpha = b) and plain interpolation is
+    # exact; only pixels near textured edges need the full-res guide
+    alpha = np.array(Image.fromarray(alpha_small).resize(guide_full.size, Image.Resampling.BILINEAR))
+    detail = Image.fromarray((np.abs(mean_a) > 1e-2).astype(np.uint8))
+    ys, xs = np.nonzero(np.asarray(detail.resize(guide_full.size, Image.Resampling.NEAREST)))
+    if len(ys):
+        I_full = np.asarray(guide_full)[ys, xs].astype(np.float32) / 255
+        a = _sample_bilinear(mean_a, ys, xs, guide_full.size)
+        b = _sample_bilinear(mean_b, ys, xs, guide_full.size)
+        alpha[ys, xs] = (np.clip(a * I_full + b, 0, 1) * 255 + 0.5).astype(np.uint8)
+    return alpha
+
+def _edge_band(mask, width):
+    """Boolean array marking pixels within width px of the mask boundary"""
+    solid = (np.asarray(mask) >= 128).astype(np.float32)
+    # A window that is neither all foreground nor all background straddles the edge
+    coverage = _box_mean(solid, width)
+    return (coverage > 1e-3) & (coverage < 1 - 1e-3)
+
+def _apply_alpha(image, alpha):
+    output = image.convert('RGBA')
+    output.putalpha(Image.fromarray(alpha) if isinstance(alpha, np.ndarray) else alpha)
+    return output
+
+def cutout_image(image, quality="standard"):
+    """
+    Remove the background from an in-memory image at a quality tier
+
+    Args:
+        image: PIL image
+        quality: fast, standard or high (see QUALITY_TIERS)
+
+    Returns:
+        (RGBA PIL image, per-stage timings in ms)
+    """
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {quality}")
+
+    timings = {}
+    started = time.perf_counter()
+
+    def record(stage):
+        nonlocal started
+        elapsed = time.perf_counter() - started
+        timings[stage] = round(elapsed * 1000, 1)
+        record_span(stage, elapsed)
+        started = time.perf_counter()
+
+    image = ImageOps.exif_transpose(image).convert('RGB')
+
+    if quality == "standard":
+        output = load_module("rembg").remove(image, session=get_session()).convert('RGBA')
+        record("segment")
+        return output, timings
+
+    if quality == "fast":
+        small = _downscale(image, REMBG_FAST_MAX_SIDE)
+        record("downscale")
+        mask = get_session().predict(small)[0]
+        record("segment")
+        output = _apply_alpha(image, guided_upsample(mask, image, guide_small=small))
+        record("refine")
+        return output, timings
+
+    # high: the mask from the full-resolution pass stays authoritative away
+    # from the edge; only the boundary band is re-solved against the image
+    mask = get_session().predict(image)[0]
+    record("segment")
+
+    coarse = _downscale(mask, REMBG_REFINE_MAX_SIDE)
+    band_width = max(2, round(min(coarse.size) / 100))
+    band = _edge_band(coarse, band_width)
+    refined = guided_upsample(coarse, image, radius=band_width)
+    if coarse.size != image.size:
+        band = np.asarray(Image.fromarray(band).resize(image.size, Image.Resampling.NEAREST))
+    alpha = np.where(band, refined, np.asarray(mask))
+    output = _apply_alpha(image, alpha)
+    record("refine")
+    return output, timings
+
+def segment_batch(images):
+    """
+    Segment several images with a single ONNX run
+
+    Args:
+        images: RGB PIL images (at most REMBG_BATCH_SIZE)
+
+    Returns:
+        One L mask per image, at model resolution for batchable models
+        (upsample with cutout_with_mask) or at image resolution otherwise
+    """
+    session = get_session()
+    if REMBG_MODEL not in BATCHABLE_MODELS:
+        with span("segment"):
+            return [session.predict(image)[0] for image in images]
+
+    mean, std, size = U2NET_NORMALIZATION
+    model_input = session.inner_session.get_inputs()[0]
+    # Shrink first so normalize()'s LANCZOS resize works on small images
+    tensors = [
+        session.normalize(_downscale(image, max(size) * 2), mean, std, size)[model_input.name]
+        for image in images
+    ]
+
+    with span("segment"):
+        if isinstance(model_input.shape[0], int):
+            # Exported with a fixed batch dimension: still one session, one call each
+            outputs = [session.inner_session.run(None, {model_input.name: tensor})[0] for tensor in tensors]
+            predictions = np.concatenate(outputs)[:, 0]
+        else:
+            predictions = session.inner_session.run(None, {model_input.name: np.concatenate(tensors)})[0][:, 0]
+
+    masks = []
+    for prediction in predictions:
+        # Per-image min/max scaling, as rembg does for a batch of one
+        low, high = float(prediction.min()), float(prediction.max())
+        prediction = (prediction - low) / max(high - low, 1e-6)
+        masks.append(Image.fromarray((prediction * 255).astype(np.uint8)))
+    return masks
+
+def cutout_with_mask(image, mask):
+    """Apply a (possibly low-resolution) mask to an image, edge-aware upsampled"""
+    return _apply_alpha(image, guided_upsample(mask, image))
+
+def remove_background_image(image, quality="standard"):
+    """
+    Remove the background from an in-memory image
+
+    Args:
+        image: PIL image
+        quality: fast, standard or high
+
+    Returns:
+        RGBA PIL image with the background made transparent
+    """
+    return cutout_image(image, quality)[0]
+
+def crop_cutout(image, padding=0):
+    """
+    Crop a cutout to its subject
+
+    Returns:
+        (cropped image, offset of the crop in the original as {"x", "y"})
+    """
+    box = alpha_bbox(image, padding, AUTOCROP_ALPHA_THRESHOLD)
+    if box is None or box == (0, 0, image.width, image.height):
+        return image, {"x": 0, "y": 0}
+    return image.crop(box), {"x": box[0], "y": box[1]}
+
+def remove_background(input_path, output_path, quality="standard", crop=False, padding=0,
+                      format="PNG", compress_level=CUTOUT_PNG_COMPRESS_LEVEL):
     """
     Remove background from image using rembg (U2-Net model)
     This is much lighter and faster than SAM
     
     Args:
         input_path: Path to input image
-        output_path: Path to save output image (PNG with transparency)
+        output_path: Path to save output image (with transparency);
+            None returns the encoded image as "data" instead
+        quality: fast, standard or high (see QUALITY_TIERS)
+        crop: Crop to the subject's alpha bounding box
+        padding: Transparent margin kept around the subject when cropping
+        format: PNG or WEBP (lossless)
+        compress_level: PNG zlib level, 1 (fastest) to 9 (smallest)
     
     Returns:
-        dict with success status and metadata
+        dict with success status and metadata; "offset" places a cropped
+        cutout within original_dimensions
     """
     try:
-        print(f"🖼️  Processing: {input_path}")
-        
-        # Load image
-        with open(input_path, 'rb') as input_file:
-            input_data = input_file.read()
-        
+        format = normalize_format(format)
+        print(f"🖼️  Processing: {input_path} ({quality})")
+
+        started = time.perf_counter()
+        with span("decode"):
+            image = Image.open(input_path)
+            image.load()
+        decode_ms = round((time.perf_counter() - started) * 1000, 1)
+
         print("🎯 Removing background with rembg...")
-        
-        # Remove background using rembg (uses U2-Net model)
-        # This automatically downloads a ~176MB model on first use
-        # Much lighter than SAM's 2.4GB!
-        output_data = remove(input_data)
-        
-        # Save output
-        output_image = Image.open(io.BytesIO(output_data))
-        output_image.save(output_path, "PNG")
-        
-        # Get dimensions
+
+        # Downloads a ~176MB model on first use (much lighter than SAM's 2.4GB)
+        output_image, timings = cutout_image(image, quality)
+        original_width, original_height = output_image.size
+
+        offset = {"x": 0, "y": 0}
+        if crop:
+            started = time.perf_counter()
+            with span("crop"):
+                output_image, offset = crop_cutout(output_image, padding)
+            timings["crop"] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        with span("encode"):
+            data = encode_cutout(output_image, format, compress_level, CUTOUT_WEBP_METHOD)
+        timings = {"decode": decode_ms, **timings,
+                   "encode": round((time.perf_counter() - started) * 1000, 1)}
+
+        if output_path is not None:
+            with span("write"), open(output_path, "wb") as f:
+                f.write(data)
+
         width, height = output_image.size
-        
-        print(f"💾 Saved to: {output_path}")
-        print(f"📏 Dimensions: {width}x{height}")
-        
+
+        if output_path is not None:
+            print(f"💾 Saved to: {output_path}")
+        print(f"📏 Dimensions: {width}x{height} ({len(data) / 1024:.0f}KB {format}) {timings}")
+
         return {
             "success": True,
             "output_path": output_path,
+            "data": data if output_path is None else None,
+            "format": format,
+            "size_kb": round(len(data) / 1024, 2),
             "dimensions": {
                 "width": width,
                 "height": height
             },
-            "method": "rembg"
+            "original_dimensions": {
+                "width": original_width,
+                "height": original_height
+            },
+            "offset": offset,
+            "method": "rembg" if quality == "standard" else f"rembg-{quality}",
+            "quality": quality,
+            "timings_ms": timings
         }
-        
+
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return {
@@ -70,48 +376,10 @@ def remove_background_simple(input_path, output_path):
 
 def remove_background_fast(input_path, output_path):
     """
-    Even faster version with reduced quality
+    Segments a downscaled copy and upsamples the mask edge-aware
     Good for previews or when speed is critical
     """
-    try:
-        print(f"🖼️  Fast processing: {input_path}")
-        
-        with open(input_path, 'rb') as input_file:
-            input_data = input_file.read()
-        
-        print("⚡ Quick background removal...")
-        
-        # Use fast model (less accurate but much faster)
-        output_data = remove(
-            input_data,
-            alpha_matting=False,  # Disable alpha matting for speed
-            alpha_matting_foreground_threshold=240,
-            alpha_matting_background_threshold=10
-        )
-        
-        output_image = Image.open(io.BytesIO(output_data))
-        output_image.save(output_path, "PNG")
-        
-        width, height = output_image.size
-        
-        print(f"💾 Saved to: {output_path}")
-        
-        return {
-            "success": True,
-            "output_path": output_path,
-            "dimensions": {
-                "width": width,
-                "height": height
-            },
-            "method": "rembg-fast"
-        }
-        
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        return {
-            "success": False,
-            "error": str(e)
-        }
+    return remove_background(input_path, output_path, quality="fast")
 
 if __name__ == "__main__":
     # Test script
@@ -1,9 +1,11 @@
-from PIL import Image
 import numpy as np
-from sklearn.cluster import KMeans
 from collections import Counter
 import colorsys
 
+from image_processing.engines import load_module
+from image_processing.imaging import get_backend
+from image_processing.instrumentation import span
+
 def rgb_to_hex(rgb):
     """Convert RGB tuple to hex color"""
     return "#{:02x}{:02x}{:02x}".format(int(rgb[0]), int(rgb[1]), int(rgb[2]))
@@ -116,12 +118,9 @@ def extract_colors(image_path, n_colors=5):
     try:
         print(f"🎨 Extracting {n_colors} colors from {image_path}")
         
-        # Load and prepare image
-        image = Image.open(image_path)
-        image = image.convert('RGB')
-        
-        # Resize for faster processing
-        image.thumbnail((300, 300), Image.Resampling.LANCZOS)
+        # Load at reduced scale; only a 300px thumbnail is analyzed
+        with span("decode"):
+            image = get_backend().thumbnail(image_path, (300, 300))
         
         # Convert to numpy array
         pixels = np.array(image).reshape(-1, 3)
@@ -137,8 +136,10 @@ def extract_colors(image_path, n_colors=5):
         
         # Apply KMeans clustering
         n_colors_actual = min(n_colors, len(pixels))
+        KMeans = load_module("sklearn.cluster").KMeans
         kmeans = KMeans(n_clusters=n_colors_actual, random_state=42, n_init=10)
-        kmeans.fit(pixels)
+        with span("kmeans"):
+            kmeans.fit(pixels)
         
         # Get cluster centers (dominant colors)
         colors = kmeans.cluster_centers_.astype(int)
@@ -185,6 +186,11 @@ def extract_colors(image_path, n_colors=5):
             "error": str(e)
         }
 
+def warm_up():
+    """Import scikit-learn and fit a tiny KMeans so its native libraries are loaded"""
+    KMeans = load_module("sklearn.cluster").KMeans
+    KMeans(n_clusters=2, random_state=42, n_init=1).fit(np.array([[0, 0, 0], [255, 255, 255]]))
+
 def extract_color_palette(image_path, palette_size=5):
     """
     Extract a curated color palette suitable for branding
@@ -0,0 +1,380 @@
+"""
+Pixel-level compliance analysis
+Measures a rendered creative where the Node design/layout rules only see
+element properties: WCAG contrast of text against the pixels actually behind
+it, content inside the social safe zones, and how much of each packshot box
+the product covers. Each check is a handful of whole-array NumPy operations
+(one content mask per image, then a slice per element) instead of loops
+over pixels.
+"""
+
+import os
+
+import numpy as np
+
+from image_processing.instrumentation import span
+
+WCAG_AA_NORMAL = 4.5
+WCAG_AA_LARGE = 3.0
+
+# Story safe zones as (top, bottom) fractions of the canvas height,
+# matching SocialSafeZoneRule's 200px / 250px of 1920
+SAFE_ZONES = {
+    "instagram_story": (200 / 1920, 250 / 1920),
+    "facebook_story": (200 / 1920, 250 / 1920)
+}
+# Creatives analyzed per request
+MAX_ANALYSIS_CREATIVES = int(os.getenv("MAX_ANALYSIS_CREATIVES", 20))
+# Share of a safe zone's pixels that may hold content before it fails
+SAFE_ZONE_TOLERANCE = float(os.getenv("SAFE_ZONE_TOLERANCE", 0.001))
+# Alpha above this counts as content in a render with transparency
+CONTENT_ALPHA_THRESHOLD = 16
+# Per-channel distance from the background (or text) color that still matches it
+COLOR_TOLERANCE = 24
+# Antialiased glyph edges are neither text nor background; skip this many px
+GLYPH_EDGE_PX = 2
+# Contrast is reported at this percentile of the background pixels, so a
+# few stray pixels don't fail an element but a busy patch behind it does
+CONTRAST_PERCENTILE = 10
+
+TEXT_TYPES = ("text", "i-text", "textbox")
+NAMED_COLORS = {"white": (255, 255, 255), "black": (0, 0, 0)}
+
+# sRGB -> linear light, weighted per channel, so luminance is three lookups
+_LINEAR = np.arange(256, dtype=np.float64) / 255
+_LINEAR = np.where(_LINEAR <= 0.03928, _LINEAR / 12.92, ((_LINEAR + 0.055) / 1.055) ** 2.4)
+_LUMINANCE_LUTS = [(_LINEAR * weight).astype(np.float32) for weight in (0.2126, 0.7152, 0.0722)]
+
+
+def parse_color(value):
+    """#rgb, #rrggbb or white/black as an RGB tuple; None for anything else"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    if value in NAMED_COLORS:
+        return NAMED_COLORS[value]
+    value = value.lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    if len(value) != 6:
+        return None
+    try:
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return None
+
+
+def luminance(rgb):
+    """WCAG relative luminance of an HxWx3 uint8 array"""
+    return (_LUMINANCE_LUTS[0][rgb[..., 0]] + _LUMINANCE_LUTS[1][rgb[..., 1]]
+            + _LUMINANCE_LUTS[2][rgb[..., 2]])
+
+
+def contrast_ratio(l1, l2):
+    """WCAG contrast between luminances (scalars or arrays)"""
+    return (np.maximum(l1, l2) + 0.05) / (np.minimum(l1, l2) + 0.05)
+
+
+def _hex(rgb):
+    return "#{:02x}{:02x}{:02x}".format(*(int(round(c)) for c in rgb))
+
+
+def _dilate(mask, radius):
+    """Grow a boolean mask by radius px (square window)"""
+    if radius <= 0 or not mask.any():
+        return mask
+    height, width = mask.shape
+    # Separable: rows first, then columns
+    padded = np.pad(mask, radius)
+    rows = np.zeros_like(mask)
+    for dy in range(2 * radius + 1):
+        rows |= padded[dy:dy + height, radius:radius + width]
+    padded = np.pad(rows, radius)
+    grown = np.zeros_like(mask)
+    for dx in range(2 * radius + 1):
+        grown |= padded[radius:radius + height, dx:dx + width]
+    return grown
+
+
+def color_distance(rgb, color):
+    """Largest per-channel difference from a color, staying in uint8"""
+    distance = None
+    for channel, value in enumerate(np.asarray(color, dtype=np.uint8)):
+        plane = rgb[..., channel]
+        difference = np.maximum(plane, value) - np.minimum(plane, value)
+        distance = difference if distance is None else np.maximum(distance, difference, out=distance)
+    return distance
+
+
+def content_mask(rgb, alpha=None, background=None):
+    """
+    Pixels that hold content
+
+    A render with transparency is taken as layers over an empty canvas, so
+    alpha decides. An opaque render is compared against the background
+    color (given, or the median of the image border).
+
+    Returns:
+        (boolean HxW mask, "alpha" or "background")
+    """
+    if alpha is not None:
+        return alpha > CONTENT_ALPHA_THRESHOLD, "alpha"
+
+    if background is None:
+        border = np.concatenate([rgb[0], rgb[-1], rgb[:, 0], rgb[:, -1]])
+        background = np.median(border, axis=0)
+    return color_distance(rgb, background) > COLOR_TOLERANCE, "background"
+
+
+def flatten(rgb, alpha, backdrop):
+    """Composite a region of a transparent render over the backdrop color"""
+    if alpha is None:
+        return rgb
+    weight = alpha[..., None].astype(np.float32) / 255
+    blended = rgb * weight + np.asarray(backdrop, dtype=np.float32) * (1 - weight)
+    return (blended + 0.5).astype(np.uint8)
+
+
+def element_box(element, scale, size):
+    """
+    Pixel box of an editor element (fabric left/top/width/height, or x/y)
+
+    Args:
+        element: Element dict in canvas coordinates
+        scale: (x, y) canvas -> image scale
+        size: Image (width, height) the box is clipped to
+
+    Returns:
+        (left, top, right, bottom), or None if it lies outside the image
+    """
+    left = element.get("left", element.get("x"))
+    top = element.get("top", element.get("y"))
+    if left is None or top is None:
+        return None
+    width = (element.get("width") or 0) * (element.get("scaleX") or 1)
+    height = (element.get("height") or 0) * (element.get("scaleY") or 1)
+
+    box = (
+        int(np.floor(left * scale[0])), int(np.floor(top * scale[1])),
+        int(np.ceil((left + width) * scale[0])), int(np.ceil((top + height) * scale[1]))
+    )
+    box = (max(0, box[0]), max(0, box[1]), min(size[0], box[2]), min(size[1], box[3]))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return None
+    return box
+
+
+def is_large_text(element):
+    """WCAG large text, as WCAGContrastRule decides it"""
+    font_size = element.get("fontSize") or 0
+    bold = str(element.get("fontWeight", "")).lower() in ("bold", "bolder", "600", "700", "800", "900")
+    return font_size >= 24 or (font_size >= 18 and bold)
+
+
+def text_contrast(region_rgb, fill=None):
+    """
+    Contrast of one text region against its local background
+
+    With a declared fill, pixels near that color are the text; otherwise
+    the region is split at its mean luminance and the smaller class is
+    taken as the text. Glyph edges are excluded from the background.
+
+    Text that can't be told apart from its background (a fill within
+    COLOR_TOLERANCE of every pixel, or a uniform region) is measured
+    against the whole region, so it reports a ratio near 1 and fails.
+
+    Returns:
+        dict with contrast (at CONTRAST_PERCENTILE), median_contrast and the
+        measured colors
+    """
+    region_lum = luminance(region_rgb)
+
+    if fill is not None:
+        text = color_distance(region_rgb, fill) <= COLOR_TOLERANCE
+        text_lum = float(luminance(np.asarray(fill, dtype=np.uint8)[None, None])[0, 0])
+        text_color = _hex(fill)
+    else:
+        dark = region_lum <= region_lum.mean()
+        text = dark if dark.sum() <= dark.size / 2 else ~dark
+        if not text.any():
+            # Uniform region: any text in it is the background's color
+            text = np.ones_like(dark)
+        text_lum = float(np.median(region_lum[text]))
+        text_color = _hex(np.median(region_rgb[text], axis=0))
+
+    background = ~_dilate(text, GLYPH_EDGE_PX)
+    if not background.any():
+        background = np.ones_like(background)
+
+    ratios = contrast_ratio(text_lum, region_lum[background])
+    return {
+        "contrast": round(float(np.percentile(ratios, CONTRAST_PERCENTILE)), 2),
+        "median_contrast": round(float(np.median(ratios)), 2),
+        "text_color": text_color,
+        "background_color": _hex(np.median(region_rgb[background], axis=0)),
+        "text_coverage": round(float(text.mean()), 3)
+    }
+
+
+def safe_zone_boxes(creative, canvas_size, scale, size):
+    """Named safe-zone boxes in image px, from creative["safeZone"] or the format"""
+    canvas_width, canvas_height = canvas_size
+    zone = creative.get("safeZone")
+    if zone is None:
+        fractions = SAFE_ZONES.get(creative.get("format"))
+        if fractions is None:
+            return {}
+        zone = {"top": fractions[0] * canvas_height, "bottom": fractions[1] * canvas_height}
+
+    boxes = {}
+    if zone.get("top"):
+        boxes["top"] = (0, 0, canvas_width, zone["top"])
+    if zone.get("bottom"):
+        boxes["bottom"] = (0, canvas_height - zone["bottom"], canvas_width, canvas_height)
+    if zone.get("left"):
+        boxes["left"] = (0, 0, zone["left"], canvas_height)
+    if zone.get("right"):
+        boxes["right"] = (canvas_width - zone["right"], 0, canvas_width, canvas_height)
+
+    clipped = {}
+    for name, (left, top, right, bottom) in boxes.items():
+        box = element_box({"left": left, "top": top, "width": right - left, "height": bottom - top},
+                          scale, size)
+        if box is not None:
+            clipped[name] = box
+    return clipped
+
+
+def _exclude_backgrounds(mask, elements, scale, size):
+    """
+    Drop isBackground layers (backdrop images, full-canvas shapes) from the
+    content mask, keeping whatever other elements' boxes cover on top of them
+    """
+    backgrounds = np.zeros(mask.shape, dtype=bool)
+    foreground = np.zeros(mask.shape, dtype=bool)
+    for element in elements:
+        box = element_box(element, scale, size)
+        if box is None:
+            continue
+        left, top, right, bottom = box
+        layer = backgrounds if element.get("isBackground") else foreground
+        layer[top:bottom, left:right] = True
+
+    if not backgrounds.any():
+        return mask
+    return mask & (~backgrounds | foreground)
+
+
+def analyze_creative(image, creative=None, canvas_size=None):
+    """
+    Contrast, safe-zone and coverage checks for one rendered creative
+
+    Args:
+        image: PIL image of the render (RGBA keeps the layers' transparency)
+        creative: Editor data as the Node rules get it: format,
+            backgroundColor, canvasWidth/canvasHeight, elements (left, top,
+            width, height, type, fill, fontSize, fontWeight, isPackshot,
+            isBackground) and an optional safeZone {top, bottom, left, right}
+        canvas_size: Canvas (width, height) the element boxes refer to when
+            the creative doesn't say; defaults to the image size
+
+    Returns:
+        dict with success status, contrast, safe_zones and coverage
+    """
+    try:
+        creative = creative or {}
+        elements = creative.get("elements") or []
+        size = image.size
+        canvas_size = (
+            creative.get("canvasWidth") or (canvas_size or size)[0],
+            creative.get("canvasHeight") or (canvas_size or size)[1]
+        )
+        # Exports at 2x, or downscaled on ingest, keep canvas coordinates
+        scale = (size[0] / canvas_size[0], size[1] / canvas_size[1])
+
+        with span("analyze"):
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            pixels = np.asarray(image)
+            rgb = pixels[..., :3]
+            alpha = pixels[..., 3] if image.mode == "RGBA" else None
+            if alpha is not None and alpha.min() == 255:
+                alpha = None
+
+            background = parse_color(creative.get("backgroundColor"))
+            mask, mask_source = content_mask(rgb, alpha, background)
+            mask = _exclude_backgrounds(mask, elements, scale, size)
+
+            contrast = []
+            for index, element in enumerate(elements):
+                if element.get("type") not in TEXT_TYPES:
+                    continue
+                box = element_box(element, scale, size)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                # Transparent layers are judged over the creative's background
+                region = flatten(rgb[top:bottom, left:right],
+                                 None if alpha is None else alpha[top:bottom, left:right],
+                                 background or NAMED_COLORS["white"])
+                measured = text_contrast(region, parse_color(element.get("fill")))
+                required = WCAG_AA_LARGE if is_large_text(element) else WCAG_AA_NORMAL
+                contrast.append({
+                    "element": f"text_{index}",
+                    "box": list(box),
+                    "required": required,
+                    "passed": measured["contrast"] >= required,
+                    **measured
+                })
+
+            safe_zones = []
+            for name, (left, top, right, bottom) in safe_zone_boxes(creative, canvas_size, scale, size).items():
+                count = int(np.count_nonzero(mask[top:bottom, left:right]))
+                intrusion = count / ((right - left) * (bottom - top))
+                safe_zones.append({
+                    "zone": name,
+                    "box": [left, top, right, bottom],
+                    "content_pixels": count,
+                    "intrusion_ratio": round(intrusion, 4),
+                    "passed": intrusion <= SAFE_ZONE_TOLERANCE
+                })
+
+            coverage = {"content_ratio": round(np.count_nonzero(mask) / mask.size, 4), "packshots": []}
+            union = None
+            for index, element in enumerate(elements):
+                if element.get("type") != "packshot" and not element.get("isPackshot"):
+                    continue
+                box = element_box(element, scale, size)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                count = int(np.count_nonzero(mask[top:bottom, left:right]))
+                coverage["packshots"].append({
+                    "element": f"element_{index}",
+                    "box": list(box),
+                    "fill_ratio": round(count / ((right - left) * (bottom - top)), 4)
+                })
+                if union is None:
+                    union = np.zeros(mask.shape, dtype=bool)
+                union[top:bottom, left:right] = True
+            if union is not None:
+                # Share of the canvas the products cover, overlaps counted once
+                coverage["product_ratio"] = round(np.count_nonzero(mask & union) / mask.size, 4)
+
+        return {
+            "success": True,
+            "dimensions": {"width": size[0], "height": size[1]},
+            "canvas": {"width": canvas_size[0], "height": canvas_size[1]},
+            "content_mask": mask_source,
+            "passed": all(c["passed"] for c in contrast) and all(z["passed"] for z in safe_zones),
+            "contrast": contrast,
+            "safe_zones": safe_zones,
+            "coverage": coverage
+        }
+
+    except Exception as e:
+        print(f"❌ Compliance analysis error: {e}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
@@ -0,0 +1,112 @@
+"""
+In-memory ad composition
+Places a background-removed product onto a background with optional drop
+shadow, without any intermediate encode
+"""
+
+from PIL import Image, ImageFilter, ImageOps
+
+from image_processing.compliance_analysis import parse_color
+
+# Named anchor points for the product center, as fractions of the canvas
+PLACEMENTS = {
+    'center': (0.5, 0.5),
+    'top': (0.5, 0.3),
+    'bottom': (0.5, 0.68),
+    'left': (0.3, 0.5),
+    'right': (0.7, 0.5),
+    'bottom-left': (0.3, 0.68),
+    'bottom-right': (0.7, 0.68)
+}
+
+
+def parse_placement(placement):
+    """Named placement or "x,y" fractions of the canvas"""
+    if placement in PLACEMENTS:
+        return PLACEMENTS[placement]
+
+    try:
+        x, y = (float(v) for v in placement.split(","))
+    except (ValueError, AttributeError):
+        raise ValueError(f"Invalid placement: {placement}")
+
+    if not (0 <= x <= 1 and 0 <= y <= 1):
+        raise ValueError(f"Placement must be fractions between 0 and 1: {placement}")
+
+    return x, y
+
+
+def parse_background_color(color):
+    """#rgb, #rrggbb, white or black as an RGB tuple"""
+    rgb = parse_color(color)
+    if rgb is None:
+        raise ValueError(f"Invalid background_color: {color} (use #rrggbb)")
+    return rgb
+
+
+def solid_background(rgb, width, height):
+    return Image.new('RGB', (width, height), rgb)
+
+
+def fit_background(image, width, height):
+    """Cover-fit a background to the canvas size"""
+    image = image.convert('RGB')
+    if image.size == (width, height):
+        return image
+    return ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+
+
+def composite_product(background, product, placement=(0.5, 0.5), scale=0.6,
+                      shadow=True, shadow_opacity=0.35):
+    """
+    Composite a cutout product onto a background
+
+    Args:
+        background: RGB canvas (already at output size)
+        product: RGBA product cutout
+        placement: (x, y) canvas fractions for the product center
+        scale: Max share of the canvas width/height the product may fill
+        shadow: Add a soft drop shadow from the product's alpha
+        shadow_opacity: Shadow strength (0-1)
+
+    Returns:
+        (RGB composite, product box dict)
+    """
+    canvas = background.convert('RGBA')
+    product = product.convert('RGBA')
+
+    # Scale the visible object, not its transparent margins
+    bbox = product.getchannel('A').getbbox()
+    if bbox:
+        product = product.crop(bbox)
+
+    max_w, max_h = canvas.width * scale, canvas.height * scale
+    ratio = min(max_w / product.width, max_h / product.height)
+    size = (max(1, round(product.width * ratio)), max(1, round(product.height * ratio)))
+    product = product.resize(size, Image.Resampling.LANCZOS)
+
+    # Center on the anchor, clamped so the product stays on canvas
+    x = round(placement[0] * canvas.width - size[0] / 2)
+    y = round(placement[1] * canvas.height - size[1] / 2)
+    x = min(max(0, x), canvas.width - size[0])
+    y = min(max(0, y), canvas.height - size[1])
+
+    if shadow:
+        blur = max(2, round(min(size) * 0.04))
+        offset = (round(size[0] * 0.02), round(size[1] * 0.04))
+        alpha = product.getchannel('A').point(lambda a: round(a * shadow_opacity))
+
+        # Padded so the blur isn't clipped at the product edges
+        shadow_layer = Image.new('L', (size[0] + blur * 4, size[1] + blur * 4), 0)
+        shadow_layer.paste(alpha, (blur * 2, blur * 2))
+        shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(blur))
+
+        shadow_rgba = Image.new('RGBA', shadow_layer.size, (0, 0, 0, 0))
+        shadow_rgba.putalpha(shadow_layer)
+        layer = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+        layer.paste(shadow_rgba, (x + offset[0] - blur * 2, y + offset[1] - blur * 2))
+        canvas = Image.alpha_composite(canvas, layer)
+
+    canvas.alpha_composite(product, (x, y))
+
+    return canvas.convert('RGB'), {"x": x, "y": y, "width": size[0], "height": size[1]}
@@ -0,0 +1,90 @@
+"""
+Inline result delivery
+Lets image endpoints answer with the result bytes themselves instead of a
+download_url, so callers skip the second request and the service skips the
+artifact write and read:
+  url       - JSON with a download_url (artifact persisted, the default)
+  binary    - the image as the body, JSON metadata in X-Image-Metadata
+  multipart - multipart/mixed: a JSON part, then one part per image
+  s3        - JSON with the object keys/presigned URLs of uploads made
+              straight from memory to the output bucket
+"""
+
+import asyncio
+import json
+import uuid
+
+from fastapi.responses import Response
+
+from image_processing.object_store import S3_OUTPUT_BUCKET, upload_bytes
+
+DELIVERY_MODES = ("url", "binary", "multipart", "s3")
+
+METADATA_HEADER = "X-Image-Metadata"
+
+
+def parse_delivery(delivery):
+    delivery = (delivery or "url").lower()
+    if delivery not in DELIVERY_MODES:
+        raise ValueError(f"Unknown delivery: {delivery} (use {', '.join(DELIVERY_MODES)})")
+    if delivery == "s3" and not S3_OUTPUT_BUCKET:
+        raise ValueError("s3 delivery needs S3_OUTPUT_BUCKET (or AWS_S3_BUCKET)")
+    return delivery
+
+
+def binary_response(data, media_type, filename, metadata):
+    """Image bytes as the body; metadata as ASCII JSON in a header"""
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="{filename}"',
+            METADATA_HEADER: json.dumps(metadata, separators=(",", ":"))
+        }
+    )
+
+
+def multipart_response(metadata, parts):
+    """
+    multipart/mixed body: the JSON metadata first, then each image
+
+    Args:
+        metadata: JSON-serializable dict
+        parts: (filename, media type, bytes) per image
+    """
+    boundary = uuid.uuid4().hex
+    chunks = [
+        f"--{boundary}\r\n"
+        f"Content-Type: application/json\r\n"
+        f'Content-Disposition: inline; name="metadata"\r\n\r\n'.encode(),
+        json.dumps(metadata).encode(),
+        b"\r\n"
+    ]
+    for filename, media_type, data in parts:
+        chunks += [
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f'Content-Disposition: inline; name="image"; filename="{filename}"\r\n'
+            f"Content-Length: {len(data)}\r\n\r\n".encode(),
+            data,
+            b"\r\n"
+        ]
+    chunks.append(f"--{boundary}--\r\n".encode())
+
+    return Response(content=b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+async def deliver(delivery, metadata, parts):
+    """Response for a non-url delivery mode (binary takes a single image)"""
+    if delivery == "s3":
+        objects = await asyncio.gather(*(
+            asyncio.to_thread(upload_bytes, data, filename, media_type)
+            for filename, media_type, data in parts
+        ))
+        return {**metadata, "objects": list(objects)}
+    if delivery == "binary":
+        if len(parts) != 1:
+            raise ValueError("binary delivery returns exactly one image; use multipart")
+        filename, media_type, data = parts[0]
+        return binary_response(data, media_type, filename, metadata)
+    return multipart_response(metadata, parts)
@@ -0,0 +1,220 @@
+"""
+Target-size image encoding
+Binary-searches quality (then scale) against in-memory buffers so a size
+target is hit in ~log2 encode attempts instead of a linear walk
+"""
+
+import io
+import numpy as np
+from PIL import Image
+
+FORMAT_ALIASES = {
+    'JPG': 'JPEG',
+    'JPEG': 'JPEG',
+    'PNG': 'PNG',
+    'WEBP': 'WEBP'
+}
+
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp'
+}
+
+FORMAT_MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp'
+}
+
+# Formats whose size responds to a quality setting
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+# Formats that keep a cutout's alpha (WEBP is encoded lossless)
+CUTOUT_FORMATS = ('PNG', 'WEBP')
+
+
+def normalize_format(format):
+    """Map a user-supplied format name to the PIL format name"""
+    normalized = FORMAT_ALIASES.get(str(format).upper())
+    if not normalized:
+        raise ValueError(f"Unsupported format: {format}")
+    return normalized
+
+
+def prepare_for_format(image, format):
+    """Flatten transparency onto white for formats without alpha"""
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA')
+        rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+        rgb_image.paste(image, mask=image.split()[3])
+        return rgb_image
+
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        return image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    return image
+
+
+def encode_image(image, format='JPEG', quality=85):
+    """Encode an image to bytes in memory"""
+    buffer = io.BytesIO()
+    if format == 'PNG':
+        image.save(buffer, format='PNG', optimize=True)
+    elif format == 'WEBP':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def alpha_bbox(image, padding=0, threshold=0):
+    """
+    Box around the pixels whose alpha is above threshold
+
+    Args:
+        image: RGBA PIL image
+        padding: Pixels added on every side (clamped to the image)
+        threshold: Alpha at or below this counts as empty
+
+    Returns:
+        (left, top, right, bottom), or None if the image is fully transparent
+    """
+    alpha = image.getchannel('A')
+    if threshold:
+        alpha = alpha.point(lambda value: 255 if value > threshold else 0)
+    box = alpha.getbbox()
+    if box is None:
+        return None
+
+    left, top, right, bottom = box
+    return (max(0, left - padding), max(0, top - padding),
+            min(image.width, right + padding), min(image.height, bottom + padding))
+
+
+def clear_transparent(image):
+    """
+    Zero the color of fully transparent pixels
+    They're invisible, but the original background left under them costs
+    the encoder most of a cutout's bytes and time.
+    """
+    pixels = np.array(image)
+    pixels[pixels[..., 3] == 0, :3] = 0
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def encode_cutout(image, format='PNG', compress_level=6, webp_method=1):
+    """
+    Encode an RGBA cutout losslessly
+
+    Args:
+        image: RGBA PIL image
+        format: PNG or WEBP (lossless)
+        compress_level: zlib level for PNG, 1 (fastest) to 9 (smallest)
+        webp_method: WebP effort, 0 (fastest) to 6 (smallest)
+
+    Returns:
+        Encoded bytes
+    """
+    format = normalize_format(format)
+    if format not in CUTOUT_FORMATS:
+        raise ValueError(f"Cutouts need an alpha channel: use {' or '.join(CUTOUT_FORMATS)}")
+
+    image = clear_transparent(image)
+    buffer = io.BytesIO()
+    if format == 'WEBP':
+        image.save(buffer, format='WEBP', lossless=True, method=webp_method)
+    else:
+        image.save(buffer, format='PNG', compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def encode_to_target(image, target_size_kb=500, format='JPEG', min_quality=60,
+                     max_quality=95, resize_quality=85, min_scale=0.5, backend=None):
+    """
+    Encode an image to the highest quality (then largest scale) under a size target
+
+    Args:
+        image: PIL image, or an image of the given imaging backend
+        target_size_kb: Maximum encoded size
+        format: JPEG, PNG or WEBP
+        min_quality / max_quality: Quality search range for lossy formats
+        resize_quality: Quality used once downscaling is required
+        min_scale: Smallest scale factor tried before giving up
+        backend: Imaging backend that resizes and encodes (default: PIL)
+
+    Returns:
+        dict with success status, encoded bytes and search metadata
+    """
+    if backend is None:
+        from image_processing.imaging import PIL_BACKEND as backend
+
+    format = normalize_format(format)
+    image = backend.prepare(image, format)
+    target_bytes = target_size_kb * 1024
+    attempts = 0
+
+    def encode(img, quality):
+        nonlocal attempts
+        attempts += 1
+        return backend.encode(img, format, quality)
+
+    def result(data, quality, img):
+        width, height = backend.size(img)
+        return {
+            "success": True,
+            "data": data,
+            "format": format,
+            "size_kb": round(len(data) / 1024, 2),
+            "quality": quality if format in LOSSY_FORMATS else None,
+            "dimensions": {"width": width, "height": height},
+            "encode_attempts": attempts
+        }
+
+    # Quality search: highest quality that fits
+    if format in LOSSY_FORMATS:
+        data = encode(image, max_quality)
+        if len(data) <= target_bytes:
+            return result(data, max_quality, image)
+
+        best = None
+        low, high = min_quality, max_quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode(image, quality)
+            if len(data) <= target_bytes:
+                best = (data, quality)
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best:
+            return result(best[0], best[1], image)
+    else:
+        data = encode(image, None)
+        if len(data) <= target_bytes:
+            return result(data, None, image)
+
+    # Scale search: largest size (in 1% steps) that fits at resize_quality
+    best = None
+    width, height = backend.size(image)
+    low, high = int(min_scale * 100), 99
+    while low <= high:
+        percent = (low + high) // 2
+        new_size = (max(1, width * percent // 100), max(1, height * percent // 100))
+        resized = backend.resize(image, new_size)
+        data = encode(resized, resize_quality)
+        if len(data) <= target_bytes:
+            best = (data, resized)
+            low = percent + 1
+        else:
+            high = percent - 1
+
+    if best:
+        return result(best[0], resize_quality if format in LOSSY_FORMATS else None, best[1])
+
+    return {
+        "success": False,
+        "error": "Could not optimize to target size",
+        "encode_attempts": attempts
+    }
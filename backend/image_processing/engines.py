@@ -0,0 +1,133 @@
+"""
+Heavy engine loading and startup warmup
+rembg/onnxruntime, scikit-learn and the Stability SDK are imported on first
+use rather than at module load, so a replica only pays for the engines it
+actually serves. PRELOAD names the engines warmed at startup instead; the
+readiness endpoint reports on them.
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+
+from image_processing.instrumentation import record_span
+
+ENGINES = ("rembg", "sklearn", "stability")
+# Engines a prefork parent may warm and share; gRPC channels don't survive fork()
+FORK_SAFE_ENGINES = ("rembg", "sklearn")
+
+
+def parse_preload(value):
+    """Comma-separated engine names, or "all" / "none" """
+    value = (value or "").strip().lower()
+    if value in ("", "none"):
+        return []
+    if value == "all":
+        return list(ENGINES)
+
+    engines = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown PRELOAD engine(s): {', '.join(unknown)} (use {', '.join(ENGINES)})")
+    return engines
+
+
+PRELOAD = parse_preload(os.getenv("PRELOAD", ""))
+
+# module name -> import time in ms, for modules loaded through load_module
+import_timings = {}
+_import_lock = threading.Lock()
+
+# engine -> {"state": pending|warming|ready|failed, "warmup_ms", "error"}
+engine_status = {name: {"state": "pending"} for name in PRELOAD}
+
+
+def load_module(name):
+    """Import a heavy module on first use, recording how long it took"""
+    # A module can be in sys.modules while another thread is still running
+    # its body (e.g. PRELOAD warmup); import_module waits for it to finish
+    # on the module's import lock, so it is always called
+    if name in sys.modules:
+        return importlib.import_module(name)
+
+    with _import_lock:
+        first_import = name not in sys.modules
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - started
+
+    if first_import:
+        import_timings[name] = round(elapsed * 1000, 1)
+        record_span("import", elapsed)
+        print(f"📚 Imported {name} in {elapsed:.2f} seconds")
+    return module
+
+
+def _warm_rembg():
+    from image_processing.background_removal import warm_up
+    warm_up()
+
+
+def _warm_sklearn():
+    from image_processing.color_extraction import warm_up
+    warm_up()
+
+
+def _warm_stability():
+    from image_processing.stability_client import init_stability_pool
+    init_stability_pool()
+
+
+WARMERS = {
+    "rembg": _warm_rembg,
+    "sklearn": _warm_sklearn,
+    "stability": _warm_stability
+}
+
+
+def warm_engines(engines=None):
+    """
+    Import and warm engines (blocking)
+
+    Args:
+        engines: Engine names; defaults to PRELOAD
+
+    Returns:
+        True if every engine warmed successfully
+    """
+    engines = PRELOAD if engines is None else engines
+    ok = True
+
+    for name in engines:
+        status = engine_status.setdefault(name, {})
+        status.update({"state": "warming", "error": None})
+        started = time.perf_counter()
+        try:
+            WARMERS[name]()
+            status["state"] = "ready"
+        except Exception as e:
+            ok = False
+            status.update({"state": "failed", "error": str(e)})
+            print(f"❌ Warmup of {name} failed: {e}")
+        status["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"🔥 {name} {status['state']} in {status['warmup_ms'] / 1000:.2f} seconds")
+
+    return ok
+
+
+def pending_engines():
+    """Preloaded engines not warmed yet (e.g. by a prefork parent)"""
+    return [name for name in PRELOAD if engine_status[name]["state"] != "ready"]
+
+
+def readiness():
+    """(ready, details): ready once every preloaded engine has warmed"""
+    ready = all(status["state"] == "ready" for status in engine_status.values())
+    return ready, {
+        "ready": ready,
+        "preload": PRELOAD,
+        "engines": engine_status,
+        "imports_ms": import_timings
+    }
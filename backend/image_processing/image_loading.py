@@ -0,0 +1,72 @@
+"""
+Shared image loading
+Decodes JPEGs at reduced scale (libjpeg DCT scaling via PIL's draft mode)
+when the caller only needs a smaller image, so analysis paths skip most of
+the decode work and memory of large photos
+"""
+
+import io
+import math
+
+from PIL import ExifTags, Image, ImageOps
+
+# EXIF orientations that swap width and height when applied
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def open_image(source):
+    """Lazily open a path, bytes or file object (header only, no decode)"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def load_image(source, min_size=None, mode=None, exif_transpose=False):
+    """
+    Decode an image at the smallest scale that still covers min_size
+
+    JPEGs decode at 1/2, 1/4 or 1/8 scale when that is still at least
+    min_size in both dimensions; other formats decode at full size.
+
+    Args:
+        source: Path, bytes, file object or a lazily opened image
+        min_size: (width, height) the result must cover, in display
+            orientation; None decodes at full resolution
+        mode: Convert to this mode after decoding
+        exif_transpose: Apply the EXIF orientation
+
+    Returns:
+        Decoded PIL image
+    """
+    image = open_image(source)
+
+    orientation = 1
+    if exif_transpose:
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+
+    if min_size:
+        width, height = min_size
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        # Grayscale can also skip the YCbCr -> RGB conversion
+        image.draft('L' if mode == 'L' else None, (max(1, math.ceil(width)), max(1, math.ceil(height))))
+
+    image.load()
+
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def load_thumbnail(source, max_size, mode='RGB'):
+    """Decode straight to a thumbnail that fits within max_size"""
+    image = open_image(source)
+    # Only the thumbnail's own size needs covering, not max_size in both axes
+    scale = min(max_size[0] / image.width, max_size[1] / image.height, 1)
+    image = load_image(image, min_size=(image.width * scale, image.height * scale), mode=mode)
+    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+    return image
@@ -0,0 +1,237 @@
+"""
+Pluggable imaging backend
+Resize and encode paths go through a backend chosen by IMAGING_BACKEND:
+  pil  - Pillow, decoding the whole image into memory (the default)
+  vips - libvips via pyvips: images are lazy pipelines streamed from the
+         source in strips, with shrink-on-load for JPEG/WebP, so memory
+         stays near the output size rather than the source size
+  auto - vips when pyvips is installed, otherwise pil
+A missing pyvips falls back to pil, so the service always starts.
+libvips reads VIPS_CONCURRENCY for its per-image thread count.
+"""
+
+import os
+
+from PIL import Image, ImageOps
+
+from image_processing.admission import downscale_on_ingest
+from image_processing.encoding import encode_image, prepare_for_format
+from image_processing.engines import load_module
+from image_processing.image_loading import load_image, load_thumbnail
+
+IMAGING_BACKEND = os.getenv("IMAGING_BACKEND", "pil").lower()
+IMAGING_BACKENDS = ("pil", "vips", "auto")
+
+_backend = None
+
+
+class PILBackend:
+    """Images are decoded PIL images"""
+
+    name = "pil"
+    # Whole images are held in memory between steps
+    streaming = False
+
+    def load(self, source, min_size=None):
+        """Decode a path, bytes or file object (JPEGs at reduced scale when min_size allows)"""
+        return load_image(source, min_size)
+
+    def ingest(self, image):
+        return downscale_on_ingest(image)
+
+    def from_pil(self, image):
+        return image
+
+    def size(self, image):
+        return image.size
+
+    def prepare(self, image, format):
+        return prepare_for_format(image, format)
+
+    def resize(self, image, size):
+        return image.resize(size, Image.Resampling.LANCZOS)
+
+    def fit(self, image, size):
+        """Crop to the aspect of size around the centre, then resize"""
+        return ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+
+    def encode(self, image, format, quality):
+        return encode_image(image, format, quality)
+
+    def thumbnail(self, source, max_size, mode='RGB'):
+        """Decoded PIL image that fits within max_size"""
+        return load_thumbnail(source, max_size, mode)
+
+
+class VipsPipeline:
+    """
+    Recipe from a source to an image; nothing is decoded until it is encoded
+
+    Args:
+        source: Path, bytes, PIL image or an in-memory vips image
+        width / height: Source dimensions
+        resize: (width, height) to shrink-on-load to, or None
+        crop: Crop to the aspect of resize around the centre instead of stretching
+        flatten: Composite alpha onto white (for JPEG)
+    """
+
+    def __init__(self, source, width, height, resize=None, crop=False, flatten=False):
+        self.source = source
+        self.width = width
+        self.height = height
+        self.resize = resize
+        self.crop = crop
+        self.flatten = flatten
+
+    def derive(self, **changes):
+        return VipsPipeline(**{**vars(self), **changes})
+
+
+class VipsBackend:
+    """Images are VipsPipelines, opened afresh by every encode"""
+
+    name = "vips"
+    streaming = True
+
+    def __init__(self):
+        self.pyvips = load_module("pyvips")
+        # Every request reads a different source; libvips' operation cache
+        # would only hold on to their pixels
+        self.pyvips.cache_set_max(0)
+
+    def load(self, source, min_size=None):
+        """Read the header only; min_size is moot since every resize shrinks on load"""
+        if isinstance(source, Image.Image):
+            return self.from_pil(source)
+        if not isinstance(source, (str, bytes)):
+            source = source.read()
+        if isinstance(source, str):
+            header = self.pyvips.Image.new_from_file(source)
+        else:
+            header = self.pyvips.Image.new_from_buffer(source, "")
+        return VipsPipeline(source, header.width, header.height)
+
+    def ingest(self, image):
+        # Oversized sources never reach memory: every output is shrunk on load
+        return image
+
+    def from_pil(self, image):
+        # Copied in once, not once per encode attempt
+        return VipsPipeline(self._in_memory(image), image.width, image.height)
+
+    def size(self, image):
+        return image.resize or (image.width, image.height)
+
+    def prepare(self, image, format):
+        image = image.derive(flatten=format == 'JPEG')
+        if image.resize:
+            # Shrunk outputs are small: decode once, and let every quality
+            # attempt encode from memory instead of re-reading the source
+            pixels = self.open(image).copy_memory()
+            return VipsPipeline(pixels, pixels.width, pixels.height)
+        return image
+
+    def resize(self, image, size):
+        return image.derive(resize=size, crop=False)
+
+    def fit(self, image, size):
+        return image.derive(resize=size, crop=True)
+
+    def _in_memory(self, image):
+        """vips image for an in-memory source (PIL images are copied in)"""
+        if isinstance(image, self.pyvips.Image):
+            return image
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        bands = len(image.getbands())
+        vips_image = self.pyvips.Image.new_from_memory(image.tobytes(), image.width, image.height, bands, "uchar")
+        return vips_image.copy(interpretation="srgb" if bands >= 3 else "b-w")
+
+    def open(self, pipeline):
+        """Build the streaming vips image for a pipeline"""
+        vips = self.pyvips
+        source = pipeline.source
+
+        if pipeline.resize:
+            width, height = pipeline.resize
+            # no_rotate matches PIL, which ignores the EXIF orientation here
+            options = {"height": height, "no_rotate": True}
+            options.update({"crop": "centre"} if pipeline.crop else {"size": "force"})
+            if isinstance(source, str):
+                image = vips.Image.thumbnail(source, width, **options)
+            elif isinstance(source, bytes):
+                image = vips.Image.thumbnail_buffer(source, width, **options)
+            else:
+                image = self._in_memory(source).thumbnail_image(width, **options)
+        elif isinstance(source, str):
+            image = vips.Image.new_from_file(source, access="sequential")
+        elif isinstance(source, bytes):
+            image = vips.Image.new_from_buffer(source, "", access="sequential")
+        else:
+            image = self._in_memory(source)
+
+        # CMYK, 16-bit and other exotic inputs become 8-bit sRGB/grey
+        if image.interpretation not in ("srgb", "b-w"):
+            image = image.colourspace("srgb")
+        if image.format != "uchar":
+            image = image.cast("uchar", shift=True)
+        if pipeline.flatten and image.hasalpha():
+            image = image.flatten(background=[255] * (image.bands - 1))
+        return image
+
+    def encode(self, image, format, quality):
+        image = self.open(image)
+        if format == 'PNG':
+            return image.pngsave_buffer(compression=9)
+        if format == 'WEBP':
+            return image.webpsave_buffer(Q=quality, effort=4)
+        return image.jpegsave_buffer(Q=quality, optimize_coding=True, strip=True)
+
+    def thumbnail(self, source, max_size, mode='RGB'):
+        """Decoded PIL image that fits within max_size, shrunk on load"""
+        if isinstance(source, Image.Image):
+            return load_thumbnail(source, max_size, mode)
+        if not isinstance(source, (str, bytes)):
+            source = source.read()
+
+        options = {"height": max_size[1], "size": "down", "no_rotate": True}
+        if isinstance(source, str):
+            image = self.pyvips.Image.thumbnail(source, max_size[0], **options)
+        else:
+            image = self.pyvips.Image.thumbnail_buffer(source, max_size[0], **options)
+
+        if image.format != "uchar":
+            image = image.cast("uchar", shift=True)
+        if mode == 'L':
+            image = image.colourspace("b-w")
+        elif image.interpretation != "srgb":
+            image = image.colourspace("srgb")
+        # Like PIL's convert, alpha is dropped rather than composited
+        bands = 1 if mode == 'L' else 3
+        if image.bands > bands:
+            image = image.extract_band(0, n=bands)
+        return Image.frombytes(mode, (image.width, image.height), image.write_to_memory())
+
+
+PIL_BACKEND = PILBackend()
+
+
+def create_backend(name=IMAGING_BACKEND):
+    if name not in IMAGING_BACKENDS:
+        raise ValueError(f"Unknown IMAGING_BACKEND: {name} (use {', '.join(IMAGING_BACKENDS)})")
+    if name != "pil":
+        try:
+            return VipsBackend()
+        except (ImportError, OSError) as e:
+            if name == "vips":
+                print(f"⚠️ pyvips unavailable ({e}), falling back to PIL imaging")
+    return PIL_BACKEND
+
+
+def get_backend():
+    """Process-wide backend, created on first use (after any prefork)"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+        print(f"🧱 Imaging backend: {_backend.name}")
+    return _backend
@@ -0,0 +1,231 @@
+"""
+Per-request stage instrumentation
+Named stage spans are collected in a context variable for the current
+request (it follows asyncio.to_thread and the Stability executor), then
+surfaced as a Server-Timing header, in response metadata and as Prometheus
+histograms. Every Nth request can also be captured by a sampling profiler.
+"""
+
+import contextvars
+import glob
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest, multiprocess
+from starlette.routing import Match
+
+# Set (before start) to aggregate metrics across prefork workers
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# 0 disables; otherwise one request in N is profiled
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "image_service_request_seconds",
+    "Request latency until the response completes",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "image_service_stage_seconds",
+    "Time spent in a named processing stage",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class RequestSpans:
+    """Stage durations for one request; repeated stages accumulate"""
+
+    def __init__(self):
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def as_ms(self):
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.durations.items()}
+
+
+def record_span(name, seconds):
+    """Add a measured duration to the current request, if there is one"""
+    spans = _spans.get()
+    if spans is not None:
+        spans.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time a block as a named stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def stage_timings():
+    """Stages recorded so far in the current request, in ms"""
+    spans = _spans.get()
+    return spans.as_ms() if spans is not None else {}
+
+
+def server_timing_header(timings_ms):
+    return ", ".join(
+        f"{name.replace(' ', '_')};dur={duration}" for name, duration in timings_ms.items()
+    )
+
+
+class StackSampler:
+    """
+    Sampling profiler: snapshots every thread's stack at a fixed interval
+    and counts them in collapsed-stack form (flamegraph.pl / speedscope)
+    Samples all threads, so concurrent requests show up too.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = ";".join(
+                    f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                    for entry in traceback.extract_stack(frame)
+                )
+                self.stacks[stack] += 1
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def route_template(router, scope):
+    """Path template of the matched route, so metrics don't explode per file id"""
+    route = scope.get("route")
+    if route is None:
+        for candidate in router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", "unmatched")
+
+
+class StageTimingMiddleware:
+    """
+    ASGI middleware that opens a span collection per request, adds a
+    Server-Timing header when the response starts, and records request and
+    stage histograms when it completes
+    """
+
+    def __init__(self, app, router, profile_every_n=PROFILE_EVERY_N, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.router = router
+        self.profile_every_n = profile_every_n
+        self.profile_dir = profile_dir
+        self._requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        spans = RequestSpans()
+        token = _spans.set(spans)
+        started = time.perf_counter()
+        status = 500
+
+        self._requests += 1
+        sampler = None
+        if self.profile_every_n and self._requests % self.profile_every_n == 0:
+            sampler = StackSampler().start()
+
+        async def timed_receive():
+            # Upload I/O: time spent waiting on the request body
+            receive_started = time.perf_counter()
+            message = await receive()
+            spans.add("receive", time.perf_counter() - receive_started)
+            return message
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings = {**spans.as_ms(), "total": round((time.perf_counter() - started) * 1000, 1)}
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(timings).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, timed_send)
+        finally:
+            _spans.reset(token)
+            elapsed = time.perf_counter() - started
+            endpoint = route_template(self.router, scope)
+
+            REQUEST_SECONDS.labels(endpoint, scope["method"], str(status)).observe(elapsed)
+            for name, seconds in spans.durations.items():
+                STAGE_SECONDS.labels(endpoint, name).observe(seconds)
+
+            if sampler is not None:
+                sampler.stop()
+                stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+                slug = endpoint.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+                path = os.path.join(self.profile_dir, f"{stamp}_{slug}.folded")
+                sampler.write(path)
+                print(f"🔬 Profiled {scope['method']} {scope['path']} ({elapsed:.2f}s) -> {path}")
+
+
+def metrics_payload():
+    """(body, content type) for a Prometheus scrape"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Every worker writes its own files; a scrape of any one sums them all
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def reset_multiprocess_metrics():
+    """Clear the previous run's per-worker metric files"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+def mark_worker_dead(pid):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,288 @@
+"""
+Persistent job queue for long-running image operations
+Jobs live in a local SQLite database so they survive restarts without an
+external broker; a small pool of async workers claims them in priority
+order (interactive editor work ahead of bulk catalog work)
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+JOB_INPUT_DIR = os.getenv("JOB_INPUT_DIR", "data/job_inputs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Workers that only take interactive jobs, so a bulk backlog can't starve the editor
+JOB_INTERACTIVE_WORKERS = int(os.getenv("JOB_INTERACTIVE_WORKERS", 1))
+# Finished jobs are kept this long for status polling, then deleted
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 24 * 3600))
+
+# Lower runs first
+PRIORITIES = {
+    'interactive': 0,
+    'bulk': 10
+}
+
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, created_at);
+"""
+
+
+def parse_priority(priority):
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority} (use {', '.join(PRIORITIES)})")
+    return PRIORITIES[priority]
+
+
+class JobQueue:
+    """SQLite-backed queue; one connection per process, shared behind a lock"""
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        with self._lock:
+            self._db.executescript(SCHEMA)
+            columns = [row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if "worker" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN worker INTEGER")
+
+    @property
+    def _db(self):
+        # SQLite connections must not be used across fork(), so a forked
+        # server worker opens its own instead of the parent's
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def recover(self, worker=None):
+        """
+        Requeue jobs that were running when their process stopped
+
+        Args:
+            worker: Only requeue jobs claimed by this pid (a dead server
+                worker); None requeues every running job
+        """
+        query = ("UPDATE jobs SET status = 'queued', progress = 0, message = 'requeued after restart' "
+                 "WHERE status = 'running'")
+        params = ()
+        if worker is not None:
+            query += " AND worker = ?"
+            params = (worker,)
+        with self._lock:
+            cursor = self._db.execute(query, params)
+        return cursor.rowcount
+
+    def submit(self, job_type, params, priority='interactive'):
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, type, priority, status, params, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, job_type, parse_priority(priority), json.dumps(params), time.time())
+            )
+        return job_id
+
+    def claim(self, max_priority=None):
+        """Mark the highest-priority, oldest queued job running and return it"""
+        if max_priority is None:
+            max_priority = max(PRIORITIES.values())
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND priority <= ? "
+                    "ORDER BY priority, created_at LIMIT 1",
+                    (max_priority,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, "
+                        "worker = ? WHERE id = ?",
+                        (time.time(), os.getpid(), row["id"])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._to_dict(row) if row is not None else None
+
+    def progress(self, job_id, progress, message=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                (progress, message, job_id)
+            )
+
+    def complete(self, job_id, result):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, progress = 1, message = NULL, "
+                "finished_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def position(self, job_id):
+        """Number of queued jobs that will run before this one"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) FROM jobs AS ahead, jobs AS job "
+                "WHERE job.id = ? AND job.status = 'queued' AND ahead.status = 'queued' "
+                "AND (ahead.priority < job.priority OR "
+                "(ahead.priority = job.priority AND ahead.created_at < job.created_at))",
+                (job_id,)
+            ).fetchone()
+        return row[0]
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, priority, COUNT(*) FROM jobs GROUP BY status, priority"
+            ).fetchall()
+        stats = {}
+        for status, priority, count in rows:
+            stats.setdefault(status, {})[PRIORITY_NAMES.get(priority, str(priority))] = count
+        return stats
+
+    def purge(self, max_age_seconds=JOB_RETENTION_SECONDS):
+        """Delete finished jobs older than max_age_seconds"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (time.time() - max_age_seconds,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = None
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["priority"] = PRIORITY_NAMES.get(job["priority"], job["priority"])
+        return job
+
+
+class JobWorkerPool:
+    """
+    Async workers that claim jobs and run the registered handler for their type
+
+    Handlers are coroutines taking (params, report) where report(progress,
+    message) records progress; they return the job result dict or raise.
+    """
+
+    def __init__(self, queue, handlers, workers=JOB_WORKERS,
+                 interactive_workers=JOB_INTERACTIVE_WORKERS):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        # At least one worker always takes bulk jobs
+        self.interactive_workers = min(max(0, interactive_workers), self.workers - 1)
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self, recover=True):
+        """
+        Start the workers; recover=False leaves interrupted jobs alone (a
+        prefork parent requeues them once instead of every server worker)
+        """
+        if recover:
+            requeued = self.queue.recover()
+            if requeued:
+                print(f"♻️ Requeued {requeued} interrupted jobs")
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def notify(self):
+        """Wake idle workers after a submission"""
+        self._wakeup.set()
+
+    async def _work(self, worker_id):
+        max_priority = PRIORITIES['interactive'] if worker_id < self.interactive_workers else None
+        while True:
+            job = await asyncio.to_thread(self.queue.claim, max_priority)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # Timeout covers jobs submitted by another process
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(worker_id, job)
+
+    async def _run(self, worker_id, job):
+        job_id = job["id"]
+        handler = self.handlers.get(job["type"])
+        print(f"🛠️ Worker {worker_id} running {job['type']} job {job_id} ({job['priority']})")
+
+        def report(progress, message=None):
+            self.queue.progress(job_id, progress, message)
+
+        started = time.time()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job type: {job['type']}")
+            result = await handler(job["params"], report)
+            await asyncio.to_thread(self.queue.complete, job_id, result)
+            print(f"✅ Job {job_id} finished in {time.time() - started:.2f} seconds")
+        except asyncio.CancelledError:
+            # Left 'running'; recover() requeues it on the next start
+            raise
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            print(f"❌ Job {job_id} failed: {error}")
+            await asyncio.to_thread(self.queue.fail, job_id, error)
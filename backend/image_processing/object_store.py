@@ -0,0 +1,116 @@
+"""
+Direct-to-object-storage output
+Uploads results from memory straight to an S3-compatible bucket (AWS, MinIO,
+or a local stand-in such as moto_server via S3_ENDPOINT_URL), so artifacts
+no longer travel through temp/processed and the Node backend on the way to
+S3. Large objects go up as concurrent multipart uploads over a pooled
+client shared by the process.
+"""
+
+import io
+import os
+import threading
+from datetime import datetime
+
+from image_processing.engines import load_module
+from image_processing.instrumentation import span
+
+S3_OUTPUT_BUCKET = os.getenv("S3_OUTPUT_BUCKET") or os.getenv("AWS_S3_BUCKET")
+S3_OUTPUT_PREFIX = os.getenv("S3_OUTPUT_PREFIX", "image-service/")
+S3_REGION = os.getenv("AWS_REGION")
+# e.g. http://localhost:9000 for MinIO or moto_server
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_ADDRESSING_STYLE = os.getenv("S3_ADDRESSING_STYLE", "path" if S3_ENDPOINT_URL else "auto")
+# Connections kept open to S3, shared by every upload in the process
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+# Parts uploaded in parallel per object
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 4))
+S3_MULTIPART_THRESHOLD_BYTES = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", 8)) * 1024 * 1024
+S3_MULTIPART_CHUNK_BYTES = int(os.getenv("S3_MULTIPART_CHUNK_MB", 8)) * 1024 * 1024
+# 0 returns keys only
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", 3600))
+
+_client = None
+_transfer_config = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Shared boto3 client (created on first use; boto3 is imported lazily)"""
+    global _client, _transfer_config
+
+    with _client_lock:
+        if _client is None:
+            if not S3_OUTPUT_BUCKET:
+                raise ValueError("S3_OUTPUT_BUCKET (or AWS_S3_BUCKET) not set")
+
+            boto3 = load_module("boto3")
+            botocore_config = load_module("botocore.config")
+            transfer = load_module("boto3.s3.transfer")
+
+            _client = boto3.client(
+                "s3",
+                region_name=S3_REGION,
+                endpoint_url=S3_ENDPOINT_URL,
+                config=botocore_config.Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "standard"},
+                    s3={"addressing_style": S3_ADDRESSING_STYLE}
+                )
+            )
+            _transfer_config = transfer.TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD_BYTES,
+                multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+                max_concurrency=S3_UPLOAD_CONCURRENCY,
+                use_threads=S3_UPLOAD_CONCURRENCY > 1
+            )
+            print(f"🪣 S3 output ready (bucket {S3_OUTPUT_BUCKET}"
+                  f"{', endpoint ' + S3_ENDPOINT_URL if S3_ENDPOINT_URL else ''})")
+
+    return _client
+
+
+def object_key(filename):
+    """Date-partitioned key under S3_OUTPUT_PREFIX"""
+    return f"{S3_OUTPUT_PREFIX}{datetime.utcnow():%Y/%m/%d}/{filename}"
+
+
+def presign(key, expires_in=S3_PRESIGN_SECONDS):
+    return get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": S3_OUTPUT_BUCKET, "Key": key},
+        ExpiresIn=expires_in
+    )
+
+
+def upload_bytes(data, filename, content_type):
+    """
+    Upload an in-memory result (multipart above the threshold)
+
+    Args:
+        data: Encoded bytes
+        filename: Artifact filename; the key is derived from it
+        content_type: MIME type stored on the object
+
+    Returns:
+        dict with bucket, key, size and a presigned url (None if disabled)
+    """
+    client = get_s3_client()
+    key = object_key(filename)
+
+    with span("upload"):
+        client.upload_fileobj(
+            io.BytesIO(data),
+            S3_OUTPUT_BUCKET,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_transfer_config
+        )
+
+    return {
+        "bucket": S3_OUTPUT_BUCKET,
+        "key": key,
+        "size": len(data),
+        "content_type": content_type,
+        "url": presign(key) if S3_PRESIGN_SECONDS else None
+    }
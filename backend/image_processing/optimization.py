@@ -1,61 +1,40 @@
-from PIL import Image
-import os
+from image_processing.encoding import encode_to_target
+from image_processing.imaging import get_backend
+from image_processing.instrumentation import span
 
 def optimize_image(input_path, output_path, target_size_kb=500, format='JPEG'):
-    """Optimize image to target file size"""
+    """Optimize image to target file size (output_path None returns the bytes as "data")"""
     try:
-        image = Image.open(input_path)
-        
-        # Convert RGBA to RGB if saving as JPEG
-        if format == 'JPEG' and image.mode == 'RGBA':
-            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-            rgb_image.paste(image, mask=image.split()[3] if len(image.split()) == 4 else None)
-            image = rgb_image
-        
-        # Try different quality levels
-        quality = 95
-        while quality > 60:
-            image.save(output_path, format=format, quality=quality, optimize=True)
-            
-            size_kb = os.path.getsize(output_path) / 1024
-            
-            if size_kb <= target_size_kb:
-                return {
-                    "success": True,
-                    "output_path": output_path,
-                    "size_kb": round(size_kb, 2),
-                    "quality": quality
-                }
-            
-            quality -= 5
-        
-        # If still too large, resize image
-        scale = 0.9
-        while True:
-            new_size = (int(image.width * scale), int(image.height * scale))
-            resized = image.resize(new_size, Image.Resampling.LANCZOS)
-            resized.save(output_path, format=format, quality=85, optimize=True)
-            
-            size_kb = os.path.getsize(output_path) / 1024
-            
-            if size_kb <= target_size_kb:
-                return {
-                    "success": True,
-                    "output_path": output_path,
-                    "size_kb": round(size_kb, 2),
-                    "dimensions": new_size
-                }
-            
-            scale -= 0.1
-            if scale < 0.5:
-                break
-        
+        backend = get_backend()
+        # With a streaming backend this only reads the header; decoding
+        # happens inside each encode
+        with span("decode"):
+            image = backend.load(input_path)
+
+        # Binary-search quality, then scale, entirely in memory
+        with span("encode"):
+            result = encode_to_target(image, target_size_kb, format, backend=backend)
+
+        if not result["success"]:
+            return result
+
+        # Only the final encode touches disk, if anything does
+        if output_path is not None:
+            with span("write"), open(output_path, 'wb') as f:
+                f.write(result["data"])
+
         return {
-            "success": False,
-            "error": "Could not optimize to target size"
+            "success": True,
+            "output_path": output_path,
+            "data": result["data"] if output_path is None else None,
+            "format": result["format"],
+            "size_kb": result["size_kb"],
+            "quality": result["quality"],
+            "dimensions": result["dimensions"],
+            "encode_attempts": result["encode_attempts"]
         }
     except Exception as e:
         return {
             "success": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,229 @@
+"""
+Catalog-scale palette index
+Extracts palettes for many product images in a process pool and stores them
+in a compact array-backed index for similar-color product search
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_processing.color_extraction import extract_colors, hex_to_rgb
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+DEFAULT_INDEX_PATH = "data/palette_index.npz"
+
+
+def rgb_to_lab(rgb):
+    """
+    Convert an array of sRGB colors (..., 3) in 0-255 to CIE Lab (D65)
+    Vectorized so a whole catalog converts in one pass
+    """
+    rgb = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+    matrix = np.array([
+        [0.4124, 0.3576, 0.1805],
+        [0.2126, 0.7152, 0.0722],
+        [0.0193, 0.1192, 0.9505]
+    ], dtype=np.float32)
+    xyz = linear @ matrix.T
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    l = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([l, a, b], axis=-1)
+
+
+def _extract_palette(args):
+    """Process pool worker: extract one image's palette as (rgb, weights)"""
+    image_path, n_colors = args
+    result = extract_colors(image_path, n_colors)
+
+    if not result["success"]:
+        return image_path, None, None
+
+    rgb = np.zeros((n_colors, 3), dtype=np.uint8)
+    weights = np.zeros(n_colors, dtype=np.float32)
+    for i, color in enumerate(result["colors"][:n_colors]):
+        rgb[i] = color["rgb"]
+        weights[i] = color["percentage"] / 100
+
+    return image_path, rgb, weights
+
+
+def find_catalog_images(root_dir):
+    """Recursively list product images under a catalog directory"""
+    paths = []
+    for folder, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(folder, filename))
+    paths.sort()
+    return paths
+
+
+def build_palette_index(image_paths, index_path=DEFAULT_INDEX_PATH, n_colors=5,
+                        workers=None, root_dir=None):
+    """
+    Extract palettes for a catalog and persist them as a compact .npz index
+
+    Args:
+        image_paths: List of product image paths
+        index_path: Where to write the index
+        n_colors: Palette size stored per product
+        workers: Process pool size (default: CPU count)
+        root_dir: Product ids are stored relative to this directory
+
+    Returns:
+        dict with success status and indexing stats
+    """
+    try:
+        start_time = time.time()
+        print(f"🗂️  Indexing palettes for {len(image_paths)} images...")
+
+        ids, palettes, weights, failed = [], [], [], []
+        jobs = [(path, n_colors) for path in image_paths]
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 8))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, rgb, w in pool.map(_extract_palette, jobs, chunksize=chunksize):
+                if rgb is None:
+                    failed.append(path)
+                    continue
+                ids.append(os.path.relpath(path, root_dir) if root_dir else path)
+                palettes.append(rgb)
+                weights.append(w)
+
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        # Searches reload the index when its mtime changes, so it is written
+        # beside it and swapped in whole (a file object stops numpy adding .npz)
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    ids=np.array(ids, dtype=str),
+                    palettes=np.array(palettes, dtype=np.uint8).reshape(-1, n_colors, 3),
+                    weights=np.array(weights, dtype=np.float32).reshape(-1, n_colors)
+                )
+            os.replace(temp_path, index_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        elapsed = time.time() - start_time
+        print(f"✅ Indexed {len(ids)} products in {elapsed:.1f}s ({len(failed)} failed)")
+
+        return {
+            "success": True,
+            "index_path": index_path,
+            "indexed": len(ids),
+            "failed": failed,
+            "processing_time_seconds": round(elapsed, 2)
+        }
+
+    except Exception as e:
+        print(f"❌ Palette indexing failed: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+class PaletteIndex:
+    """In-memory palette index with vectorized nearest-neighbor search"""
+
+    def __init__(self, ids, palettes, weights):
+        self.ids = ids
+        self.palettes = palettes
+        self.weights = weights
+        # Lab is computed once at load so searches are pure array math
+        self.lab = rgb_to_lab(palettes)
+        self.valid = weights > 0
+
+    @classmethod
+    def load(cls, index_path=DEFAULT_INDEX_PATH):
+        with np.load(index_path) as data:
+            return cls(data["ids"], data["palettes"], data["weights"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_colors, top_k=10):
+        """
+        Find products whose palette is closest to a set of colors
+
+        Args:
+            query_colors: List of hex colors (e.g. a brand palette)
+            top_k: Number of results to return
+
+        Returns:
+            List of matches, closest first
+        """
+        if len(self) == 0:
+            return []
+
+        query_rgb = np.array([hex_to_rgb(c) for c in query_colors], dtype=np.uint8)
+        query_lab = rgb_to_lab(query_rgb)
+
+        # (N, K, Q) CIE76 distances between every palette color and every query color
+        diff = self.lab[:, :, None, :] - query_lab[None, None, :, :]
+        distances = np.sqrt((diff ** 2).sum(axis=-1))
+        distances = np.where(self.valid[:, :, None], distances, np.inf)
+
+        # Each query color should appear in the product palette...
+        query_to_product = distances.min(axis=1).mean(axis=1)
+        # ...and the product's dominant colors should be on-brand
+        product_to_query = (distances.min(axis=2) * self.weights).sum(axis=1, where=self.valid)
+        product_to_query /= np.maximum(self.weights.sum(axis=1), 1e-6)
+
+        scores = (query_to_product + product_to_query) / 2
+
+        top_k = min(top_k, len(scores))
+        nearest = np.argpartition(scores, top_k - 1)[:top_k]
+        nearest = nearest[np.argsort(scores[nearest])]
+
+        return [
+            {
+                "product_id": str(self.ids[i]),
+                "distance": round(float(scores[i]), 2),
+                "palette": [
+                    {
+                        "hex": "#{:02x}{:02x}{:02x}".format(*(int(c) for c in rgb)),
+                        "percentage": round(float(w) * 100, 2)
+                    }
+                    for rgb, w, ok in zip(self.palettes[i], self.weights[i], self.valid[i]) if ok
+                ]
+            }
+            for i in nearest
+        ]
+
+
+if __name__ == "__main__":
+    # Batch indexing job: python -m image_processing.palette_index <catalog_dir> [index_path]
+    if len(sys.argv) > 1:
+        catalog_dir = sys.argv[1]
+        output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+
+        print("=" * 60)
+        print("Building Palette Index")
+        print("=" * 60)
+
+        result = build_palette_index(
+            find_catalog_images(catalog_dir),
+            index_path=output_path,
+            root_dir=catalog_dir
+        )
+
+        if result["success"]:
+            print(f"\n✅ Index written to {result['index_path']} ({result['indexed']} products)")
+        else:
+            print(f"\n❌ Failed: {result['error']}")
+    else:
+        print("Usage: python -m image_processing.palette_index <catalog_dir> [index_path]")
@@ -0,0 +1,291 @@
+"""
+Prefork server for the image service
+The parent imports the app and warms the read-only engines (rembg session,
+scikit-learn) once, then forks worker processes that inherit them
+copy-on-write and serve a shared listening socket. The parent supervises:
+it restarts dead or hung workers, requeues their jobs and drains them on
+shutdown.
+"""
+
+import asyncio
+import fcntl
+import gc
+import mmap
+import os
+import signal
+import socket
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+import uvicorn
+
+SERVER_WORKERS = int(os.getenv("IMAGE_SERVICE_WORKERS", 1))
+# Seconds a draining worker gets to finish in-flight requests
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", 30))
+HEARTBEAT_INTERVAL_SECONDS = 1.0
+# A worker whose event loop hasn't heartbeated for this long is restarted
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT_SECONDS", 30))
+
+# pid, started_at, heartbeat_at, requests, in_flight, memory_bytes
+_SLOT = struct.Struct("qddqqq")
+
+_table = None
+_worker_index = None
+
+
+class WorkerTable:
+    """Per-worker status slots in shared memory, inherited across fork"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        # Backed by an unnamed file (rather than anonymous memory) so the
+        # workers can take a lock on it
+        self._file = tempfile.TemporaryFile()
+        self._file.truncate(_SLOT.size * workers)
+        self._memory = mmap.mmap(self._file.fileno(), _SLOT.size * workers)
+
+    def read(self, index):
+        pid, started_at, heartbeat_at, requests, in_flight, memory_bytes = _SLOT.unpack_from(
+            self._memory, index * _SLOT.size
+        )
+        return {"pid": pid, "started_at": started_at, "heartbeat_at": heartbeat_at,
+                "requests": requests, "in_flight": in_flight, "memory_bytes": memory_bytes}
+
+    def write(self, index, **fields):
+        slot = {**self.read(index), **fields}
+        _SLOT.pack_into(self._memory, index * _SLOT.size, slot["pid"], slot["started_at"],
+                        slot["heartbeat_at"], slot["requests"], slot["in_flight"],
+                        slot["memory_bytes"])
+
+    @contextmanager
+    def locked(self):
+        """Exclusive across processes; released by the kernel if the holder dies"""
+        fcntl.lockf(self._file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+
+class SharedMemoryLedger:
+    """
+    Admission-budget bytes held by every worker, so MEMORY_BUDGET_MB bounds
+    the whole instance while any one request may still use all of it
+    (plugs into MemoryBudget as its shared ledger)
+    """
+
+    def in_use(self):
+        return sum(_table.read(index)["memory_bytes"] for index in range(_table.workers))
+
+    def try_reserve(self, nbytes, capacity):
+        """Claim nbytes for this worker if the instance has room"""
+        with _table.locked():
+            if self.in_use() + nbytes > capacity:
+                return False
+            held = _table.read(_worker_index)["memory_bytes"]
+            _table.write(_worker_index, memory_bytes=held + nbytes)
+            return True
+
+    def release(self, nbytes):
+        with _table.locked():
+            held = _table.read(_worker_index)["memory_bytes"]
+            _table.write(_worker_index, memory_bytes=held - nbytes)
+
+
+def current_worker():
+    """Index of this server worker, or None when not running under prefork"""
+    return _worker_index
+
+
+def worker_status():
+    """Health of every server worker (for /health), or None when not preforked"""
+    if _table is None:
+        return None
+    now = time.time()
+    workers = []
+    for index in range(_table.workers):
+        slot = _table.read(index)
+        workers.append({
+            "index": index,
+            "pid": slot["pid"],
+            "alive": bool(slot["pid"]) and now - slot["heartbeat_at"] < HEARTBEAT_TIMEOUT_SECONDS,
+            "uptime_seconds": round(now - slot["started_at"], 1) if slot["pid"] else None,
+            "heartbeat_age_seconds": round(now - slot["heartbeat_at"], 1) if slot["pid"] else None,
+            "requests": slot["requests"],
+            "in_flight": slot["in_flight"],
+            "memory_bytes": slot["memory_bytes"]
+        })
+    return workers
+
+
+class _WorkerApp:
+    """Counts a worker's requests into its slot around the real app"""
+
+    def __init__(self, app, index):
+        self.app = app
+        self.index = index
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        slot = _table.read(self.index)
+        _table.write(self.index, requests=slot["requests"] + 1, in_flight=slot["in_flight"] + 1)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _table.write(self.index, in_flight=_table.read(self.index)["in_flight"] - 1)
+
+
+async def _heartbeat(index):
+    # Runs on the worker's event loop, so a blocked loop stops the heartbeat
+    while True:
+        _table.write(index, heartbeat_at=time.time())
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+
+
+def _run_worker(app, index, sock, log_level):
+    global _worker_index
+    _worker_index = index
+    now = time.time()
+    _table.write(index, pid=os.getpid(), started_at=now, heartbeat_at=now, requests=0, in_flight=0,
+                 memory_bytes=0)
+
+    # Undo the parent's handlers; uvicorn installs its own graceful ones
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+
+    config = uvicorn.Config(
+        _WorkerApp(app, index),
+        log_level=log_level,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS
+    )
+    server = uvicorn.Server(config)
+
+    async def serve():
+        heartbeat = asyncio.create_task(_heartbeat(index))
+        try:
+            await server.serve(sockets=[sock])
+        finally:
+            heartbeat.cancel()
+
+    asyncio.run(serve())
+
+
+def serve(app, host="0.0.0.0", port=8000, workers=SERVER_WORKERS, log_level="info",
+          on_worker_exit=None):
+    """
+    Fork workers sharing one listening socket and supervise them until SIGTERM/SIGINT
+
+    Everything the app warmed before this call is shared copy-on-write with
+    the workers, so load models first and keep threads and network clients
+    (gRPC channels, SQLite connections) out of the parent.
+
+    Args:
+        app: ASGI app, already imported and warmed
+        workers: Number of worker processes
+        on_worker_exit: Called with the pid of every worker that exits
+    """
+    global _table
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    _table = WorkerTable(workers)
+
+    # Objects that exist now are never touched by the workers' collector,
+    # which keeps it from dirtying (and un-sharing) the preloaded pages
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, index, sock, log_level)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException as e:
+                print(f"❌ Worker {index} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = {"index": index, "started": time.time()}
+        print(f"👷 Worker {index} started (pid {pid})")
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"🍴 Prefork server on {host}:{port} with {workers} workers (parent pid {os.getpid()})")
+    for index in range(workers):
+        spawn(index)
+
+    while not stopping:
+        time.sleep(HEARTBEAT_INTERVAL_SECONDS)
+
+        # Reap workers that exited and replace them
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            child = children.pop(pid, None)
+            if child is None:
+                continue
+            # Budget the dead worker held is free for the others right away
+            with _table.locked():
+                _table.write(child["index"], memory_bytes=0)
+            if not stopping:
+                print(f"⚠️ Worker {child['index']} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+            if on_worker_exit is not None:
+                on_worker_exit(pid)
+            if not stopping:
+                # Back off a worker that dies as soon as it starts
+                if time.time() - child["started"] < 5:
+                    time.sleep(1)
+                spawn(child["index"])
+
+        # Restart workers whose event loop stopped heartbeating
+        now = time.time()
+        for pid, child in list(children.items()):
+            slot = _table.read(child["index"])
+            if slot["pid"] == pid and now - slot["heartbeat_at"] > HEARTBEAT_TIMEOUT_SECONDS:
+                print(f"💀 Worker {child['index']} (pid {pid}) missed heartbeats, restarting")
+                os.kill(pid, signal.SIGKILL)
+
+    # Drain: new connections are refused once the workers close their copies
+    # of the socket; in-flight requests finish, then the workers exit
+    sock.close()
+    print(f"🛑 Draining {len(children)} workers (up to {GRACEFUL_TIMEOUT_SECONDS}s)")
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+
+    deadline = time.time() + GRACEFUL_TIMEOUT_SECONDS + 5
+    while children and time.time() < deadline:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        if children.pop(pid, None) is not None and on_worker_exit is not None:
+            on_worker_exit(pid)
+
+    for pid in children:
+        print(f"⚠️ Worker pid {pid} did not drain in time, killing")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        if on_worker_exit is not None:
+            on_worker_exit(pid)
+
+    print("👋 Prefork server stopped")
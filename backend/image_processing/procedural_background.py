@@ -0,0 +1,176 @@
+"""
+Local procedural background engine
+Renders the gradient, minimal and textured styles with NumPy in milliseconds
+and fully offline, optionally seeded from a brand palette
+"""
+
+import random
+
+import numpy as np
+from PIL import Image
+
+from image_processing.color_extraction import hex_to_rgb, get_color_brightness
+
+PROCEDURAL_STYLES = ('gradient', 'minimal', 'textured')
+
+DEFAULT_PALETTES = {
+    'gradient': ['#1d3557', '#457b9d', '#a8dadc'],
+    'minimal': ['#f4f1ec', '#d9d4cb'],
+    'textured': ['#3d405b', '#81b29a', '#f2cc8f']
+}
+
+
+def parse_palette(palette):
+    """
+    Normalize a palette to an (N, 3) float array
+
+    Accepts a comma-separated hex string, a list of hex strings, or the
+    "colors" list returned by extract_colors
+    """
+    if palette is None or len(palette) == 0:
+        return None
+
+    if isinstance(palette, np.ndarray):
+        return palette.astype(np.float32).reshape(-1, 3)
+
+    if isinstance(palette, str):
+        palette = [c.strip() for c in palette.split(",") if c.strip()]
+
+    colors = []
+    for color in palette:
+        if isinstance(color, dict):
+            color = color.get('rgb') or hex_to_rgb(color['hex'])
+        elif isinstance(color, str):
+            if len(color.lstrip('#')) != 6:
+                raise ValueError(f"Invalid hex color: {color}")
+            color = hex_to_rgb(color)
+        colors.append(color)
+
+    return np.array(colors, dtype=np.float32)
+
+
+def _apply_stops(t, colors):
+    """Map a [0, 1] field through evenly spaced color stops"""
+    if len(colors) == 1:
+        return np.broadcast_to(colors[0], t.shape + (3,)).copy()
+
+    stops = np.linspace(0, 1, len(colors))
+    return np.stack([np.interp(t, stops, colors[:, c]) for c in range(3)], axis=-1).astype(np.float32)
+
+
+def _linear_field(width, height, angle):
+    x = np.linspace(-0.5, 0.5, width, dtype=np.float32)[None, :]
+    y = np.linspace(-0.5, 0.5, height, dtype=np.float32)[:, None]
+    field = x * np.cos(angle) + y * np.sin(angle)
+    return (field - field.min()) / max(float(field.max() - field.min()), 1e-6)
+
+
+def _radial_field(width, height, cx, cy):
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    field = np.sqrt((x - cx) ** 2 + (y - cy) ** 2)
+    return np.clip(field / max(float(field.max()), 1e-6), 0, 1)
+
+
+def _value_noise(width, height, rng, octaves=4, base_cells=4):
+    """Fractal value noise: random grids upsampled bicubically and summed"""
+    noise = np.zeros((height, width), dtype=np.float32)
+    amplitude, total = 1.0, 0.0
+
+    for octave in range(octaves):
+        cells = base_cells * (2 ** octave)
+        grid = rng.random((max(2, cells * height // width), cells), dtype=np.float32)
+        layer = Image.fromarray(grid).resize((width, height), Image.Resampling.BICUBIC)
+        noise += amplitude * np.asarray(layer)
+        total += amplitude
+        amplitude *= 0.5
+
+    noise /= total
+    return (noise - noise.min()) / max(float(noise.max() - noise.min()), 1e-6)
+
+
+def _vignette(width, height, strength):
+    """Multiplicative darkening toward the corners"""
+    return 1 - strength * _radial_field(width, height, 0.5, 0.5) ** 2
+
+
+def _lighten(colors, amount):
+    return colors + (255 - colors) * amount
+
+
+def generate_procedural_background(style="gradient", width=1024, height=1024,
+                                   palette=None, seed=None, prompt=None):
+    """
+    Render a background locally
+
+    Args:
+        style: gradient, minimal or textured
+        width / height: Output size
+        palette: Brand colors (see parse_palette), defaults per style
+        seed: Makes the layout (angle, center, texture) reproducible
+        prompt: Echoed back for parity with generate_background
+
+    Returns:
+        dict with the same shape as generate_background
+    """
+    try:
+        if style not in PROCEDURAL_STYLES:
+            raise ValueError(f"Style '{style}' is not available procedurally")
+
+        if seed is None:
+            seed = random.randint(0, 2 ** 32 - 1)
+        rng = np.random.default_rng(seed)
+
+        colors = parse_palette(palette)
+        if colors is None:
+            colors = parse_palette(DEFAULT_PALETTES[style])
+        # Dark to light ramps read as intentional lighting
+        colors = colors[np.argsort([get_color_brightness(c) for c in colors])]
+
+        print(f"🧮 Rendering procedural {style} background ({width}x{height}, seed {seed})")
+
+        if style == 'gradient':
+            if rng.random() < 0.5:
+                field = _linear_field(width, height, rng.uniform(0, 2 * np.pi))
+            else:
+                field = _radial_field(width, height, *rng.uniform(0.2, 0.8, size=2))
+            pixels = _apply_stops(field, colors) * _vignette(width, height, 0.15)[..., None]
+
+        elif style == 'minimal':
+            # A whisper of the most chromatic brand color
+            tint = colors[np.argmax(colors.max(axis=1) - colors.min(axis=1))][None, :]
+            base = _lighten(tint, 0.92)
+            edge = _lighten(tint, 0.75)
+            field = _radial_field(width, height, *rng.uniform(0.4, 0.6, size=2))
+            pixels = _apply_stops(field, np.concatenate([base, edge])) * _vignette(width, height, 0.06)[..., None]
+
+        else:
+            field = _linear_field(width, height, rng.uniform(0, 2 * np.pi))
+            noise = _value_noise(width, height, rng)
+            # Noise warps where the palette ramp falls and modulates luminance
+            warped = np.clip(field * 0.6 + noise * 0.4, 0, 1)
+            grain = _value_noise(width, height, rng, octaves=2, base_cells=64)
+            pixels = _apply_stops(warped, colors) * (0.9 + 0.2 * grain)[..., None]
+            pixels *= _vignette(width, height, 0.25)[..., None]
+
+        # Sub-LSB dither hides banding in smooth gradients
+        pixels += rng.random((height, width, 1), dtype=np.float32) - 0.5
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+        return {
+            "success": True,
+            "image": image,
+            "prompt": prompt,
+            "enhanced_prompt": None,
+            "style": style,
+            "seed": seed,
+            "engine": "procedural",
+            "dimensions": {"width": width, "height": height}
+        }
+
+    except Exception as e:
+        print(f"❌ Procedural background failed: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
@@ -0,0 +1,152 @@
+"""
+Multi-rendition builder
+Decodes a source once, derives every requested size from a shared
+downscale pyramid and encodes the outputs in parallel to per-size budgets.
+With a streaming imaging backend each rendition instead shrinks straight
+from the source as it is encoded, so no full-size image is ever held.
+"""
+
+import contextvars
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from image_processing.encoding import encode_to_target, normalize_format, prepare_for_format
+from image_processing.imaging import PIL_BACKEND
+from image_processing.instrumentation import span
+
+# name: (width, height, budget_kb)
+RENDITION_PRESETS = {
+    'square': (1080, 1080, 500),
+    'story': (1080, 1920, 500),
+    'landscape': (1200, 628, 400),
+    'thumb_large': (400, 400, 80),
+    'thumb_medium': (200, 200, 40),
+    'thumb_small': (100, 100, 15)
+}
+
+DEFAULT_RENDITIONS = list(RENDITION_PRESETS)
+
+# Budget for custom WxH sizes, roughly what the presets allow per pixel
+DEFAULT_BYTES_PER_PIXEL = 0.4
+
+
+def parse_rendition_specs(sizes):
+    """
+    Parse "square,story,640x480,300x250@60" into rendition specs
+    Custom sizes are WIDTHxHEIGHT with an optional @KB budget. Names become
+    filenames, so a repeated rendition is built once and the same size with
+    two budgets is an error.
+    """
+    specs = []
+    for token in [t.strip() for t in sizes.split(",") if t.strip()]:
+        if token in RENDITION_PRESETS:
+            width, height, budget_kb = RENDITION_PRESETS[token]
+            _add_spec(specs, {"name": token, "width": width, "height": height, "budget_kb": budget_kb})
+            continue
+
+        match = re.fullmatch(r"(\d+)x(\d+)(?:@(\d+))?", token)
+        if not match:
+            raise ValueError(f"Unknown rendition: {token}")
+
+        width, height = int(match.group(1)), int(match.group(2))
+        if not (0 < width <= 4096 and 0 < height <= 4096):
+            raise ValueError(f"Rendition size out of range: {token}")
+
+        budget_kb = int(match.group(3)) if match.group(3) else \
+            max(10, round(width * height * DEFAULT_BYTES_PER_PIXEL / 1024))
+        _add_spec(specs, {"name": f"{width}x{height}", "width": width, "height": height, "budget_kb": budget_kb})
+
+    if not specs:
+        raise ValueError("No renditions requested")
+
+    return specs
+
+
+def _add_spec(specs, spec):
+    for existing in specs:
+        if existing["name"] == spec["name"]:
+            if existing != spec:
+                raise ValueError(f"Rendition {spec['name']} requested with different budgets")
+            return
+    specs.append(spec)
+
+
+def required_source_size(specs):
+    """Smallest source that covers every rendition after cropping to aspect"""
+    return (max(spec["width"] for spec in specs), max(spec["height"] for spec in specs))
+
+
+class DownscalePyramid:
+    """Halving pyramid built lazily from one decoded source"""
+
+    def __init__(self, image):
+        self.levels = [image]
+
+    def level_for(self, width, height):
+        """Smallest level that still covers width x height after cropping to aspect"""
+        while True:
+            level = self.levels[-1]
+            if level.width // 2 < width or level.height // 2 < height:
+                break
+            self.levels.append(level.reduce(2))
+
+        for level in reversed(self.levels):
+            if level.width >= width and level.height >= height:
+                return level
+        return self.levels[0]
+
+
+def build_renditions(image, specs, format='JPEG', workers=None, backend=PIL_BACKEND):
+    """
+    Build every rendition of an already-decoded image
+
+    Args:
+        image: Decoded PIL image, or an image loaded by backend
+        specs: Output of parse_rendition_specs
+        format: Output format for all renditions
+        workers: Encode thread count (default: one per rendition, capped at CPU count)
+        backend: Imaging backend that loaded image
+
+    Returns:
+        List of per-rendition results (encoded bytes plus metadata), in spec order
+    """
+    format = normalize_format(format)
+    if backend.streaming:
+        sources = [image] * len(specs)
+    else:
+        sources = _pyramid_sources(image, specs, format)
+
+    def render(spec, source):
+        # Streaming backends only record the resize here; it runs in the encode
+        with span("resize"):
+            fitted = backend.fit(source, (spec["width"], spec["height"]))
+        # Renditions keep their exact size, so only quality is searched
+        with span("encode"):
+            result = encode_to_target(fitted, spec["budget_kb"], format, min_scale=1.0, backend=backend)
+        return {**spec, **result}
+
+    workers = workers or min(len(specs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Each call runs in a copy of the caller's context so its spans are kept
+        futures = [
+            pool.submit(contextvars.copy_context().run, render, spec, source)
+            for spec, source in zip(specs, sources)
+        ]
+        return [future.result() for future in futures]
+
+
+def _pyramid_sources(image, specs, format):
+    """Pyramid level each rendition of a PIL image is resized from"""
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    if format == 'JPEG' or not has_alpha:
+        # Flattened onto white once here instead of once per rendition
+        image = prepare_for_format(image, 'JPEG')
+        target_mode = 'RGB'
+    else:
+        target_mode = 'RGBA'
+    if image.mode != target_mode:
+        image = image.convert(target_mode)
+
+    # Build all pyramid levels up front so worker threads only read from them
+    pyramid = DownscalePyramid(image)
+    return [pyramid.level_for(spec["width"], spec["height"]) for spec in specs]
@@ -0,0 +1,111 @@
+"""
+Long-lived Stability AI client
+Holds a small pool of gRPC channels created once per process, runs blocking
+generations on a bounded executor so concurrent requests don't serialize,
+and retries transient failures with exponential backoff
+"""
+
+import asyncio
+import contextvars
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from image_processing.engines import load_module
+
+STABILITY_HOST = os.getenv("STABILITY_HOST", "grpc.stability.ai:443")
+STABILITY_ENGINE = os.getenv("STABILITY_ENGINE", "stable-diffusion-xl-1024-v1-0")
+STABILITY_CHANNELS = int(os.getenv("STABILITY_CHANNELS", 2))
+STABILITY_MAX_CONCURRENCY = int(os.getenv("STABILITY_MAX_CONCURRENCY", 8))
+STABILITY_TIMEOUT_SECONDS = float(os.getenv("STABILITY_TIMEOUT_SECONDS", 60))
+STABILITY_RETRIES = int(os.getenv("STABILITY_RETRIES", 2))
+STABILITY_BACKOFF_SECONDS = float(os.getenv("STABILITY_BACKOFF_SECONDS", 1.0))
+
+# Failures worth retrying; everything else (auth, bad request) fails fast.
+# grpc.StatusCode names, so grpc itself is only imported with the SDK
+RETRYABLE_CODES = (
+    "UNAVAILABLE",
+    "DEADLINE_EXCEEDED",
+    "RESOURCE_EXHAUSTED",
+    "ABORTED"
+)
+
+
+class StabilityClientPool:
+    """Round-robin pool of StabilityInference clients, one gRPC channel each"""
+
+    def __init__(self, api_key, host=STABILITY_HOST, engine=STABILITY_ENGINE,
+                 size=STABILITY_CHANNELS, timeout=STABILITY_TIMEOUT_SECONDS):
+        self.host = host
+        self.engine = engine
+        self.clients = []
+        client = load_module("stability_sdk.client")
+        for _ in range(max(1, size)):
+            stability_api = client.StabilityInference(host=host, key=api_key, engine=engine)
+            # Passed through to every Generate call as its gRPC deadline
+            stability_api.grpc_args["timeout"] = timeout
+            self.clients.append(stability_api)
+        self._next = itertools.count()
+
+    def get(self):
+        return self.clients[next(self._next) % len(self.clients)]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_executor = ThreadPoolExecutor(
+    max_workers=STABILITY_MAX_CONCURRENCY,
+    thread_name_prefix="stability"
+)
+
+
+def init_stability_pool():
+    """Create the shared client pool (called at startup, or lazily on first use)"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            api_key = os.getenv('STABILITY_API_KEY')
+            if not api_key and STABILITY_HOST.endswith("443"):
+                raise ValueError("STABILITY_API_KEY not found in environment")
+
+            _pool = StabilityClientPool(api_key or "")
+            print(f"🔌 Stability client ready ({len(_pool.clients)} channels to {_pool.host})")
+
+    return _pool
+
+
+def get_stability_client():
+    return (_pool or init_stability_pool()).get()
+
+
+def is_retryable(error):
+    grpc = load_module("grpc")
+    return isinstance(error, grpc.RpcError) and error.code().name in RETRYABLE_CODES
+
+
+def call_with_retries(fn, retries=STABILITY_RETRIES, backoff=STABILITY_BACKOFF_SECONDS):
+    """Call fn, retrying transient gRPC errors with exponential backoff and jitter"""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            print(f"⚠️ Stability call failed ({e.code().name}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def submit_to_stability_executor(fn, *args, **kwargs):
+    """Submit a blocking generation to the bounded Stability executor"""
+    # Carry the caller's context so the request's stage spans see the work
+    return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+async def run_in_stability_executor(fn, *args, **kwargs):
+    """Await a blocking generation on the bounded Stability executor"""
+    return await asyncio.wrap_future(submit_to_stability_executor(fn, *args, **kwargs))
@@ -0,0 +1,108 @@
+"""
+Local stub of the Stability gRPC generation service
+Returns a cheap seeded gradient instead of calling SDXL, so background
+generation can be exercised offline:
+
+    python -m image_processing.stability_stub --port 50051
+    STABILITY_HOST=localhost:50051 python image-service.py
+
+Set STUB_DELAY_SECONDS to simulate generation latency and STUB_FAIL_FIRST
+to make the first N calls fail with UNAVAILABLE (exercises retries).
+Prompts containing "nsfw" come back safety-filtered.
+"""
+
+import argparse
+import io
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent import futures
+
+import grpc
+import numpy as np
+from PIL import Image
+import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+import stability_sdk.interfaces.gooseai.generation.generation_pb2_grpc as generation_grpc
+
+
+class StubGenerationService(generation_grpc.GenerationServiceServicer):
+    def __init__(self, delay_seconds=0.0, fail_first=0):
+        self.delay_seconds = delay_seconds
+        self.fail_first = fail_first
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def Generate(self, request, context):
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+
+        if call_number <= self.fail_first:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "stub: simulated outage")
+
+        time.sleep(self.delay_seconds)
+
+        prompt = " ".join(p.text for p in request.prompt)
+        seed = request.image.seed[0] if request.image.seed else random.randint(0, 2 ** 32 - 1)
+        width = request.image.width or 1024
+        height = request.image.height or 1024
+
+        if "nsfw" in prompt.lower():
+            artifact = generation.Artifact(
+                type=generation.ARTIFACT_IMAGE,
+                finish_reason=generation.FILTER,
+                seed=seed
+            )
+        else:
+            artifact = generation.Artifact(
+                id=1,
+                type=generation.ARTIFACT_IMAGE,
+                mime="image/png",
+                binary=render_stub_image(width, height, seed),
+                finish_reason=generation.NULL,
+                seed=seed
+            )
+
+        yield generation.Answer(
+            answer_id=str(uuid.uuid4()),
+            request_id=request.request_id,
+            artifacts=[artifact]
+        )
+
+
+def render_stub_image(width, height, seed):
+    """Two-color diagonal gradient picked from the seed"""
+    rng = np.random.default_rng(seed)
+    start, end = rng.integers(0, 256, size=(2, 3))
+    t = (np.linspace(0, 1, width)[None, :] + np.linspace(0, 1, height)[:, None]) / 2
+    pixels = start + (end - start) * t[..., None]
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8), 'RGB').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def start_stub_server(port=50051, delay_seconds=0.0, fail_first=0):
+    """Start the stub in a background thread pool; returns (server, servicer)"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    servicer = StubGenerationService(delay_seconds, fail_first)
+    generation_grpc.add_GenerationServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+    return server, servicer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Stability gRPC server")
+    parser.add_argument("--port", type=int, default=50051)
+    args = parser.parse_args()
+
+    server, _ = start_stub_server(
+        args.port,
+        delay_seconds=float(os.getenv("STUB_DELAY_SECONDS", 0)),
+        fail_first=int(os.getenv("STUB_FAIL_FIRST", 0))
+    )
+    print(f"🧪 Stub Stability server listening on localhost:{args.port}")
+    server.wait_for_termination()
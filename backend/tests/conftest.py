@@ -0,0 +1,25 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# image_processing is imported from the backend directory, like the services do
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "ai-engine", "compliance"))
+
+
+@pytest.fixture(scope="session")
+def image_service(tmp_path_factory):
+    """image-service.py loaded as a module, with its temp/ and data/ in a scratch directory"""
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("image-service"))
+    try:
+        spec = importlib.util.spec_from_file_location("image_service", os.path.join(BACKEND_DIR, "image-service.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+    finally:
+        os.chdir(previous)
@@ -0,0 +1,106 @@
+"""Pixel checks on rendered creatives: text contrast, safe zones and packshot coverage"""
+
+from PIL import Image, ImageDraw
+
+from image_processing.compliance_analysis import analyze_creative
+
+
+def _text_render(text_color, background_color, size=(400, 200), box=(100, 60, 300, 140)):
+    """Canvas with glyph-like strokes inside box"""
+    image = Image.new("RGB", size, background_color)
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = box
+    for x in range(left + 10, right - 10, 16):
+        draw.rectangle((x, top + 10, x + 5, bottom - 10), fill=text_color)
+    return image
+
+
+def _text_creative(fill, background_color, box=(100, 60, 300, 140)):
+    left, top, right, bottom = box
+    return {
+        "backgroundColor": background_color,
+        "elements": [{
+            "type": "text", "left": left, "top": top, "width": right - left,
+            "height": bottom - top, "fill": fill, "fontSize": 16
+        }]
+    }
+
+
+def test_dark_text_on_light_background_passes():
+    result = analyze_creative(_text_render("#111111", "#ffffff"), _text_creative("#111111", "#ffffff"))
+
+    assert result["success"]
+    assert result["passed"]
+    assert result["contrast"][0]["passed"]
+    assert result["contrast"][0]["contrast"] > 15
+
+
+def test_low_contrast_text_fails():
+    result = analyze_creative(_text_render("#bbbbbb", "#ffffff"), _text_creative("#bbbbbb", "#ffffff"))
+
+    assert not result["passed"]
+    assert not result["contrast"][0]["passed"]
+    assert result["contrast"][0]["contrast"] < 4.5
+
+
+def test_text_matching_the_background_fails_instead_of_being_dropped():
+    # Within COLOR_TOLERANCE of the canvas, every pixel counts as text
+    image = _text_render("#ffffff", "#f8f8f8")
+    result = analyze_creative(image, _text_creative("#ffffff", "#f8f8f8"))
+
+    assert len(result["contrast"]) == 1
+    assert result["contrast"][0]["contrast"] < 1.1
+    assert not result["contrast"][0]["passed"]
+    assert not result["passed"]
+
+
+def test_uniform_region_without_fill_fails():
+    image = Image.new("RGB", (400, 200), "#f8f8f8")
+    creative = _text_creative(None, "#f8f8f8")
+
+    result = analyze_creative(image, creative)
+
+    assert len(result["contrast"]) == 1
+    assert not result["contrast"][0]["passed"]
+
+
+def test_content_in_story_safe_zone_fails():
+    image = Image.new("RGB", (1080, 1920), "#ffffff")
+    ImageDraw.Draw(image).rectangle((300, 50, 780, 150), fill="#0055aa")
+    creative = {"format": "instagram_story", "backgroundColor": "#ffffff", "elements": []}
+
+    result = analyze_creative(image, creative)
+
+    zones = {zone["zone"]: zone for zone in result["safe_zones"]}
+    assert not zones["top"]["passed"]
+    assert zones["top"]["content_pixels"] == 481 * 101
+    assert zones["bottom"]["passed"]
+    assert not result["passed"]
+
+
+def test_background_layer_is_not_content():
+    image = Image.new("RGB", (1080, 1920), "#336699")
+    creative = {
+        "format": "instagram_story",
+        "backgroundColor": "#ffffff",
+        "elements": [{"type": "image", "left": 0, "top": 0, "width": 1080, "height": 1920, "isBackground": True}]
+    }
+
+    result = analyze_creative(image, creative)
+
+    assert all(zone["passed"] for zone in result["safe_zones"])
+    assert result["coverage"]["content_ratio"] == 0
+
+
+def test_packshot_coverage():
+    image = Image.new("RGBA", (400, 400), (0, 0, 0, 0))
+    # Product fills the left half of its 200x200 box
+    image.paste((200, 40, 40, 255), (100, 100, 200, 300))
+    creative = {"elements": [{"type": "image", "isPackshot": True, "left": 100, "top": 100, "width": 200, "height": 200}]}
+
+    result = analyze_creative(image, creative)
+
+    packshot = result["coverage"]["packshots"][0]
+    assert packshot["fill_ratio"] == 0.5
+    assert result["coverage"]["product_ratio"] == 0.125
+    assert result["content_mask"] == "alpha"
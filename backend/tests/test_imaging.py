@@ -0,0 +1,122 @@
+"""Both imaging backends must give the same results through the shared encode paths"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_processing.encoding import encode_to_target
+from image_processing.imaging import PIL_BACKEND
+from image_processing.renditions import build_renditions, parse_rendition_specs
+
+
+def _vips_backend():
+    pytest.importorskip("pyvips")
+    from image_processing.imaging import VipsBackend
+    return VipsBackend()
+
+
+@pytest.fixture(params=["pil", "vips"])
+def backend(request):
+    return PIL_BACKEND if request.param == "pil" else _vips_backend()
+
+
+@pytest.fixture(scope="module")
+def photo_path(tmp_path_factory):
+    """1600x1200 noisy gradient JPEG: too detailed for small budgets at high quality"""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 190, 1600, dtype=np.float32)[None, :, None]
+    pixels = (rng.random((1200, 1600, 3), dtype=np.float32) * 60 + gradient).astype(np.uint8)
+    path = tmp_path_factory.mktemp("imaging") / "photo.jpg"
+    Image.fromarray(pixels).save(path, quality=92)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def cutout_path(tmp_path_factory):
+    """800x600 red product on a transparent canvas"""
+    image = Image.new("RGBA", (800, 600), (0, 0, 0, 0))
+    image.paste((220, 30, 30, 255), (200, 150, 600, 450))
+    path = tmp_path_factory.mktemp("imaging") / "cutout.png"
+    image.save(path)
+    return str(path)
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def test_quality_search_fits_budget_at_full_size(backend, photo_path):
+    result = encode_to_target(backend.load(photo_path), 250, "JPEG", backend=backend)
+
+    assert result["success"]
+    assert len(result["data"]) <= 250 * 1024
+    assert 60 <= result["quality"] < 95
+    assert result["dimensions"] == {"width": 1600, "height": 1200}
+    assert decode(result["data"]).size == (1600, 1200)
+
+
+def test_scale_search_downsizes_when_quality_is_not_enough(backend, photo_path):
+    result = encode_to_target(backend.load(photo_path), 150, "JPEG", backend=backend)
+
+    assert result["success"]
+    assert len(result["data"]) <= 150 * 1024
+    assert result["quality"] == 85
+    width, height = result["dimensions"]["width"], result["dimensions"]["height"]
+    assert 800 <= width < 1600 and 600 <= height < 1200
+    assert decode(result["data"]).size == (width, height)
+
+
+def test_unreachable_target_fails(backend, photo_path):
+    result = encode_to_target(backend.load(photo_path), 1, "JPEG", backend=backend)
+
+    assert not result["success"]
+
+
+def test_renditions_have_exact_sizes(backend, photo_path):
+    specs = parse_rendition_specs("square,landscape,thumb_small,300x50")
+    results = build_renditions(backend.load(photo_path), specs, "JPEG", workers=2, backend=backend)
+
+    for spec, result in zip(specs, results):
+        assert result["success"]
+        assert len(result["data"]) <= spec["budget_kb"] * 1024
+        assert decode(result["data"]).size == (spec["width"], spec["height"])
+
+
+def test_png_renditions_keep_alpha(backend, cutout_path):
+    specs = parse_rendition_specs("400x300")
+    [result] = build_renditions(backend.load(cutout_path), specs, "PNG", backend=backend)
+
+    image = decode(result["data"])
+    assert image.mode == "RGBA"
+    assert image.getpixel((0, 0))[3] == 0
+    assert image.getpixel((200, 150)) == (220, 30, 30, 255)
+
+
+def test_jpeg_renditions_flatten_onto_white(backend, cutout_path):
+    specs = parse_rendition_specs("400x300")
+    [result] = build_renditions(backend.load(cutout_path), specs, "JPEG", backend=backend)
+
+    image = decode(result["data"])
+    assert image.mode == "RGB"
+    assert all(channel >= 250 for channel in image.getpixel((5, 5)))
+    red, green, blue = image.getpixel((200, 150))
+    assert red > 200 and green < 60 and blue < 60
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_thumbnail_fits_within_max_size(backend, photo_path, mode):
+    thumbnail = backend.thumbnail(photo_path, (300, 300), mode)
+
+    assert thumbnail.mode == mode
+    assert thumbnail.size == (300, 225)
+
+
+def test_thumbnail_drops_alpha(backend, cutout_path):
+    thumbnail = backend.thumbnail(cutout_path, (200, 200))
+
+    assert thumbnail.mode == "RGB"
+    assert thumbnail.size == (200, 150)
@@ -0,0 +1,82 @@
+"""Uploads to S3, against moto's in-process stand-in"""
+
+import io
+
+import pytest
+from PIL import Image
+
+moto = pytest.importorskip("moto")
+pytest.importorskip("boto3")
+
+from image_processing import delivery, object_store
+
+BUCKET = "test-output"
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setattr(object_store, "S3_OUTPUT_BUCKET", BUCKET)
+    monkeypatch.setattr(delivery, "S3_OUTPUT_BUCKET", BUCKET)
+    monkeypatch.setattr(object_store, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(object_store, "S3_ENDPOINT_URL", None)
+    # S3's smallest part is 5MB
+    monkeypatch.setattr(object_store, "S3_MULTIPART_THRESHOLD_BYTES", 5 * MB)
+    monkeypatch.setattr(object_store, "S3_MULTIPART_CHUNK_BYTES", 5 * MB)
+    monkeypatch.setattr(object_store, "_client", None)
+
+    with moto.mock_aws():
+        client = object_store.get_s3_client()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_small_upload_is_single_part(s3):
+    result = object_store.upload_bytes(b"x" * 100, "small.png", "image/png")
+
+    head = s3.head_object(Bucket=BUCKET, Key=result["key"])
+    assert head["ContentLength"] == 100
+    assert head["ContentType"] == "image/png"
+    assert "-" not in head["ETag"]
+    assert result["key"].startswith(object_store.S3_OUTPUT_PREFIX)
+    assert result["key"].endswith("/small.png")
+
+
+def test_upload_above_threshold_is_multipart(s3):
+    data = bytes(range(256)) * (12 * MB // 256)
+    result = object_store.upload_bytes(data, "big.bin", "application/octet-stream")
+
+    head = s3.head_object(Bucket=BUCKET, Key=result["key"])
+    # Multipart ETags end in -<part count>
+    assert head["ETag"].strip('"').endswith("-3")
+    assert s3.get_object(Bucket=BUCKET, Key=result["key"])["Body"].read() == data
+
+
+def test_presigned_url_follows_setting(s3, monkeypatch):
+    result = object_store.upload_bytes(b"x", "signed.png", "image/png")
+    assert result["url"] and result["key"] in result["url"]
+
+    monkeypatch.setattr(object_store, "S3_PRESIGN_SECONDS", 0)
+    result = object_store.upload_bytes(b"x", "unsigned.png", "image/png")
+    assert result["url"] is None
+
+
+def test_optimize_delivers_to_s3(s3, image_service):
+    from fastapi.testclient import TestClient
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(buffer, "JPEG")
+
+    with TestClient(image_service.app) as client:
+        response = client.post(
+            "/process/optimize?delivery=s3",
+            files={"file": ("a.jpg", buffer.getvalue(), "image/jpeg")}
+        )
+
+    assert response.status_code == 200
+    [uploaded] = response.json()["objects"]
+    assert uploaded["content_type"] == "image/jpeg"
+    body = s3.get_object(Bucket=BUCKET, Key=uploaded["key"])["Body"].read()
+    assert Image.open(io.BytesIO(body)).size == (64, 48)
@@ -0,0 +1,74 @@
+"""Semantic cache reuse: harmless rewording hits, claim-changing edits miss"""
+
+import pytest
+
+from semantic_cache import SemanticCache
+
+COMPLIANT = {"label": "allowed", "confidence": 0.95, "compliant": True}
+
+# (compliant original, edit that makes it violate)
+CLAIM_EDITS = [
+    ("Fresh orange juice available now", "Fresh orange juice available now, cures hangovers"),
+    ("Fresh orange juice available now", "Clinically proven fresh orange juice available now"),
+    ("This juice does contain added sugar", "This juice does not contain added sugar"),
+    ("Great value orange juice at Tesco", "Great value orange juice at Tesco, guaranteed best price"),
+]
+
+REWORDINGS = [
+    ("Shop today", "Shop now"),
+    ("Fresh orange juice available now at Tesco", "Fresh orange juice - available now at the Tesco!"),
+    ("Buy our juice today", "Shop juice now"),
+]
+
+
+@pytest.mark.parametrize("original, edited", CLAIM_EDITS)
+def test_edit_adding_words_is_not_reused(original, edited):
+    cache = SemanticCache(size=16)
+    cache.add(original, COMPLIANT)
+
+    assert cache.lookup(edited) == (None, None)
+
+
+@pytest.mark.parametrize("original, edited", CLAIM_EDITS)
+def test_claim_edits_miss_even_at_the_old_threshold(original, edited):
+    cache = SemanticCache(size=16, threshold=0.8)
+    cache.add(original, COMPLIANT)
+
+    assert cache.lookup(edited) == (None, None)
+
+
+def test_dropping_a_word_is_not_reused_by_default():
+    cache = SemanticCache(size=16)
+    cache.add("Clinically proven fresh orange juice", {"label": "health_claim", "confidence": 0.9})
+
+    assert cache.lookup("Fresh orange juice") == (None, None)
+
+
+@pytest.mark.parametrize("original, edited", REWORDINGS)
+def test_rewording_is_reused(original, edited):
+    cache = SemanticCache(size=16)
+    cache.add(original, COMPLIANT)
+
+    result, match = cache.lookup(edited)
+    assert result == COMPLIANT
+    assert match["match"] == "semantic"
+    assert match["cached_text"] == original
+
+
+def test_punctuation_and_case_hit_exactly():
+    cache = SemanticCache(size=16)
+    cache.add("Fresh orange juice", COMPLIANT)
+
+    result, match = cache.lookup("FRESH orange juice!!")
+    assert result == COMPLIANT
+    assert match["match"] == "exact"
+
+
+def test_oldest_entry_is_evicted():
+    cache = SemanticCache(size=2)
+    for text in ("Fresh orange juice", "Crisp green apples", "Ripe yellow bananas"):
+        cache.add(text, COMPLIANT)
+
+    assert cache.lookup("Fresh orange juice") == (None, None)
+    assert cache.lookup("Ripe yellow bananas")[0] == COMPLIANT
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,101 @@
+"""Background generation against the local Stability stub: retries, safety filter, seeds, concurrency"""
+
+import asyncio
+import functools
+import socket
+import time
+
+import pytest
+
+pytest.importorskip("stability_sdk")
+
+from image_processing import background_generation, stability_client
+from image_processing.stability_stub import start_stub_server
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Start a stub server and point the shared client pool at it; call with stub options"""
+    servers = []
+
+    def start(**options):
+        port = _free_port()
+        server, servicer = start_stub_server(port, **options)
+        servers.append(server)
+        monkeypatch.setattr(stability_client, "_pool",
+                            stability_client.StabilityClientPool("", host=f"localhost:{port}"))
+        return servicer
+
+    # Retry after milliseconds rather than STABILITY_BACKOFF_SECONDS
+    monkeypatch.setattr(background_generation, "call_with_retries",
+                        functools.partial(stability_client.call_with_retries, backoff=0.01))
+    yield start
+    for server in servers:
+        server.stop(None)
+
+
+def test_unavailable_is_retried(stub):
+    servicer = stub(fail_first=1)
+
+    result = background_generation.generate_background("sunlit kitchen counter", width=256, height=256)
+
+    assert result["success"], result.get("error")
+    assert result["image"].size == (256, 256)
+    assert servicer.calls == 2
+
+
+def test_outage_beyond_retries_fails(stub):
+    servicer = stub(fail_first=stability_client.STABILITY_RETRIES + 1)
+
+    result = background_generation.generate_background("sunlit kitchen counter", width=256, height=256)
+
+    assert not result["success"]
+    assert servicer.calls == stability_client.STABILITY_RETRIES + 1
+
+
+def test_safety_filter_is_reported(stub):
+    servicer = stub()
+
+    result = background_generation.generate_background("nsfw poster", width=256, height=256)
+
+    assert not result["success"]
+    assert "filtered" in result["error"]
+    # A filtered answer is final, not retried
+    assert servicer.calls == 1
+
+
+def test_seed_passes_through(stub):
+    stub()
+
+    first = background_generation.generate_background("marble surface", width=256, height=256, seed=1234)
+    second = background_generation.generate_background("marble surface", width=256, height=256, seed=1234)
+
+    assert first["seed"] == second["seed"] == 1234
+    assert first["image"].tobytes() == second["image"].tobytes()
+
+
+def test_concurrent_generations_overlap(stub):
+    delay = 0.3
+    servicer = stub(delay_seconds=delay)
+    count = 4
+
+    async def generate_all():
+        return await asyncio.gather(*(
+            background_generation.generate_background_async(f"studio backdrop {i}", width=256, height=256)
+            for i in range(count)
+        ))
+
+    started = time.perf_counter()
+    results = asyncio.run(generate_all())
+    elapsed = time.perf_counter() - started
+
+    assert all(result["success"] for result in results)
+    assert servicer.calls == count
+    # Serialized calls would take count * delay
+    assert elapsed < delay * count / 2